@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2013 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure HTTP Basic authenticated API requests per second.
+
+Runs /api/test against a throwaway instance, with and without the
+credential cache of the httpapiauth plugin:
+
+  ./devtools/httpapiauth_benchmark.py --requests 200
+"""
+
+import argparse
+import base64
+import os
+import shutil
+import tempfile
+import time
+
+from webtest import TestApp
+
+CONFIG = """\
+[mediagoblin]
+sql_engine = "sqlite://"
+run_migrations = true
+
+[storage:publicstore]
+base_dir = %(here)s/media/public
+base_url = /mgoblin_media/
+
+[storage:queuestore]
+base_dir = %(here)s/media/queue
+
+[plugins]
+[[mediagoblin.plugins.api]]
+[[mediagoblin.plugins.httpapiauth]]
+[[mediagoblin.plugins.basic_auth]]
+"""
+
+
+def make_app(directory):
+    from mediagoblin.app import MediaGoblinApp
+    from mediagoblin.db.models import User
+    from mediagoblin.plugins.basic_auth.tools import bcrypt_gen_password_hash
+
+    config_path = os.path.join(directory, 'mediagoblin.ini')
+    with open(config_path, 'w') as config_file:
+        config_file.write(CONFIG)
+
+    app = MediaGoblinApp(config_path, setup_celery=False)
+    user = User(username=u'benchmark', email=u'benchmark@example.org',
+                pw_hash=bcrypt_gen_password_hash(u'benchmark'),
+                status=u'active', email_verified=True)
+    user.save()
+    return TestApp(app)
+
+
+def run(test_app, requests):
+    headers = {'Authorization': 'Basic ' + base64.b64encode(
+        'benchmark:benchmark')}
+    start = time.time()
+    for i in xrange(requests):
+        test_app.get('/api/test', headers=headers)
+    return requests / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        test_app = make_app(directory)
+
+        from mediagoblin.plugins.httpapiauth import http_auth
+        credentials = http_auth.credentials
+
+        http_auth.credentials = None
+        print '%-16s %8.1f requests/s' % (
+            'without cache', run(test_app, args.requests))
+
+        http_auth.credentials = credentials
+        print '%-16s %8.1f requests/s' % (
+            'with cache', run(test_app, args.requests))
+        print 'cache: %(hits)d hits, %(misses)d misses' % credentials.stats()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2013 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure markdown conversions per second for different numbers of threads.
+
+Compares the per-thread converters of cleaned_markdown_conversion with
+one converter shared under a lock, the only safe way to share one:
+
+  ./devtools/markdown_benchmark.py --threads 1 2 4 8
+"""
+
+import argparse
+import threading
+import time
+
+import markdown
+
+from mediagoblin.tools import text
+
+
+COMMENT = u"""\
+Nice *picture*!  The [colours][1] remind me of **that** one by
+[someone else](http://example.org/someone/else).
+
+> Quoting the description: it was a
+> sunny day.
+
+ * one
+ * two
+
+[1]: http://example.org/colours
+"""
+
+_shared = markdown.Markdown()
+_shared_lock = threading.Lock()
+
+
+def shared_conversion(source):
+    with _shared_lock:
+        html = _shared.reset().convert(source)
+    return text.clean_html(html)
+
+
+def run(convert, thread_count, conversions):
+    per_thread = conversions // thread_count
+
+    def work():
+        for i in xrange(per_thread):
+            convert(COMMENT)
+
+    threads = [threading.Thread(target=work) for i in range(thread_count)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_thread * thread_count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--conversions', type=int, default=4000)
+    args = parser.parse_args()
+
+    print '%7s %16s %16s' % ('threads', 'shared+lock/s', 'per-thread/s')
+    for thread_count in args.threads:
+        print '%7d %16.0f %16.0f' % (
+            thread_count,
+            run(shared_conversion, thread_count, args.conversions),
+            run(text.cleaned_markdown_conversion, thread_count,
+                args.conversions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2013 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time the audio spectrogram, drawn column by column and batched.
+
+Runs on generated noise, so neither audiolab nor gstreamer are needed:
+
+  ./devtools/spectrogram_benchmark.py --minutes 60
+"""
+
+import argparse
+import imp
+import os
+import time
+
+import numpy
+
+# Load the module on its own: importing the audio media type needs gstreamer
+spectrogram = imp.load_source(
+    'spectrogram',
+    os.path.join(os.path.dirname(__file__), os.pardir,
+                 'mediagoblin', 'media_types', 'audio', 'spectrogram.py'))
+
+
+class NoiseFile(object):
+    """Mimics audiolab.Sndfile"""
+    def __init__(self, nframes, samplerate=44100):
+        self.nframes = nframes
+        self.samplerate = samplerate
+        self.channels = 1
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def read_frames(self, frames):
+        frames = min(frames, self.nframes - self.position)
+        self.position += frames
+        return numpy.random.uniform(-1, 1, frames)
+
+    def close(self):
+        pass
+
+
+def column_by_column(processor, image):
+    """ the way the spectrogram used to be drawn """
+    samples_per_pixel = processor.audio_file.nframes / float(image.image_width)
+    pixels = []
+    for x in range(image.image_width):
+        spectral_centroid, db_spectrum = processor.spectral_centroid(
+            int(x * samples_per_pixel))
+        for index, alpha in image.y_to_bin:
+            pixels.append(image.palette[int(
+                (255.0 - alpha) * db_spectrum[index]
+                + alpha * db_spectrum[index + 1])])
+        for y in range(len(image.y_to_bin), image.image_height):
+            pixels.append(image.palette[0])
+
+    result = spectrogram.Image.new(
+        'RGBA', (image.image_height, image.image_width))
+    result.putdata(pixels)
+    return result.transpose(spectrogram.Image.ROTATE_90)
+
+
+def batched(processor, image):
+    samples_per_pixel = processor.audio_file.nframes / float(image.image_width)
+    seek_points = (numpy.arange(image.image_width)
+                   * samples_per_pixel).astype(numpy.intp)
+    for x, db_spectra in processor.db_spectra(seek_points):
+        image.draw_spectra(x, db_spectra)
+
+    return spectrogram.Image.fromarray(image.pixels, 'RGBA').transpose(
+        spectrogram.Image.ROTATE_90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=192)
+    parser.add_argument('--fft-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    nframes = int(args.minutes * 60 * 44100)
+
+    class audiolab(object):
+        Sndfile = staticmethod(lambda filename, mode: NoiseFile(nframes))
+
+    spectrogram.audiolab = audiolab
+    processor = spectrogram.AudioProcessor('noise', args.fft_size)
+
+    for name, draw in [('column by column', column_by_column),
+                       ('batched', batched)]:
+        image = spectrogram.SpectrogramImage(
+            (args.width, args.height), args.fft_size)
+        start = time.time()
+        draw(processor, image)
+        print '%-16s %8.3fs' % (name, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@ from werkzeug.exceptions import Forbidden
 
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.decorators import require_active_login
+from mediagoblin.processing import get_progress_sink
 from mediagoblin.tools.response import render_to_response
 
 @require_active_login
@@ -30,7 +31,7 @@ def admin_processing_panel(request):
         raise Forbidden()
 
     processing_entries = MediaEntry.query.filter_by(state = u'processing').\
-        order_by(MediaEntry.created.desc())
+        order_by(MediaEntry.created.desc()).all()
 
     # Get media entries which have failed to process
     failed_entries = MediaEntry.query.filter_by(state = u'failed').\
@@ -44,5 +45,7 @@ def admin_processing_panel(request):
         request,
         'mediagoblin/admin/panel.html',
         {'processing_entries': processing_entries,
+         'progress': get_progress_sink().get(
+             [entry.id for entry in processing_entries]),
          'failed_entries': failed_entries,
          'processed_entries': processed_entries})
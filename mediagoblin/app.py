@@ -35,7 +35,7 @@ from mediagoblin.init.celery import setup_celery_from_config
 from mediagoblin.init.plugins import setup_plugins
 from mediagoblin.init import (get_jinja_loader, get_staticdirector,
     setup_global_and_app_config, setup_locales, setup_workbench, setup_database,
-    setup_storage)
+    setup_storage, setup_cache)
 from mediagoblin.tools.pluginapi import PluginManager, hook_transform
 from mediagoblin.tools.crypto import setup_crypto
 from mediagoblin.auth.tools import check_auth_enabled, no_auth_logout
@@ -109,6 +109,9 @@ class MediaGoblinApp(object):
         # Set up storage systems
         self.public_store, self.queue_store = setup_storage()
 
+        # Set up the page cache
+        self.cache = setup_cache()
+
         # set up routing
         self.url_map = get_url_map()
 
@@ -176,6 +179,7 @@ class MediaGoblinApp(object):
         request.app = self
 
         request.db = self.db
+        request.lookups = mg_request.RequestLookups()
         request.staticdirect = self.staticdirector
 
         request.locale = translate.get_locale_from_request(request)
@@ -255,6 +259,12 @@ class MediaGoblinApp(object):
         ## If more errors happen that look like unclean sessions:
         # self.db.check_session_clean()
 
+        counter = self.db.query_counter
+        if counter is not None:
+            counter.reset()
+            start_response = _counting_start_response(
+                environ, start_response, counter)
+
         try:
             return self.call_backend(environ, start_response)
         finally:
@@ -263,6 +273,20 @@ class MediaGoblinApp(object):
             self.db.reset_after_request()
 
 
+def _counting_start_response(environ, start_response, counter):
+    """
+    Wrap start_response to log the number of sql queries of the request
+    and add them as a header
+    """
+    def counting_start_response(status, headers, exc_info=None):
+        _log.debug("%s %s: %d sql queries", environ.get('REQUEST_METHOD'),
+                   environ.get('PATH_INFO'), counter.count)
+        headers = list(headers)
+        headers.append(('X-MediaGoblin-Queries', str(counter.count)))
+        return start_response(status, headers, exc_info)
+    return counting_start_response
+
+
 def paste_app_factory(global_config, **app_config):
     configs = app_config['config'].split()
     mediagoblin_config = None
@@ -19,10 +19,10 @@ import uuid
 
 from sqlalchemy import (MetaData, Table, Column, Boolean, SmallInteger,
                         Integer, Unicode, UnicodeText, DateTime,
-                        ForeignKey)
+                        ForeignKey, Index)
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import and_
+from sqlalchemy.sql import and_, func, select
 from migrate.changeset.constraint import UniqueConstraint
 
 
@@ -474,3 +474,113 @@ def wants_notifications(db):
     col.create(user_table)
 
     db.commit()
+
+
+@RegisterMigration(16, MIGRATIONS)
+def add_upload_hash(db):
+    """Add an indexed upload_hash field to MediaEntry"""
+    metadata = MetaData(bind=db.bind)
+    media_entry_table = inspect_table(metadata, "core__media_entries")
+
+    col = Column('upload_hash', Unicode)
+    col.create(media_entry_table)
+
+    Index('ix_core__media_entries_upload_hash',
+          media_entry_table.c.upload_hash).create(db.bind)
+
+    db.commit()
+
+
+@RegisterMigration(17, MIGRATIONS)
+def add_tag_media_count(db):
+    """Add an indexed media_count to Tag and count the current uses"""
+    metadata = MetaData(bind=db.bind)
+    tag_table = inspect_table(metadata, "core__tags")
+    media_tag_table = inspect_table(metadata, "core__media_tags")
+
+    col = Column('media_count', Integer, default=0)
+    col.create(tag_table)
+
+    db.execute(tag_table.update().values(
+        media_count=select([func.count(media_tag_table.c.id)]).where(
+            media_tag_table.c.tag == tag_table.c.id).as_scalar()))
+
+    Index('ix_core__tags_media_count',
+          tag_table.c.media_count).create(db.bind)
+
+    db.commit()
+
+
+@RegisterMigration(18, MIGRATIONS)
+def add_user_media_counts(db):
+    """
+    Add per-state media counts to User and recount the items of the
+    collections, which media deletion did not keep up to date
+    """
+    metadata = MetaData(bind=db.bind)
+    user_table = inspect_table(metadata, "core__users")
+    media_table = inspect_table(metadata, "core__media_entries")
+    collection_table = inspect_table(metadata, "core__collections")
+    item_table = inspect_table(metadata, "core__collection_items")
+
+    counts = {}
+    for state in (u'processed', u'processing', u'failed'):
+        col = Column('%s_media_count' % state, Integer, default=0)
+        col.create(user_table)
+        counts[col.name] = select([func.count(media_table.c.id)]).where(
+            (media_table.c.uploader == user_table.c.id)
+            & (media_table.c.state == state)).as_scalar()
+    db.execute(user_table.update().values(counts))
+
+    db.execute(collection_table.update().values(
+        items=select([func.count(item_table.c.id)]).where(
+            item_table.c.collection == collection_table.c.id).as_scalar()))
+
+    db.commit()
+
+
+@RegisterMigration(19, MIGRATIONS)
+def add_media_uploader_state_id_index(db):
+    """Index MediaEntry by uploader, state and id for prev/next lookups"""
+    metadata = MetaData(bind=db.bind)
+    media_entry_table = inspect_table(metadata, "core__media_entries")
+
+    Index('ix_core__media_entries_uploader_state_id',
+          media_entry_table.c.uploader, media_entry_table.c.state,
+          media_entry_table.c.id).create(db.bind)
+
+    db.commit()
+
+
+@RegisterMigration(20, MIGRATIONS)
+def add_rendered_markdown(db):
+    """
+    Add columns for the stored html of descriptions, comments, notes
+    and bios.  "gmg rendermarkdown" fills them for existing rows.
+    """
+    metadata = MetaData(bind=db.bind)
+    for table_name in ("core__users", "core__media_entries",
+                       "core__media_comments", "core__collections",
+                       "core__collection_items"):
+        table = inspect_table(metadata, table_name)
+        Column('rendered_html', UnicodeText).create(table)
+        Column('rendered_version', SmallInteger).create(table)
+
+    db.commit()
+
+
+@RegisterMigration(21, MIGRATIONS)
+def recount_tag_processed_media(db):
+    """Tag.media_count only counts processed media now, recount it"""
+    metadata = MetaData(bind=db.bind)
+    tag_table = inspect_table(metadata, "core__tags")
+    media_tag_table = inspect_table(metadata, "core__media_tags")
+    media_table = inspect_table(metadata, "core__media_entries")
+
+    db.execute(tag_table.update().values(
+        media_count=select([func.count(media_tag_table.c.id)]).where(
+            (media_tag_table.c.tag == tag_table.c.id)
+            & (media_tag_table.c.media_entry == media_table.c.id)
+            & (media_table.c.state == u'processed')).as_scalar()))
+
+    db.commit()
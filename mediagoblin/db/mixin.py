@@ -37,14 +37,35 @@ from mediagoblin import mg_globals
 from mediagoblin.media_types import FileTypeNotSupported
 from mediagoblin.tools import common, licenses
 from mediagoblin.tools.pluginapi import hook_handle
-from mediagoblin.tools.text import cleaned_markdown_conversion
+from mediagoblin.tools.text import cleaned_markdown_conversion, \
+    MARKDOWN_RENDERER_VERSION
 from mediagoblin.tools.url import slugify
 
 
-class UserMixin(object):
+class RenderedMarkdownMixin(object):
+    """
+    For models keeping the html of their markdown_field in rendered_html
+    (see mediagoblin.db.models.render_markdown_on_set).
+    """
+    markdown_field = None
+
+    def rendered_markdown(self):
+        """
+        The cleaned html of the markdown_field: the stored one, unless
+        it was rendered by another version of the renderer.
+        """
+        if self.rendered_version == MARKDOWN_RENDERER_VERSION:
+            return self.rendered_html or u''
+        return cleaned_markdown_conversion(
+            getattr(self, self.markdown_field))
+
+
+class UserMixin(RenderedMarkdownMixin):
+    markdown_field = 'bio'
+
     @property
     def bio_html(self):
-        return cleaned_markdown_conversion(self.bio)
+        return self.rendered_markdown()
 
 
 class GenerateSlugMixin(object):
@@ -117,7 +138,9 @@ class GenerateSlugMixin(object):
                 self.slug += uuid.uuid4().hex[:4]
 
 
-class MediaEntryMixin(GenerateSlugMixin):
+class MediaEntryMixin(GenerateSlugMixin, RenderedMarkdownMixin):
+    markdown_field = 'description'
+
     def check_slug_used(self, slug):
         # import this here due to a cyclic import issue
         # (db.models -> db.mixin -> db.util -> db.models)
@@ -131,7 +154,7 @@ class MediaEntryMixin(GenerateSlugMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_markdown()
 
     def get_display_media(self):
         """Find the best media for display.
@@ -180,6 +203,31 @@ class MediaEntryMixin(GenerateSlugMixin):
             media=self.slug_or_id,
             **extra_args)
 
+    def _url_to_sibling(self, urlgen, sibling):
+        if sibling is None:
+            return None
+        return urlgen(
+            'mediagoblin.user_pages.media_home',
+            user=self.get_uploader.username,
+            media=sibling.slug or u'id:%s' % sibling.id)
+
+    def url_to_prev(self, urlgen):
+        """get the next 'newer' entry by this user"""
+        return self._url_to_sibling(urlgen, self.siblings[0])
+
+    def url_to_next(self, urlgen):
+        """get the next 'older' entry by this user"""
+        return self._url_to_sibling(urlgen, self.siblings[1])
+
+    def thumb_url_of_next(self):
+        """
+        The thumbnail of the next 'older' entry by this user, for
+        prefetching; None if there is no such entry or thumbnail.
+        """
+        older = self.siblings[1]
+        if older is not None and older.file_path:
+            return mg_globals.app.public_store.file_url(older.file_path)
+
     @property
     def thumb_url(self):
         """Return the thumbnail URL (for usage in templates)
@@ -280,14 +328,16 @@ class MediaEntryMixin(GenerateSlugMixin):
         return exif_short
 
 
-class MediaCommentMixin(object):
+class MediaCommentMixin(RenderedMarkdownMixin):
+    markdown_field = 'content'
+
     @property
     def content_html(self):
         """
         the actual html-rendered version of the comment displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.content)
+        return self.rendered_markdown()
 
     def __repr__(self):
         return '<{klass} #{id} {author} "{comment}">'.format(
@@ -297,7 +347,9 @@ class MediaCommentMixin(object):
             comment=self.content)
 
 
-class CollectionMixin(GenerateSlugMixin):
+class CollectionMixin(GenerateSlugMixin, RenderedMarkdownMixin):
+    markdown_field = 'description'
+
     def check_slug_used(self, slug):
         # import this here due to a cyclic import issue
         # (db.models -> db.mixin -> db.util -> db.models)
@@ -311,7 +363,7 @@ class CollectionMixin(GenerateSlugMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_markdown()
 
     @property
     def slug_or_id(self):
@@ -332,11 +384,13 @@ class CollectionMixin(GenerateSlugMixin):
             **extra_args)
 
 
-class CollectionItemMixin(object):
+class CollectionItemMixin(RenderedMarkdownMixin):
+    markdown_field = 'note'
+
     @property
     def note_html(self):
         """
         the actual html-rendered version of the note displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.note)
+        return self.rendered_markdown()
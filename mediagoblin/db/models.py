@@ -23,20 +23,26 @@ import datetime
 
 from sqlalchemy import Column, Integer, Unicode, UnicodeText, DateTime, \
         Boolean, ForeignKey, UniqueConstraint, PrimaryKeyConstraint, \
-        SmallInteger
-from sqlalchemy.orm import relationship, backref, with_polymorphic
+        SmallInteger, Index, event
+from sqlalchemy.orm import relationship, backref, with_polymorphic, \
+        joinedload, joinedload_all, subqueryload, subqueryload_all, \
+        column_property
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.orm.collections import attribute_mapped_collection
-from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import desc, select, union_all, literal, \
+        and_, exists
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.util import memoized_property
 
 
 from mediagoblin.db.extratypes import PathTupleWithSlashes, JSONEncoded
-from mediagoblin.db.base import Base, DictReadAttrProxy
+from mediagoblin.db.base import Base, DictReadAttrProxy, Session
 from mediagoblin.db.mixin import UserMixin, MediaEntryMixin, \
         MediaCommentMixin, CollectionMixin, CollectionItemMixin
 from mediagoblin.tools.files import delete_media_files
 from mediagoblin.tools.common import import_component
+from mediagoblin.tools.text import cleaned_markdown_conversion, \
+        MARKDOWN_RENDERER_VERSION
 
 # It's actually kind of annoying how sqlalchemy-migrate does this, if
 # I understand it right, but whatever.  Anyway, don't remove this :P
@@ -74,6 +80,14 @@ class User(Base, UserMixin):
     is_admin = Column(Boolean, default=False, nullable=False)
     url = Column(Unicode)
     bio = Column(UnicodeText)  # ??
+    # html of the bio, see RenderedMarkdownMixin
+    rendered_html = Column(UnicodeText)
+    rendered_version = Column(SmallInteger)
+    # Number of media entries per state, kept up to date by the
+    # MediaEntry events below
+    processed_media_count = Column(Integer, default=0)
+    processing_media_count = Column(Integer, default=0)
+    failed_media_count = Column(Integer, default=0)
 
     ## TODO
     # plugin data would be in a separate model
@@ -185,8 +199,15 @@ class MediaEntry(Base, MediaEntryMixin):
     created = Column(DateTime, nullable=False, default=datetime.datetime.now,
         index=True)
     description = Column(UnicodeText) # ??
+    # html of the description, see RenderedMarkdownMixin
+    rendered_html = Column(UnicodeText)
+    rendered_version = Column(SmallInteger)
     media_type = Column(Unicode, nullable=False)
-    state = Column(Unicode, default=u'unprocessed', nullable=False)
+    # active_history: the per-state counts of the User need the old
+    # state, even if it was expired when the new one gets set
+    state = column_property(
+        Column(Unicode, default=u'unprocessed', nullable=False),
+        active_history=True)
         # or use sqlalchemy.types.Enum?
     license = Column(Unicode)
     collected = Column(Integer, default=0)
@@ -200,8 +221,14 @@ class MediaEntry(Base, MediaEntryMixin):
 
     queued_task_id = Column(Unicode)
 
+    # sha1 of the uploaded file, used to find duplicate uploads
+    upload_hash = Column(Unicode, index=True)
+
     __table_args__ = (
         UniqueConstraint('uploader', 'slug'),
+        # Walking the processed media of a user (gallery, prev/next)
+        Index('ix_core__media_entries_uploader_state_id',
+              'uploader', 'state', 'id'),
         {})
 
     get_uploader = relationship(User)
@@ -226,10 +253,35 @@ class MediaEntry(Base, MediaEntryMixin):
     tags_helper = relationship("MediaTag",
         cascade="all, delete-orphan" # should be automatically deleted
         )
-    tags = association_proxy("tags_helper", "dict_view",
+    _tags = association_proxy("tags_helper", "dict_view",
         creator=lambda v: MediaTag(name=v["name"], slug=v["slug"])
         )
 
+    def _set_tags(self, tags):
+        """
+        Replace all tags by tags, a list of {'name': ..., 'slug': ...}
+        dicts, looking up (or creating) all of their Tags at once.
+        """
+        found = Tag.find_or_create_all([tag['slug'] for tag in tags])
+        current = dict((media_tag.tag, media_tag)
+                       for media_tag in self.tags_helper
+                       if media_tag.tag is not None)
+
+        media_tags = []
+        for tag in tags:
+            tag_obj = found.pop(tag['slug'], None)
+            if tag_obj is None:
+                # Another name with the same slug
+                continue
+            media_tag = current.get(tag_obj.id) or MediaTag()
+            media_tag.name = tag['name']
+            media_tag.tag_helper = tag_obj
+            media_tags.append(media_tag)
+
+        self.tags_helper = media_tags
+
+    tags = property(lambda self: self._tags, _set_tags)
+
     collections_helper = relationship("CollectionItem",
         cascade="all, delete-orphan"
         )
@@ -238,31 +290,66 @@ class MediaEntry(Base, MediaEntryMixin):
     ## TODO
     # fail_error
 
+    @classmethod
+    def eager_query(cls, query=None):
+        """
+        Return query (default: all entries) with the uploader, files and
+        tags loaded up front.
+
+        Use this for pages listing many entries, where lazy loading would
+        cost several SELECTs per entry.
+        """
+        if query is None:
+            query = cls.query
+        return query.options(
+            joinedload(cls.get_uploader),
+            subqueryload(cls.media_files_helper),
+            subqueryload_all(cls.tags_helper, MediaTag.tag_helper))
+
     def get_comments(self, ascending=False):
         order_col = MediaComment.created
         if not ascending:
             order_col = desc(order_col)
         return self.all_comments.order_by(order_col)
 
-    def url_to_prev(self, urlgen):
-        """get the next 'newer' entry by this user"""
-        media = MediaEntry.query.filter(
-            (MediaEntry.uploader == self.uploader)
-            & (MediaEntry.state == u'processed')
-            & (MediaEntry.id > self.id)).order_by(MediaEntry.id).first()
-
-        if media is not None:
-            return media.url_for_self(urlgen)
-
-    def url_to_next(self, urlgen):
-        """get the next 'older' entry by this user"""
-        media = MediaEntry.query.filter(
-            (MediaEntry.uploader == self.uploader)
-            & (MediaEntry.state == u'processed')
-            & (MediaEntry.id < self.id)).order_by(desc(MediaEntry.id)).first()
+    @memoized_property
+    def siblings(self):
+        """
+        The processed entries by the same user right before and after
+        this one, as (newer, older).
 
-        if media is not None:
-            return media.url_for_self(urlgen)
+        Both are looked up in one query and only have an id, a slug and
+        the path of their thumbnail (or None); either is None if there
+        is no such entry.
+        """
+        entries = MediaEntry.__table__
+        files = MediaFile.__table__
+        keynames = FileKeynames.__table__
+
+        def sibling(direction, newer):
+            if newer:
+                where, order = entries.c.id > self.id, entries.c.id
+            else:
+                where, order = entries.c.id < self.id, desc(entries.c.id)
+            found = select([entries.c.id, entries.c.slug]).where(
+                (entries.c.uploader == self.uploader)
+                & (entries.c.state == u'processed')
+                & where).order_by(order).limit(1).alias(direction)
+            # Join the thumbnail outside of the LIMIT, so it is only
+            # looked up for the one entry found
+            thumbs = files.join(keynames, and_(
+                files.c.name_id == keynames.c.id,
+                keynames.c.name == u'thumb'))
+            return select(
+                [literal(direction).label('direction'),
+                 found.c.id, found.c.slug, files.c.file_path],
+                from_obj=found.outerjoin(
+                    thumbs, files.c.media_entry == found.c.id))
+
+        found = dict(
+            (row.direction, row) for row in Session.execute(
+                union_all(sibling('newer', True), sibling('older', False))))
+        return found.get('newer'), found.get('older')
 
     @property
     def media_data(self):
@@ -317,6 +404,8 @@ class MediaEntry(Base, MediaEntryMixin):
             _log.error('No such files from the user "{1}" to delete: '
                        '{0}'.format(str(error), self.get_uploader))
         _log.info('Deleted Media entry id "{0}"'.format(self.id))
+        commit = kwargs.pop('commit', True)
+        super(MediaEntry, self).delete(commit=False, **kwargs)
         # Related MediaTag's are automatically cleaned, but we might
         # want to clean out unused Tag's too.
         if del_orphan_tags:
@@ -324,8 +413,48 @@ class MediaEntry(Base, MediaEntryMixin):
             #       This cries for refactoring
             from mediagoblin.db.util import clean_orphan_tags
             clean_orphan_tags(commit=False)
-        # pass through commit=False/True in kwargs
-        super(MediaEntry, self).delete(**kwargs)
+        if commit:
+            Session.commit()
+
+
+# MediaEntry.state: the User column counting the entries in it
+USER_MEDIA_COUNTS = {
+    u'processed': 'processed_media_count',
+    u'processing': 'processing_media_count',
+    u'failed': 'failed_media_count'}
+
+
+def _change_user_media_count(connection, entry, state, change):
+    if state in USER_MEDIA_COUNTS:
+        change_count(connection, User, USER_MEDIA_COUNTS[state],
+                     entry.uploader, change)
+
+
+@event.listens_for(MediaEntry, 'after_insert')
+def _count_media_entry(mapper, connection, entry):
+    _change_user_media_count(connection, entry, entry.state, 1)
+
+
+@event.listens_for(MediaEntry, 'after_update')
+def _recount_media_entry(mapper, connection, entry):
+    history = get_history(entry, 'state')
+    if history.added and history.deleted:
+        old_state, new_state = history.deleted[0], history.added[0]
+        _change_user_media_count(connection, entry, old_state, -1)
+        _change_user_media_count(connection, entry, new_state, 1)
+        # Tags only count processed media, see MediaTag
+        if u'processed' in (old_state, new_state):
+            _change_tag_media_counts(
+                connection, entry.id,
+                1 if new_state == u'processed' else -1)
+
+
+@event.listens_for(MediaEntry, 'before_delete')
+def _uncount_media_entry(mapper, connection, entry):
+    # The state in the database, not a pending change
+    history = get_history(entry, 'state')
+    state = (history.deleted or history.unchanged or history.added)[0]
+    _change_user_media_count(connection, entry, state, -1)
 
 
 class FileKeynames(Base):
@@ -396,6 +525,9 @@ class Tag(Base):
 
     id = Column(Integer, primary_key=True)
     slug = Column(Unicode, nullable=False, unique=True)
+    # Number of media entries with this tag, kept up to date by the
+    # MediaTag events below
+    media_count = Column(Integer, default=0, index=True)
 
     def __repr__(self):
         return "<Tag %r: %r>" % (self.id, self.slug)
@@ -407,6 +539,32 @@ class Tag(Base):
             return t
         return cls(slug=slug)
 
+    @classmethod
+    def find_or_create_all(cls, slugs):
+        """
+        Return a {slug: Tag} dict for slugs, inserting the missing
+        tags in a single statement.
+        """
+        slugs = set(slugs)
+        if not slugs:
+            return {}
+
+        found = dict((tag.slug, tag)
+                     for tag in cls.query.filter(cls.slug.in_(slugs)))
+        missing = slugs.difference(found)
+        if missing:
+            Session.execute(cls.__table__.insert().values(
+                [{'slug': slug, 'media_count': 0} for slug in missing]))
+            found.update((tag.slug, tag)
+                         for tag in cls.query.filter(cls.slug.in_(missing)))
+        return found
+
+    @classmethod
+    def popular(cls, limit=20):
+        """The limit most used tags, most used first"""
+        return cls.query.filter(cls.media_count > 0).order_by(
+            cls.media_count.desc(), cls.slug).limit(limit)
+
 
 class MediaTag(Base):
     __tablename__ = "core__media_tags"
@@ -441,6 +599,50 @@ class MediaTag(Base):
         return DictReadAttrProxy(self)
 
 
+def change_count(connection, model, column, row_id, change):
+    """
+    Add change to the counter column of the model's row_id, as part
+    of the flush going on on connection.
+    """
+    table = model.__table__
+    connection.execute(table.update().where(table.c.id == row_id).values(
+        {column: table.c[column] + change}))
+
+
+def _change_tag_media_counts(connection, entry_id, change):
+    """Add change to the media_count of all tags of the entry"""
+    tags = Tag.__table__
+    media_tags = MediaTag.__table__
+    connection.execute(tags.update().where(tags.c.id.in_(
+        select([media_tags.c.tag]).where(
+            media_tags.c.media_entry == entry_id))).values(
+        media_count=tags.c.media_count + change))
+
+
+def _change_tag_media_count(connection, media_tag, change):
+    """
+    Add change to the media_count of the tag, if the media is processed
+    (in the database: the state is flushed before the MediaTags)
+    """
+    tags = Tag.__table__
+    media = MediaEntry.__table__
+    connection.execute(tags.update().where(
+        (tags.c.id == media_tag.tag)
+        & exists().where((media.c.id == media_tag.media_entry)
+                         & (media.c.state == u'processed'))).values(
+        media_count=tags.c.media_count + change))
+
+
+@event.listens_for(MediaTag, 'after_insert')
+def _count_media_tag(mapper, connection, media_tag):
+    _change_tag_media_count(connection, media_tag, 1)
+
+
+@event.listens_for(MediaTag, 'before_delete')
+def _uncount_media_tag(mapper, connection, media_tag):
+    _change_tag_media_count(connection, media_tag, -1)
+
+
 class MediaComment(Base, MediaCommentMixin):
     __tablename__ = "core__media_comments"
 
@@ -450,6 +652,9 @@ class MediaComment(Base, MediaCommentMixin):
     author = Column(Integer, ForeignKey(User.id), nullable=False)
     created = Column(DateTime, nullable=False, default=datetime.datetime.now)
     content = Column(UnicodeText, nullable=False)
+    # html of the content, see RenderedMarkdownMixin
+    rendered_html = Column(UnicodeText)
+    rendered_version = Column(SmallInteger)
 
     # Cascade: Comments are owned by their creator. So do the full thing.
     # lazy=dynamic: People might post a *lot* of comments,
@@ -486,6 +691,9 @@ class Collection(Base, CollectionMixin):
     created = Column(DateTime, nullable=False, default=datetime.datetime.now,
                      index=True)
     description = Column(UnicodeText)
+    # html of the description, see RenderedMarkdownMixin
+    rendered_html = Column(UnicodeText)
+    rendered_version = Column(SmallInteger)
     creator = Column(Integer, ForeignKey(User.id), nullable=False)
     # TODO: No of items in Collection. Badly named, can we migrate to num_items?
     items = Column(Integer, default=0)
@@ -516,6 +724,9 @@ class CollectionItem(Base, CollectionItemMixin):
         Integer, ForeignKey(MediaEntry.id), nullable=False, index=True)
     collection = Column(Integer, ForeignKey(Collection.id), nullable=False)
     note = Column(UnicodeText, nullable=True)
+    # html of the note, see RenderedMarkdownMixin
+    rendered_html = Column(UnicodeText)
+    rendered_version = Column(SmallInteger)
     added = Column(DateTime, nullable=False, default=datetime.datetime.now)
     position = Column(Integer)
 
@@ -527,6 +738,19 @@ class CollectionItem(Base, CollectionItemMixin):
 
     get_media_entry = relationship(MediaEntry)
 
+    @classmethod
+    def eager_query(cls, query=None):
+        """
+        Like MediaEntry.eager_query, for listing collection items along
+        with their media entries.
+        """
+        if query is None:
+            query = cls.query
+        return query.options(
+            joinedload_all(cls.get_media_entry, MediaEntry.get_uploader),
+            subqueryload_all(cls.get_media_entry,
+                             MediaEntry.media_files_helper))
+
     __table_args__ = (
         UniqueConstraint('collection', 'media_entry'),
         {})
@@ -537,6 +761,16 @@ class CollectionItem(Base, CollectionItemMixin):
         return DictReadAttrProxy(self)
 
 
+@event.listens_for(CollectionItem, 'after_insert')
+def _count_collection_item(mapper, connection, item):
+    change_count(connection, Collection, 'items', item.collection, 1)
+
+
+@event.listens_for(CollectionItem, 'before_delete')
+def _uncount_collection_item(mapper, connection, item):
+    change_count(connection, Collection, 'items', item.collection, -1)
+
+
 class ProcessingMetaData(Base):
     __tablename__ = 'core__processing_metadata'
 
@@ -646,6 +880,20 @@ with_polymorphic(
     Notification,
     [ProcessingNotification, CommentNotification])
 
+
+def render_markdown_on_set(target, value, oldvalue, initiator):
+    """Store the html of the markdown_field whenever it is set"""
+    target.rendered_html = cleaned_markdown_conversion(value)
+    target.rendered_version = MARKDOWN_RENDERER_VERSION
+
+
+MARKDOWN_MODELS = [User, MediaEntry, MediaComment, Collection, CollectionItem]
+
+for model in MARKDOWN_MODELS:
+    event.listen(getattr(model, model.markdown_field), 'set',
+                 render_markdown_on_set)
+
+
 MODELS = [
     User, Client, RequestToken, AccessToken, NonceTimestamp, MediaEntry, Tag,
     MediaTag, MediaComment, Collection, CollectionItem, MediaFile, FileKeynames,
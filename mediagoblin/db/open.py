@@ -17,6 +17,7 @@
 
 from sqlalchemy import create_engine, event
 import logging
+import threading
 
 from mediagoblin.db.base import Base, Session
 from mediagoblin import mg_globals
@@ -24,7 +25,28 @@ from mediagoblin import mg_globals
 _log = logging.getLogger(__name__)
 
 
+class QueryCounter(object):
+    """Counts the sql statements the engine runs, per thread"""
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self._local.count = self.count + 1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def reset(self):
+        self._local.count = 0
+
+
 class DatabaseMaster(object):
+    # A QueryCounter, with count_queries turned on
+    query_counter = None
+
     def __init__(self, engine):
         self.engine = engine
 
@@ -90,7 +112,10 @@ def setup_connection_and_db_from_config(app_config, migrations=False):
 
     Session.configure(bind=engine)
 
-    return DatabaseMaster(engine)
+    db = DatabaseMaster(engine)
+    if app_config.get('count_queries'):
+        db.query_counter = QueryCounter(engine)
+    return db
 
 
 def check_db_migrations_current(db):
@@ -14,8 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from sqlalchemy import func, select, bindparam, or_
+
 from mediagoblin.db.base import Session
-from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
+from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection, \
+    CollectionItem, User, USER_MEDIA_COUNTS, MARKDOWN_MODELS
+from mediagoblin.tools.text import cleaned_markdown_conversion, \
+    MARKDOWN_RENDERER_VERSION
 
 
 ##########################
@@ -47,14 +52,12 @@ def media_entries_for_tag_slug(dummy_db, tag_slug):
 
 
 def clean_orphan_tags(commit=True):
-    """Search for unused MediaTags and delete them"""
-    q1 = Session.query(Tag).outerjoin(MediaTag).filter(MediaTag.id==None)
-    for t in q1:
-        Session.delete(t)
-    # The "let the db do all the work" version:
-    # q1 = Session.query(Tag.id).outerjoin(MediaTag).filter(MediaTag.id==None)
-    # q2 = Session.query(Tag).filter(Tag.id.in_(q1))
-    # q2.delete(synchronize_session = False)
+    """Search for unused Tags and delete them"""
+    # Make pending MediaTag deletions count
+    Session.flush()
+    used = Session.query(MediaTag.tag)
+    Tag.query.filter(~Tag.id.in_(used.subquery())).delete(
+        synchronize_session='fetch')
     if commit:
         Session.commit()
 
@@ -68,6 +71,101 @@ def check_collection_slug_used(creator_id, slug, ignore_c_id):
     return does_exist
 
 
+def recount_user_media(user_ids=None, commit=True):
+    """
+    Recompute the per-state media counts of the users with user_ids
+    (default: all users) from their media entries.
+    """
+    users = User.__table__
+    media = MediaEntry.__table__
+    update = users.update().values(dict(
+        (column, select([func.count(media.c.id)]).where(
+            (media.c.uploader == users.c.id)
+            & (media.c.state == state)).as_scalar())
+        for state, column in USER_MEDIA_COUNTS.iteritems()))
+    if user_ids is not None:
+        update = update.where(users.c.id.in_(user_ids))
+    Session.execute(update)
+    if commit:
+        Session.commit()
+
+
+def recount_tag_media(media_ids=None, commit=True):
+    """
+    Recompute the number of processed media of the tags of the media
+    with media_ids (default: all tags)
+    """
+    tags = Tag.__table__
+    media_tags = MediaTag.__table__
+    media = MediaEntry.__table__
+    update = tags.update().values(
+        media_count=select([func.count(media_tags.c.id)]).where(
+            (media_tags.c.tag == tags.c.id)
+            & (media_tags.c.media_entry == media.c.id)
+            & (media.c.state == u'processed')).as_scalar())
+    if media_ids is not None:
+        update = update.where(tags.c.id.in_(
+            select([media_tags.c.tag]).where(
+                media_tags.c.media_entry.in_(media_ids))))
+    Session.execute(update)
+    if commit:
+        Session.commit()
+
+
+def recount_collection_items(commit=True):
+    """Recompute the number of items of all collections"""
+    collections = Collection.__table__
+    items = CollectionItem.__table__
+    Session.execute(collections.update().values(
+        items=select([func.count(items.c.id)]).where(
+            items.c.collection == collections.c.id).as_scalar()))
+    if commit:
+        Session.commit()
+
+
+def render_stored_markdown(everything=False, batch_size=500):
+    """
+    Store the html of all rows whose markdown was rendered by another
+    version of the renderer, or never (all rows if everything is set).
+    Commits after every batch_size rows; returns the number of rows.
+    """
+    rendered = 0
+    for model in MARKDOWN_MODELS:
+        table = model.__table__
+        query = select([table.c.id, table.c[model.markdown_field]])
+        if not everything:
+            query = query.where(or_(
+                table.c.rendered_version == None,
+                table.c.rendered_version != MARKDOWN_RENDERER_VERSION))
+        query = query.order_by(table.c.id).limit(batch_size)
+        update = table.update().where(table.c.id == bindparam('row_id'))
+
+        last_id = 0
+        while True:
+            rows = Session.execute(
+                query.where(table.c.id > last_id)).fetchall()
+            if not rows:
+                break
+            Session.execute(update, [
+                {'row_id': row_id,
+                 'rendered_html': cleaned_markdown_conversion(text),
+                 'rendered_version': MARKDOWN_RENDERER_VERSION}
+                for row_id, text in rows])
+            Session.commit()
+            rendered += len(rows)
+            last_id = rows[-1][0]
+    return rendered
+
+
+def newest_in_query(query, created_col, id_col):
+    """
+    Return (newest created, highest id, number of rows) of query in a
+    single aggregate query, e.g. to tell whether a listing has changed.
+    """
+    return query.order_by(None).enable_eagerloads(False).with_entities(
+        func.max(created_col), func.max(id_col), func.count(id_col)).one()
+
+
 if __name__ == '__main__':
     from mediagoblin.db.open import setup_connection_and_db_from_config
 
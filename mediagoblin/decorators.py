@@ -22,7 +22,7 @@ from oauthlib.oauth1 import ResourceEndpoint
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin import messages
-from mediagoblin.db.models import MediaEntry, User
+from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools.response import json_response, redirect, render_404
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
@@ -59,7 +59,7 @@ def active_user_from_url(controller):
     Returns a 404 if no such active user has been found"""
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
-        user = User.query.filter_by(username=request.matchdict['user']).first()
+        user = request.lookups.user_by_username(request.matchdict['user'])
         if user is None:
             return render_404(request)
 
@@ -90,8 +90,8 @@ def user_may_alter_collection(controller):
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
-        creator_id = request.db.User.query.filter_by(
-            username=request.matchdict['user']).first().id
+        creator_id = request.lookups.user_by_username(
+            request.matchdict['user']).id
         if not (request.user.is_admin or
                 request.user.id == creator_id):
             raise Forbidden()
@@ -125,7 +125,7 @@ def get_user_media_entry(controller):
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
-        user = User.query.filter_by(username=request.matchdict['user']).first()
+        user = request.lookups.user_by_username(request.matchdict['user'])
         if not user:
             raise NotFound()
 
@@ -165,8 +165,7 @@ def get_user_collection(controller):
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
-        user = request.db.User.query.filter_by(
-            username=request.matchdict['user']).first()
+        user = request.lookups.user_by_username(request.matchdict['user'])
 
         if not user:
             return render_404(request)
@@ -190,8 +189,7 @@ def get_user_collection_item(controller):
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
-        user = request.db.User.query.filter_by(
-            username=request.matchdict['user']).first()
+        user = request.lookups.user_by_username(request.matchdict['user'])
 
         if not user:
             return render_404(request)
@@ -49,25 +49,31 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.reprocess:reprocess_parser_setup',
         'func': 'mediagoblin.gmg_commands.reprocess:reprocess',
         'help': 'Reprocess media entries'},
+    'recount': {
+        'setup': 'mediagoblin.gmg_commands.recount:recount_parser_setup',
+        'func': 'mediagoblin.gmg_commands.recount:recount',
+        'help': 'Rebuild the media, tag, collection item and blog post counters'},
+    'rendermarkdown': {
+        'setup': 'mediagoblin.gmg_commands.rendermarkdown:rendermarkdown_parser_setup',
+        'func': 'mediagoblin.gmg_commands.rendermarkdown:rendermarkdown',
+        'help': 'Store the html of descriptions, comments, notes and bios'},
+    'workers': {
+        'setup': 'mediagoblin.gmg_commands.workers:workers_parser_setup',
+        'func': 'mediagoblin.gmg_commands.workers:workers',
+        'help': 'Start celery workers for all media processing queues'},
+    'env_export': {
+        'setup': 'mediagoblin.gmg_commands.import_export:import_export_parse_setup',
+        'func': 'mediagoblin.gmg_commands.import_export:env_export',
+        'help': 'Exports the data for this MediaGoblin instance'},
+    'env_import': {
+        'setup': 'mediagoblin.gmg_commands.import_export:import_export_parse_setup',
+        'func': 'mediagoblin.gmg_commands.import_export:env_import',
+        'help': 'Imports the data for this MediaGoblin instance'},
     # 'theme': {
     #     'setup': 'mediagoblin.gmg_commands.theme:theme_parser_setup',
     #     'func': 'mediagoblin.gmg_commands.theme:theme',
     #     'help': 'Theming commands',
     #     }
-
-    ## These might be useful, mayyyybe, but don't really work anymore
-    ## due to mongo change and the "versatility" of sql options.
-    ##
-    ## For now, commenting out.  Might re-enable soonish?
-    #
-    # 'env_export': {
-    #     'setup': 'mediagoblin.gmg_commands.import_export:import_export_parse_setup',
-    #     'func': 'mediagoblin.gmg_commands.import_export:env_export',
-    #     'help': 'Exports the data for this MediaGoblin instance'},
-    # 'env_import': {
-    #     'setup': 'mediagoblin.gmg_commands.import_export:import_export_parse_setup',
-    #     'func': 'mediagoblin.gmg_commands.import_export:env_import',
-    #     'help': 'Imports the data for this MediaGoblin instance'},
     }
 
 
@@ -14,156 +14,394 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mediagoblin import mg_globals
-from mediagoblin.db.open import setup_connection_and_db_from_config
-from mediagoblin.gmg_commands import util as commands_util
-from mediagoblin.storage.filestorage import BasicFileStorage
+"""
+Export the database and media files of an instance to a tar archive,
+and import them again.
+
+The archive is written and read as a gzipped tar stream, without
+unpacking it anywhere:
+
+  mediagoblin-data/manifest.json
+  mediagoblin-data/database/<table>/<nnnnnn>.ndjson
+  mediagoblin-data/public/<filepath>
+  mediagoblin-data/queue/<filepath>
+
+Every .ndjson member holds up to ROWS_PER_MEMBER rows of a table, one
+JSON object per line, and the tables come in foreign key order.  The
+files are read from and written to the storage systems by a pool of
+threads, so slow (remote) storage doesn't hold up the tar stream.
+"""
+
+from mediagoblin import __version__, mg_globals
+from mediagoblin.db.base import Base
+from mediagoblin.db.models import (MediaEntry, MediaFile,
+                                   MediaAttachmentFile, MigrationData)
+from mediagoblin.db.open import (setup_connection_and_db_from_config,
+                                 load_models)
 from mediagoblin.init import setup_storage, setup_global_and_app_config
-
+from mediagoblin.storage import clean_listy_filepath
+
+from sqlalchemy import DateTime, Integer, func, select, text
+from multiprocessing.pool import ThreadPool
+from cStringIO import StringIO
+import collections
+import datetime
+import json
 import shutil
 import tarfile
 import tempfile
-import subprocess
+import time
 import os.path
 import os
 import sys
 import logging
-from contextlib import closing
 
 _log = logging.getLogger('gmg.import_export')
 logging.basicConfig()
 _log.setLevel(logging.INFO)
 
 
+ARCHIVE_ROOT = 'mediagoblin-data/'
+ARCHIVE_FORMAT = 1
+ROWS_PER_MEMBER = 1000
+COPY_CHUNK_SIZE = 4 * 1048576
+DEFAULT_JOBS = 4
+
+
+class ArchiveError(Exception):
+    pass
+
+
 def import_export_parse_setup(subparser):
-    # TODO: Add default
     subparser.add_argument(
         'tar_file')
     subparser.add_argument(
-        '--mongodump_path', default='mongodump',
-        help='mongodump binary')
+        '--jobs', '-j', type=int, default=DEFAULT_JOBS,
+        help='Number of threads reading and writing media files')
     subparser.add_argument(
-        '--mongorestore_path', default='mongorestore',
-        help='mongorestore binary')
-    subparser.add_argument(
-        '--cache_path',
-        help='Temporary directory where files will be temporarily dumped')
-
-
-def _import_media(db, args):
-    '''
-    Import media files
-
-    Must be called after _import_database()
-    '''
-    _log.info('-> Importing media...')
-
-    media_cache = BasicFileStorage(
-        args._cache_path['media'])
-
-    # TODO: Add import of queue files
-    queue_cache = BasicFileStorage(args._cache_path['queue'])
-
-    for entry in db.MediaEntry.query.filter_by():
-        for name, path in entry.media_files.items():
-            _log.info('Importing: {0} - {1}'.format(
-                    entry.title.encode('ascii', 'replace'),
-                    name))
-
-            media_file = mg_globals.public_store.get_file(path, mode='wb')
-            media_file.write(
-                media_cache.get_file(path, mode='rb').read())
-
-    _log.info('...Media imported')
-
-
-def _import_database(db, args):
-    '''
-    Restore mongo database from ___.bson files
-    '''
-    _log.info('-> Importing database...')
-
-    p = subprocess.Popen([
-            args.mongorestore_path,
-            '-d', db.name,
-            os.path.join(args._cache_path['database'], db.name)])
-
-    p.wait()
-
-    _log.info('...Database imported')
+        '--checkpoint',
+        help='(import only) File to record the imported parts of the '
+             'archive in.  Parts already listed there are skipped, so an '
+             'interrupted import can be resumed by passing the same file '
+             'again')
+
+
+def _bounded_imap(pool, function, iterable, window):
+    """
+    Like pool.imap, but never with more than window calls in flight,
+    so the results waiting to be used don't pile up.
+    """
+    pending = collections.deque()
+    for args in iterable:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _exported_tables(engine):
+    """The tables to export, parents before the tables referring to them"""
+    # The migration state belongs to the instance, see gmg dbupdate
+    return [table for table in Base.metadata.sorted_tables
+            if table is not MigrationData.__table__
+            and table.exists(bind=engine)]
+
+
+def _encode_row(table, row):
+    data = {}
+    for column in table.columns:
+        value = row[column]
+        if value is not None and isinstance(column.type, DateTime):
+            value = value.isoformat()
+        data[column.name] = value
+    return data
+
+
+def _decode_row(table, data):
+    row = {}
+    for column in table.columns:
+        if column.name not in data:
+            continue
+        value = data[column.name]
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.datetime.strptime(
+                value,
+                '%Y-%m-%dT%H:%M:%S.%f' if '.' in value
+                else '%Y-%m-%dT%H:%M:%S')
+        row[column.name] = value
+    return row
+
+
+def _add_member(tf, name, fileobj, size):
+    info = tarfile.TarInfo(ARCHIVE_ROOT + name)
+    info.size = size
+    info.mtime = time.time()
+    tf.addfile(info, fileobj)
+
+
+def _add_string_member(tf, name, data):
+    _add_member(tf, name, StringIO(data), len(data))
+
+
+def _export_table(tf, engine, table):
+    """Stream the rows of table into tf, ROWS_PER_MEMBER at a time"""
+    connection = engine.connect().execution_options(stream_results=True)
+    try:
+        rows = connection.execute(
+            table.select().order_by(*table.primary_key.columns))
+        count = 0
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(_encode_row(table, row)) + '\n')
+            if len(lines) == ROWS_PER_MEMBER:
+                _add_string_member(tf, 'database/%s/%06d.ndjson' % (
+                    table.name, count // ROWS_PER_MEMBER), ''.join(lines))
+                count += len(lines)
+                lines = []
+        if lines:
+            _add_string_member(tf, 'database/%s/%06d.ndjson' % (
+                table.name, count // ROWS_PER_MEMBER), ''.join(lines))
+            count += len(lines)
+    finally:
+        connection.close()
+    return count
+
+
+def _stored_files(engine):
+    """(store name, filepath) of every file the database refers to"""
+    queries = [
+        ('public', select([MediaFile.__table__.c.file_path])),
+        ('public', select([MediaAttachmentFile.__table__.c.filepath])),
+        ('queue', select([MediaEntry.__table__.c.queued_media_file]))]
+    for store_name, query in queries:
+        for (filepath,) in engine.execute(query):
+            if filepath:
+                yield store_name, filepath
+
+
+def _open_stored_file(store, store_name, filepath):
+    """
+    Open a stored file for the archive, returning (store_name, filepath,
+    file, size).  Remote files are copied to a temporary file first,
+    which only stays in memory if it's small.
+    """
+    try:
+        if store.local_storage:
+            local_path = store.get_local_path(filepath)
+            return (store_name, filepath, open(local_path, 'rb'),
+                    os.path.getsize(local_path))
+
+        spool = tempfile.SpooledTemporaryFile(COPY_CHUNK_SIZE)
+        with store.get_file(filepath, 'rb') as stored_file:
+            shutil.copyfileobj(stored_file, spool, COPY_CHUNK_SIZE)
+        size = spool.tell()
+        spool.seek(0)
+        return store_name, filepath, spool, size
+    except Exception as exc:
+        _log.error(u'Could not read {0}: {1}'.format(
+            u'/'.join(filepath), exc))
+        return store_name, filepath, None, None
+
+
+def export_archive(engine, stores, fileobj, jobs=DEFAULT_JOBS):
+    """
+    Write the database behind engine and the files of the stores
+    ({'public': store, 'queue': store}) to fileobj as a gzipped tar
+    stream
+    """
+    tables = _exported_tables(engine)
+    tf = tarfile.open(fileobj=fileobj, mode='w|gz')
+    pool = ThreadPool(jobs)
+    try:
+        _add_string_member(tf, 'manifest.json', json.dumps({
+            'format': ARCHIVE_FORMAT,
+            'mediagoblin': __version__,
+            'tables': [table.name for table in tables]}))
+
+        _log.info('-> Exporting database...')
+        for table in tables:
+            count = _export_table(tf, engine, table)
+            _log.info('{0}: {1} rows'.format(table.name, count))
+
+        _log.info('-> Exporting media...')
+        files = ((stores[store_name], store_name, filepath)
+                 for store_name, filepath in _stored_files(engine))
+        count = 0
+        for store_name, filepath, stored_file, size in _bounded_imap(
+                pool, _open_stored_file, files, jobs * 2):
+            if stored_file is None:
+                continue
+            with stored_file:
+                _add_member(tf, '%s/%s' % (store_name, '/'.join(filepath)),
+                            stored_file, size)
+            count += 1
+        _log.info('{0} files'.format(count))
+    finally:
+        pool.terminate()
+        tf.close()
+
+
+def _read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+
+    with open(path) as checkpoint:
+        return set(line.rstrip('\n') for line in checkpoint if line.strip())
+
+
+def _check_empty(engine, tables):
+    for table in tables.itervalues():
+        if engine.execute(select([func.count()]).select_from(table)).scalar():
+            raise ArchiveError(
+                'Table {0} is not empty.  Import into a fresh database '
+                'set up with "gmg dbupdate", or resume an import with '
+                '--checkpoint'.format(table.name))
+
+
+def _store_file(store, filepath, spool):
+    try:
+        with store.get_file(filepath, 'wb') as stored_file:
+            shutil.copyfileobj(spool, stored_file, COPY_CHUNK_SIZE)
+    finally:
+        spool.close()
+
+
+def _reset_sequences(engine, tables):
+    """Let PostgreSQL hand out ids after the imported ones"""
+    if engine.dialect.name != 'postgresql':
+        return
+
+    for table in tables:
+        columns = list(table.primary_key.columns)
+        if len(columns) != 1 or not isinstance(columns[0].type, Integer):
+            continue
+        engine.execute(
+            text("SELECT setval(pg_get_serial_sequence(:table, :column), "
+                 "(SELECT COALESCE(MAX(%s), 0) + 1 FROM %s), false)" % (
+                     columns[0].name, table.name)),
+            table=table.name, column=columns[0].name)
+
+
+def import_archive(engine, stores, fileobj, jobs=DEFAULT_JOBS,
+                   checkpoint=None):
+    """
+    Read an archive written by export_archive from fileobj into the
+    (empty) database behind engine and the stores.
+
+    With a checkpoint file, the names of the imported archive members
+    are appended to it, and members already listed in there are skipped.
+    Returns the number of imported and skipped members.
+    """
+    done = _read_checkpoint(checkpoint)
+    tables = dict((table.name, table) for table in _exported_tables(engine))
+    if not done:
+        _check_empty(engine, tables)
+
+    tf = tarfile.open(fileobj=fileobj, mode='r|gz')
+    pool = ThreadPool(jobs)
+    pending = collections.deque()
+    record = open(checkpoint, 'a') if checkpoint else None
+    imported = []
+    skipped = 0
+
+    def finish(name):
+        imported.append(name)
+        if record:
+            record.write(name + '\n')
+            record.flush()
+
+    def finish_oldest():
+        name, result = pending.popleft()
+        result.get()
+        finish(name)
+
+    try:
+        for member in tf:
+            if not member.isfile():
+                continue
+            if not member.name.startswith(ARCHIVE_ROOT):
+                _log.warning(u'Skipping {0}'.format(member.name))
+                continue
+            name = member.name[len(ARCHIVE_ROOT):]
+            if name in done:
+                skipped += 1
+                continue
+
+            kind, _, path = name.partition('/')
+            if name == 'manifest.json':
+                manifest = json.load(tf.extractfile(member))
+                if manifest.get('format') != ARCHIVE_FORMAT:
+                    raise ArchiveError('Unknown archive format {0}'.format(
+                        manifest.get('format')))
+                _log.info('Importing data of MediaGoblin {0}'.format(
+                    manifest.get('mediagoblin')))
+
+            elif kind == 'database':
+                table = tables.get(path.split('/')[0])
+                if table is None:
+                    _log.warning(u'Skipping {0}, this instance has no such '
+                                 u'table'.format(name))
+                    continue
+                rows = [_decode_row(table, json.loads(line))
+                        for line in tf.extractfile(member)]
+                if rows:
+                    engine.execute(table.insert(), rows)
+                finish(name)
+
+            elif kind in stores:
+                # The tar stream moves on, so hand the writer a copy
+                spool = tempfile.SpooledTemporaryFile(COPY_CHUNK_SIZE)
+                shutil.copyfileobj(tf.extractfile(member), spool,
+                                   COPY_CHUNK_SIZE)
+                spool.seek(0)
+                filepath = clean_listy_filepath(path.split('/'))
+                pending.append((name, pool.apply_async(
+                    _store_file, (stores[kind], filepath, spool))))
+                while len(pending) >= jobs * 2:
+                    finish_oldest()
+
+            else:
+                _log.warning(u'Skipping {0}'.format(name))
+
+        while pending:
+            finish_oldest()
+    finally:
+        pool.terminate()
+        if record:
+            record.close()
+
+    _reset_sequences(engine, tables.values())
+    return len(imported), skipped
 
 
 def env_import(args):
     '''
-    Restore mongo database and media files from a tar archive
+    Restore the database and media files from a tar archive
     '''
-    if not args.cache_path:
-        args.cache_path = tempfile.mkdtemp()
-
-    setup_global_and_app_config(args.conf_file)
+    global_config, app_config = setup_global_and_app_config(args.conf_file)
 
     # Creates mg_globals.public_store and mg_globals.queue_store
     setup_storage()
 
-    global_config, app_config = setup_global_and_app_config(args.conf_file)
-    db = setup_connection_and_db_from_config(
-        app_config)
-
-    tf = tarfile.open(
-        args.tar_file,
-        mode='r|gz')
-
-    tf.extractall(args.cache_path)
-
-    args.cache_path = os.path.join(
-        args.cache_path, 'mediagoblin-data')
-    args = _setup_paths(args)
-
-    # Import database from extracted data
-    _import_database(db, args)
-
-    _import_media(db, args)
-
-    _clean(args)
-
-
-def _setup_paths(args):
-    '''
-    Populate ``args`` variable with cache subpaths
-    '''
-    args._cache_path = dict()
-    PATH_MAP = {
-        'media': 'media',
-        'queue': 'queue',
-        'database': 'database'}
-
-    for key, val in PATH_MAP.items():
-        args._cache_path[key] = os.path.join(args.cache_path, val)
-
-    return args
-
-
-def _create_archive(args):
-    '''
-    Create the tar archive
-    '''
-    _log.info('-> Compressing to archive')
-
-    tf = tarfile.open(
-        args.tar_file,
-        mode='w|gz')
-
-    with closing(tf):
-        tf.add(args.cache_path, 'mediagoblin-data/')
-
-    _log.info('...Archiving done')
+    load_models(app_config)
+    db = setup_connection_and_db_from_config(app_config)
 
+    stores = {'public': mg_globals.public_store,
+              'queue': mg_globals.queue_store}
+    start = time.time()
+    try:
+        with open(args.tar_file, 'rb') as tar_file:
+            imported, skipped = import_archive(
+                db.engine, stores, tar_file, max(args.jobs, 1),
+                args.checkpoint)
+    except ArchiveError as exc:
+        _log.error(exc)
+        sys.exit(1)
 
-def _clean(args):
-    '''
-    Remove cache directory
-    '''
-    shutil.rmtree(args.cache_path)
+    _log.info('Imported {0} parts of the archive in {1:.1f} seconds, '
+              'skipped {2} from the checkpoint'.format(
+                  imported, time.time() - start, skipped))
 
 
 def _export_check(args):
@@ -183,74 +421,25 @@ def _export_check(args):
     return True
 
 
-def _export_database(db, args):
-    _log.info('-> Exporting database...')
-
-    p = subprocess.Popen([
-            args.mongodump_path,
-            '-d', db.name,
-            '-o', args._cache_path['database']])
-
-    p.wait()
-
-    _log.info('...Database exported')
-
-
-def _export_media(db, args):
-    _log.info('-> Exporting media...')
-
-    media_cache = BasicFileStorage(
-        args._cache_path['media'])
-
-    # TODO: Add export of queue files
-    queue_cache = BasicFileStorage(args._cache_path['queue'])
-
-    for entry in db.MediaEntry.query.filter_by():
-        for name, path in entry.media_files.items():
-            _log.info(u'Exporting {0} - {1}'.format(
-                    entry.title,
-                    name))
-            try:
-                mc_file = media_cache.get_file(path, mode='wb')
-                mc_file.write(
-                    mg_globals.public_store.get_file(path, mode='rb').read())
-            except Exception as e:
-                _log.error('Failed: {0}'.format(e))
-
-    _log.info('...Media exported')
-
-
 def env_export(args):
     '''
-    Export database and media files to a tar archive
+    Export the database and media files to a tar archive
     '''
-    commands_util.check_unrecognized_args(args)
-    if args.cache_path:
-        if os.path.exists(args.cache_path):
-            _log.error('The cache directory must not exist '
-                       'before you run this script')
-            _log.error('Cache directory: {0}'.format(args.cache_path))
-
-            return False
-    else:
-        args.cache_path = tempfile.mkdtemp()
-
-    args = _setup_paths(args)
-
     if not _export_check(args):
         _log.error('Checks did not pass, exiting')
         sys.exit(0)
 
-    globa_config, app_config = setup_global_and_app_config(args.conf_file)
+    global_config, app_config = setup_global_and_app_config(args.conf_file)
 
     setup_storage()
 
+    load_models(app_config)
     db = setup_connection_and_db_from_config(app_config)
 
-    _export_database(db, args)
-
-    _export_media(db, args)
-
-    _create_archive(args)
+    stores = {'public': mg_globals.public_store,
+              'queue': mg_globals.queue_store}
+    start = time.time()
+    with open(args.tar_file, 'wb') as tar_file:
+        export_archive(db.engine, stores, tar_file, max(args.jobs, 1))
 
-    _clean(args)
+    _log.info('...Exported in {0:.1f} seconds'.format(time.time() - start))
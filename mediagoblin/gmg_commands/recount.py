@@ -0,0 +1,42 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.util import recount_user_media, recount_collection_items, \
+    recount_tag_media
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.pluginapi import hook_runall
+
+
+def recount_parser_setup(subparser):
+    pass
+
+
+def recount(args):
+    """
+    Rebuild the media counts of users and tags, the item counts of
+    collections and the counters of plugins from scratch
+    """
+    commands_util.setup_app(args)
+
+    recount_user_media(commit=False)
+    recount_tag_media(commit=False)
+    recount_collection_items(commit=False)
+    hook_runall('recount', commit=False)
+    Session.commit()
+
+    print "Counters rebuilt"
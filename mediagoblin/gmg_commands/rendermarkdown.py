@@ -0,0 +1,37 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from mediagoblin.db.util import render_stored_markdown
+from mediagoblin.gmg_commands import util as commands_util
+
+
+def rendermarkdown_parser_setup(subparser):
+    subparser.add_argument(
+        '--all', action='store_true', dest='everything',
+        help="Render all rows, not just those rendered by an older version")
+
+
+def rendermarkdown(args):
+    """
+    Store the html of descriptions, comments, notes and bios that were
+    rendered by an older version of the markdown renderer, or never.
+    """
+    commands_util.setup_app(args)
+
+    rendered = render_stored_markdown(everything=args.everything)
+
+    print "Rendered the markdown of %d rows" % rendered
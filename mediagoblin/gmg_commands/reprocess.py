@@ -14,11 +14,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import argparse
+import multiprocessing
 import os
+import time
 
 from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.init import setup_database, setup_workbench
 from mediagoblin.submit.lib import run_process_media
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.tools.pluginapi import hook_handle
@@ -34,6 +38,26 @@ def reprocess_parser_setup(subparser):
         action='store_true',
         help="Don't process eagerly, pass off to celery")
 
+    subparser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help="Number of worker processes to spread bulk_run, thumbs and "
+             "initial over")
+
+    subparser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=100,
+        help="Number of media entries handed to a worker at once")
+
+    subparser.add_argument(
+        '--checkpoint',
+        help="File to record finished media ids in.  Media already "
+             "listed there are skipped, so an interrupted run can be "
+             "resumed by passing the same file again.  Not with --celery, "
+             "which only queues the media")
+
     subparsers = subparser.add_subparsers(dest="reprocess_subcommand")
 
     ###################
@@ -187,11 +211,11 @@ def run(args, media_id=None):
         except ProcessorDoesNotExist:
             print 'No such processor "%s" for media with id "%s"' % (
                 args.reprocess_command, media_entry.id)
-            return
+            return False
         except ProcessorNotEligible:
             print 'Processor "%s" exists but media "%s" is not eligible' % (
                 args.reprocess_command, media_entry.id)
-            return
+            return False
 
         reprocess_parser = processor_class.generate_parser()
         reprocess_args = reprocess_parser.parse_args(args.reprocess_args)
@@ -204,6 +228,121 @@ def run(args, media_id=None):
     except ProcessingManagerDoesNotExist:
         entry = MediaEntry.query.filter_by(id=media_id).first()
         print 'No such processing manager for {0}'.format(entry.media_type)
+        return False
+
+
+def _init_worker():
+    """
+    Give each worker process its own database connection and workbench
+    """
+    Session.remove()
+    setup_database()
+    setup_workbench()
+
+
+def _process_chunk(chunk):
+    """
+    Run ``func(args, media_id)`` for every media id in the chunk.
+
+    func returns False if it skipped the media.  Returns a tuple of
+    the ids that were processed, the ids that failed and the ids that
+    were skipped.
+    """
+    func, args, media_ids = chunk
+    done = []
+    failed = []
+    skipped = []
+    for media_id in media_ids:
+        try:
+            result = func(args, media_id)
+        except Exception as exc:
+            print 'Reprocessing media "%s" failed: %r' % (media_id, exc)
+            Session.rollback()
+            failed.append(media_id)
+        else:
+            if result is False:
+                skipped.append(media_id)
+            else:
+                done.append(media_id)
+
+    return done, failed, skipped
+
+
+def _read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+
+    with open(path) as checkpoint:
+        return set(int(line) for line in checkpoint if line.strip())
+
+
+def bulk_process(args, query, func):
+    """
+    Run ``func(args, media_id)`` for every media entry in query.
+
+    With --jobs the ids are split into chunks of --chunk-size and spread
+    over a pool of worker processes.  Finished ids are appended to the
+    --checkpoint file (if given) after every chunk, and ids already in
+    there are skipped.  Media that failed or that func skipped is not
+    recorded, so it's tried again on the next run.
+    """
+    if args.checkpoint and args.celery:
+        # Queued media isn't reprocessed yet, it may still fail
+        print '--checkpoint can not be used with --celery'
+        return
+
+    skip = _read_checkpoint(args.checkpoint)
+    media_ids = [
+        media_id for (media_id,) in
+        query.with_entities(MediaEntry.id).order_by(MediaEntry.id)
+        if media_id not in skip]
+
+    chunk_size = max(args.chunk_size, 1)
+    chunks = [
+        (func, args, media_ids[i:i + chunk_size])
+        for i in range(0, len(media_ids), chunk_size)]
+
+    jobs = args.jobs
+    if jobs > 1 and args.celery:
+        print '--jobs is ignored when passing media off to celery'
+        jobs = 1
+
+    pool = None
+    if jobs > 1 and len(chunks) > 1:
+        # Don't let the workers inherit our database connections
+        Session.remove()
+        mg_globals.database.engine.dispose()
+        pool = multiprocessing.Pool(jobs, _init_worker)
+        results = pool.imap_unordered(_process_chunk, chunks)
+    else:
+        results = (_process_chunk(chunk) for chunk in chunks)
+
+    start = time.time()
+    done_count = 0
+    failed_count = 0
+    skipped_count = 0
+    checkpoint = open(args.checkpoint, 'a') if args.checkpoint else None
+    try:
+        for done, failed, skipped in results:
+            done_count += len(done)
+            failed_count += len(failed)
+            skipped_count += len(skipped)
+            if checkpoint:
+                checkpoint.writelines('%d\n' % media_id for media_id in done)
+                checkpoint.flush()
+            print 'Reprocessed %d of %d media' % (
+                done_count + failed_count + skipped_count, len(media_ids))
+    finally:
+        if pool:
+            pool.terminate()
+        if checkpoint:
+            checkpoint.close()
+
+    elapsed = time.time() - start
+    print 'Reprocessed %d media in %.1f seconds (%.2f per second), ' \
+        '%d failed, %d not eligible, %d skipped from checkpoint' % (
+            done_count, elapsed, done_count / elapsed if elapsed else 0,
+            failed_count, skipped_count, len(skip))
 
 
 def bulk_run(args):
@@ -213,8 +352,52 @@ def bulk_run(args):
     query = MediaEntry.query.filter_by(media_type=args.type,
                                        state=args.state)
 
-    for entry in query:
-        run(args, entry.id)
+    bulk_process(args, query, run)
+
+
+def thumb(args, media_id):
+    """
+    Regenerate the thumb for a single processed media
+    """
+    try:
+        media_entry, manager = get_entry_and_processing_manager(media_id)
+
+        # TODO: (maybe?) This could probably be handled entirely by the
+        # processor class...
+        try:
+            processor_class = manager.get_processor(
+                'resize', media_entry)
+        except ProcessorDoesNotExist:
+            print 'No such processor "%s" for media with id "%s"' % (
+                'resize', media_entry.id)
+            return False
+        except ProcessorNotEligible:
+            print 'Processor "%s" exists but media "%s" is not eligible' % (
+                'resize', media_entry.id)
+            return False
+
+        reprocess_parser = processor_class.generate_parser()
+
+        # prepare filetype and size to be passed into reprocess_parser
+        if args.size:
+            extra_args = 'thumb --{0} {1} {2}'.format(
+                processor_class.thumb_size,
+                args.size[0],
+                args.size[1])
+        else:
+            extra_args = 'thumb'
+
+        reprocess_args = reprocess_parser.parse_args(extra_args.split())
+        reprocess_request = processor_class.args_to_request(reprocess_args)
+        run_process_media(
+            media_entry,
+            reprocess_action='resize',
+            reprocess_info=reprocess_request)
+
+    except ProcessingManagerDoesNotExist:
+        entry = MediaEntry.query.filter_by(id=media_id).first()
+        print 'No such processing manager for {0}'.format(entry.media_type)
+        return False
 
 
 def thumbs(args):
@@ -223,44 +406,22 @@ def thumbs(args):
     """
     query = MediaEntry.query.filter_by(state='processed')
 
-    for entry in query:
-        try:
-            media_entry, manager = get_entry_and_processing_manager(entry.id)
-
-            # TODO: (maybe?) This could probably be handled entirely by the
-            # processor class...
-            try:
-                processor_class = manager.get_processor(
-                    'resize', media_entry)
-            except ProcessorDoesNotExist:
-                print 'No such processor "%s" for media with id "%s"' % (
-                    'resize', media_entry.id)
-                return
-            except ProcessorNotEligible:
-                print 'Processor "%s" exists but media "%s" is not eligible' % (
-                    'resize', media_entry.id)
-                return
-
-            reprocess_parser = processor_class.generate_parser()
-
-            # prepare filetype and size to be passed into reprocess_parser
-            if args.size:
-                extra_args = 'thumb --{0} {1} {2}'.format(
-                    processor_class.thumb_size,
-                    args.size[0],
-                    args.size[1])
-            else:
-                extra_args = 'thumb'
+    bulk_process(args, query, thumb)
 
-            reprocess_args = reprocess_parser.parse_args(extra_args.split())
-            reprocess_request = processor_class.args_to_request(reprocess_args)
-            run_process_media(
-                media_entry,
-                reprocess_action='resize',
-                reprocess_info=reprocess_request)
 
-        except ProcessingManagerDoesNotExist:
-            print 'No such processing manager for {0}'.format(entry.media_type)
+def initial_one(args, media_id):
+    """
+    Rerun initial processing for a single media
+    """
+    try:
+        media_entry, manager = get_entry_and_processing_manager(media_id)
+        run_process_media(
+            media_entry,
+            reprocess_action='initial')
+    except ProcessingManagerDoesNotExist:
+        entry = MediaEntry.query.filter_by(id=media_id).first()
+        print 'No such processing manager for {0}'.format(entry.media_type)
+        return False
 
 
 def initial(args):
@@ -269,14 +430,7 @@ def initial(args):
     """
     query = MediaEntry.query.filter_by(state='failed')
 
-    for entry in query:
-        try:
-            media_entry, manager = get_entry_and_processing_manager(entry.id)
-            run_process_media(
-                media_entry,
-                reprocess_action='initial')
-        except ProcessingManagerDoesNotExist:
-            print 'No such processing manager for {0}'.format(entry.media_type)
+    bulk_process(args, query, initial_one)
 
 
 def reprocess(args):
@@ -0,0 +1,125 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from mediagoblin.init.config import read_mediagoblin_config
+
+
+CELERY_CONFIG_MODULE = 'mediagoblin.init.celery.from_celery'
+
+
+def workers_parser_setup(subparser):
+    subparser.add_argument(
+        'queues', nargs='*',
+        help="Queues to start workers for (default: all of the "
+             "[processing] section)")
+    subparser.add_argument(
+        '--loglevel', default='info',
+        help="Log level of the workers")
+    subparser.add_argument(
+        '--beat', action='store_true',
+        help="Also run celery beat, for the periodic tasks of plugins")
+    subparser.add_argument(
+        '--dry-run', action='store_true',
+        help="Only show how the workers would be started")
+
+
+def worker_commands(global_config, queues=None, loglevel='info',
+                    beat=False):
+    """
+    Return a (queue, command) tuple for every celery worker to start:
+    one per processing queue, with the configured concurrency.  With
+    beat, the first worker also runs celery beat.
+    """
+    config = global_config['processing']
+    concurrency = config['worker_concurrency']
+
+    if not queues:
+        queues = set([config['default_queue']])
+        queues.update(config['queues'].values())
+        queues.update(concurrency.keys())
+        queues = sorted(queues)
+
+    commands = []
+    for queue in queues:
+        command = [
+            sys.executable, '-m', 'celery', 'worker',
+            '--queues', queue,
+            '--hostname', '{0}@%h'.format(queue),
+            '--loglevel', loglevel,
+            # Don't let a long transcode hold back jobs it prefetched
+            '-Ofair']
+        if queue in concurrency:
+            command.extend(['--concurrency', str(concurrency[queue])])
+        if beat and not commands:
+            # There must only be one beat, or tasks get scheduled twice
+            command.append('--beat')
+        commands.append((queue, command))
+    return commands
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+def workers(args):
+    """
+    Start celery workers for the processing queues and stop them all
+    as soon as one of them, or this command, exits.
+    """
+    global_config, validation_result = read_mediagoblin_config(
+        args.conf_file)
+    commands = worker_commands(global_config, args.queues, args.loglevel,
+                               args.beat)
+
+    env = dict(os.environ,
+               CELERY_CONFIG_MODULE=CELERY_CONFIG_MODULE,
+               MEDIAGOBLIN_CONFIG=os.path.abspath(args.conf_file))
+
+    if args.dry_run:
+        for queue, command in commands:
+            print 'CELERY_CONFIG_MODULE={0} MEDIAGOBLIN_CONFIG={1} {2}'.format(
+                env['CELERY_CONFIG_MODULE'], env['MEDIAGOBLIN_CONFIG'],
+                ' '.join(command))
+        return
+
+    signal.signal(signal.SIGTERM, _stop)
+    processes = []
+    try:
+        for queue, command in commands:
+            print 'Starting worker for queue {0}'.format(queue)
+            processes.append((queue, subprocess.Popen(command, env=env)))
+
+        while True:
+            for queue, process in processes:
+                if process.poll() is not None:
+                    print 'Worker for queue {0} exited, stopping all'.format(
+                        queue)
+                    return
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue, process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for queue, process in processes:
+            process.wait()
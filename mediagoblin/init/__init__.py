@@ -22,11 +22,13 @@ from mediagoblin.init.config import (
     read_mediagoblin_config, generate_validation_report)
 from mediagoblin import mg_globals
 from mediagoblin.mg_globals import setup_globals
+from mediagoblin.db.base import Session
 from mediagoblin.db.open import setup_connection_and_db_from_config, \
     check_db_migrations_current, load_models
 from mediagoblin.tools.pluginapi import hook_runall
 from mediagoblin.tools.workbench import WorkbenchManager
 from mediagoblin.storage import storage_system_from_config
+from mediagoblin.tools.cache import cache_from_config, listen_for_changes
 
 
 class Error(Exception):
@@ -149,6 +151,16 @@ def setup_storage():
     return public_store, queue_store
 
 
+def setup_cache():
+    cache = cache_from_config(mg_globals.global_config['cache'])
+    if cache is not None:
+        listen_for_changes(Session)
+
+    setup_globals(cache=cache)
+
+    return cache
+
+
 def setup_workbench():
     app_config = mg_globals.app_config
 
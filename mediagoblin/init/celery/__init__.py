@@ -54,6 +54,10 @@ def get_celery_settings_dict(app_config, global_config,
     celery_imports = celery_settings.setdefault('CELERY_IMPORTS', [])
     celery_imports.extend(MANDATORY_CELERY_IMPORTS)
 
+    # Plugins may add their own settings here, like periodic tasks
+    # (CELERYBEAT_SCHEDULE)
+    hook_runall('celery_settings', celery_settings)
+
     if force_celery_always_eager:
         celery_settings['CELERY_ALWAYS_EAGER'] = True
         celery_settings['CELERY_EAGER_PROPAGATES_EXCEPTIONS'] = True
@@ -33,12 +33,15 @@ def setup_plugins():
     global_config = mg_globals.global_config
     plugin_section = global_config.get('plugins', {})
 
+    pluginapi.profile_hooks(mg_globals.app_config.get('profile_hooks', False))
+
+    pman = pluginapi.PluginManager()
+
     if not plugin_section:
         _log.info("No plugins to load")
+        pman.compile_hooks()
         return
 
-    pman = pluginapi.PluginManager()
-
     # Go through and import all the modules that are subsections of
     # the [plugins] section and read in the hooks.
     for plugin_module, config in plugin_section.items():
@@ -58,5 +61,7 @@ def setup_plugins():
         if hasattr(plugin, 'hooks'):
             pman.register_hooks(plugin.hooks)
 
+    pman.compile_hooks()
+
     # Execute anything registered to the setup hook.
     pluginapi.hook_runall('setup')
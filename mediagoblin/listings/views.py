@@ -14,14 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mediagoblin import mg_globals
-from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.models import MediaEntry, Tag
 from mediagoblin.db.util import media_entries_for_tag_slug
+from mediagoblin.tools.feed import atom_feed_response, media_entry_item
 from mediagoblin.tools.pagination import Pagination
 from mediagoblin.tools.response import render_to_response
 from mediagoblin.decorators import uses_pagination
-
-from werkzeug.contrib.atom import AtomFeed
+from mediagoblin.meddleware.cache import cache_anonymous
 
 
 def _get_tag_name_from_entries(media_entries, tag_slug):
@@ -40,15 +39,23 @@ def _get_tag_name_from_entries(media_entries, tag_slug):
     return tag_name
 
 
+@cache_anonymous
 @uses_pagination
 def tag_listing(request, page):
     """'Gallery'/listing for this tag slug"""
     tag_slug = request.matchdict[u'tag']
 
-    cursor = media_entries_for_tag_slug(request.db, tag_slug)
+    cursor = MediaEntry.eager_query(
+        media_entries_for_tag_slug(request.db, tag_slug))
     cursor = cursor.order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    # Tags keep count of their processed media, no need to count them here
+    tag = Tag.query.filter_by(slug=tag_slug).first()
+
+    pagination = Pagination(page, cursor,
+                            keyset=(MediaEntry.created, MediaEntry.id),
+                            seek=request.GET.get('seek'),
+                            total_count=tag.media_count if tag else 0)
     media_entries = pagination()
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
@@ -62,9 +69,7 @@ def tag_listing(request, page):
          'pagination': pagination})
 
 
-ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
-
-
+@cache_anonymous
 def atom_feed(request):
     """
     generates the atom feed with the tag images
@@ -81,41 +86,7 @@ def atom_feed(request):
         link = request.urlgen('index', qualified=True)
         feed_title += "for all recent items"
 
-    atomlinks = [
-        {'href': link,
-         'rel': 'alternate',
-         'type': 'text/html'}]
-
-    if mg_globals.app_config["push_urls"]:
-        for push_url in mg_globals.app_config["push_urls"]:
-            atomlinks.append({
-                'rel': 'hub',
-                'href': push_url})
-
-    cursor = cursor.order_by(MediaEntry.created.desc())
-    cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
-
-    feed = AtomFeed(
-        feed_title,
-        feed_url=request.url,
-        id=link,
-        links=atomlinks)
-
-    for entry in cursor:
-        feed.add(entry.get('title'),
-            entry.description_html,
-            id=entry.url_for_self(request.urlgen,qualified=True),
-            content_type='html',
-            author={'name': entry.get_uploader.username,
-                'uri': request.urlgen(
-                    'mediagoblin.user_pages.user_home',
-                    qualified=True, user=entry.get_uploader.username)},
-            updated=entry.get('created'),
-            links=[{
-                'href':entry.url_for_self(
-                   request.urlgen,
-                   qualified=True),
-                'rel': 'alternate',
-                'type': 'text/html'}])
-
-    return feed.get_response()
+    return atom_feed_response(
+        request, MediaEntry.eager_query(cursor),
+        (MediaEntry.created, MediaEntry.id), media_entry_item,
+        feed_title, feed_id=link, link=link)
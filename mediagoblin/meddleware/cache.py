@@ -0,0 +1,82 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from werkzeug.wrappers import Response
+
+from mediagoblin import mg_globals
+from mediagoblin.meddleware import BaseMeddleware
+
+_log = logging.getLogger(__name__)
+
+
+def cache_anonymous(func):
+    """Decorate a Controller to cache its pages for anonymous visitors."""
+
+    func.cache_anonymous = True
+    return func
+
+
+class ResponseCacheMeddleware(BaseMeddleware):
+    """Page cache for visitors who are not logged in
+
+    Answers GET requests to controllers marked with cache_anonymous from
+    the cache (see mediagoblin.tools.cache) and stores their successful
+    responses.  Cached pages never carry cookies.
+    """
+
+    def process_request(self, request, controller):
+        request.page_cache_key = None
+
+        cache = mg_globals.cache
+        if (cache is None
+                or request.method not in ('GET', 'HEAD')
+                or not getattr(controller, 'cache_anonymous', False)
+                # A logged in user, or pending messages, or ...
+                or request.user is not None or request.session):
+            return None
+
+        request.page_cache_key = cache.make_key(
+            'page', request.url, request.locale,
+            mg_globals.app_config.get('theme'))
+
+        cached = cache.get(request.page_cache_key)
+        if cached is not None:
+            body, status, headers = cached
+            response = Response(body, status=status, headers=headers)
+            response.vary.add('Cookie')
+            # Answers with 304 if the page carries validators the
+            # client already has
+            return response.make_conditional(request)
+
+    def process_response(self, request, response):
+        if (not getattr(request, 'page_cache_key', None)
+                or response.status_code != 200
+                or not response.is_sequence
+                or 'Set-Cookie' in response.headers
+                or request.session.is_updated()):
+            return
+
+        body = response.get_data()
+        # Never hand out one visitor's CSRF token to everyone else
+        csrf_token = request.environ.get('CSRF_TOKEN')
+        if csrf_token and csrf_token.encode('utf-8') in body:
+            return
+
+        mg_globals.cache.set(
+            request.page_cache_key,
+            (body, response.status_code, list(response.headers)))
@@ -16,6 +16,7 @@
 
 import os
 import logging
+import shutil
 import tempfile
 
 from mediagoblin.tools.pluginapi import hook_handle
@@ -50,32 +51,88 @@ class MediaManagerBase(object):
         return hasattr(self, i)
 
 
-def sniff_media(media):
+#: How much of the start of an upload the 'sniff_magic' hooks get to see
+MAGIC_HEADER_SIZE = 4096
+
+
+def matches_magic(header, signatures):
+    """
+    Whether header has one of signatures, (offset, bytes) tuples, in place
+    """
+    return any(header[offset:offset + len(magic)] == magic
+               for offset, magic in signatures)
+
+
+def sniff_media(media, local_path=None):
     '''
     Iterate through the enabled media types and find those suited
     for a certain file.
+
+    If the upload has already been written out, pass its location as
+    local_path so the sniffers can read it from there.
+
+    The result is remembered on media, so an upload is only sniffed once
+    per request.
     '''
+    try:
+        media_type = media._mediagoblin_media_type
+    except AttributeError:
+        media_type = media._mediagoblin_media_type = _sniff_media_type(
+            media, local_path)
+
+    if media_type:
+        return media_type, hook_handle(('media_manager', media_type))
+
+    raise FileTypeNotSupported(
+        # TODO: Provide information on which file types are supported
+        _(u'Sorry, I don\'t support that file type :('))
+
 
+def _sniff_media_type(media, local_path):
+    """
+    Find the media type of media, from the cheapest test to the most
+    expensive: its file extension, the magic numbers at the start of the
+    file and finally the 'sniff_handler' hooks, which may need all of it.
+    """
     try:
-        return get_media_type_and_manager(media.filename)
+        return get_media_type_and_manager(media.filename)[0]
     except FileTypeNotSupported:
-        _log.info('No media handler found by file extension. Doing it the expensive way...')
+        pass
+
+    if local_path:
+        with open(local_path, 'rb') as media_file:
+            header = media_file.read(MAGIC_HEADER_SIZE)
+    else:
+        media.stream.seek(0)
+        header = media.stream.read(MAGIC_HEADER_SIZE)
+        media.stream.seek(0)
+
+    media_type = hook_handle('sniff_magic', header, media=media)
+    if media_type:
+        _log.info('{0} accepts the file by its magic numbers'.format(
+            media_type))
+        return media_type
+
+    _log.info('No media handler found by file extension or magic numbers. '
+              'Doing it the expensive way...')
+    if local_path:
+        media_file = open(local_path, 'rb')
+    else:
         # Create a temporary file for sniffers suchs as GStreamer-based
         # Audio video
         media_file = tempfile.NamedTemporaryFile()
-        media_file.write(media.stream.read())
+        media.stream.seek(0)
+        shutil.copyfileobj(media.stream, media_file, length=4*1048576)
+        media_file.flush()
         media.stream.seek(0)
 
+    with media_file:
         media_type = hook_handle('sniff_handler', media_file, media=media)
-        if media_type:
-            _log.info('{0} accepts the file'.format(media_type))
-            return media_type, hook_handle(('media_manager', media_type))
-        else:
-            _log.debug('{0} did not accept the file'.format(media_type))
-
-    raise FileTypeNotSupported(
-        # TODO: Provide information on which file types are supported
-        _(u'Sorry, I don\'t support that file type :('))
+    if media_type:
+        _log.info('{0} accepts the file'.format(media_type))
+    else:
+        _log.debug('No media type accepted the file')
+    return media_type
 
 
 def get_media_type_and_manager(filename):
@@ -90,8 +147,10 @@ def get_media_type_and_manager(filename):
 
         # Omit the dot from the extension and match it against
         # the media manager
-        if hook_handle('get_media_type_and_manager', ext[1:]):
-            return hook_handle('get_media_type_and_manager', ext[1:])
+        media_type_and_manager = hook_handle(
+            'get_media_type_and_manager', ext[1:])
+        if media_type_and_manager:
+            return media_type_and_manager
     else:
         _log.info('File {0} has no file extension, let\'s hope the sniffers get it.'.format(
             filename))
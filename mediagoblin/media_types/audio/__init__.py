@@ -16,7 +16,7 @@
 
 from mediagoblin.media_types import MediaManagerBase
 from mediagoblin.media_types.audio.processing import AudioProcessingManager, \
-    sniff_handler
+    sniff_handler, sniff_magic
 from mediagoblin.tools import pluginapi
 
 # Why isn't .ogg in this list?  It's still detected, but via sniffing,
@@ -44,6 +44,7 @@ hooks = {
     'setup': setup_plugin,
     'get_media_type_and_manager': get_media_type_and_manager,
     'sniff_handler': sniff_handler,
+    'sniff_magic': sniff_magic,
     ('media_manager', MEDIA_TYPE): lambda: AudioMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: AudioProcessingManager,
 }
@@ -19,6 +19,7 @@ import logging
 import os
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types import matches_magic
 from mediagoblin.processing import (
     BadMediaFail, FilenameBuilder,
     ProgressCallback, MediaProcessor, ProcessingManager,
@@ -32,6 +33,33 @@ _log = logging.getLogger(__name__)
 
 MEDIA_TYPE = 'mediagoblin.media_types.audio'
 
+MAGIC_SIGNATURES = [
+    (0, 'ID3'),  # mp3 with id3v2 tags
+    (0, '\xff\xfb'),  # mp3 frames, without tags
+    (0, '\xff\xf3'),
+    (0, '\xff\xf2'),
+    (0, 'fLaC'),
+    (8, 'WAVE'),
+    (8, 'AIFF'),
+    (8, 'M4A '),  # mp4 brands of audio only files
+    (8, 'M4B '),
+    ]
+
+# The codecs' identification headers in the first page of an Ogg file
+OGG_AUDIO_CODECS = ['\x01vorbis', 'OpusHead', '\x7fFLAC']
+
+
+def sniff_magic(header, **kw):
+    # Ogg is audio unless one of the streams is theora (see the video type)
+    if header.startswith('OggS'):
+        if '\x80theora' not in header and any(
+                codec in header for codec in OGG_AUDIO_CODECS):
+            return MEDIA_TYPE
+    elif matches_magic(header, MAGIC_SIGNATURES):
+        return MEDIA_TYPE
+
+    return None
+
 
 def sniff_handler(media_file, **kw):
     _log.info('Sniffing {0}'.format(MEDIA_TYPE))
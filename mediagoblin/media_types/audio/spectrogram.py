@@ -25,6 +25,7 @@ except ImportError:
     import Image
 import math
 import numpy
+from numpy.lib.stride_tricks import as_strided
 
 try:
     import scikits.audiolab as audiolab
@@ -36,22 +37,27 @@ class AudioProcessingException(Exception):
     pass
 
 
+# How many samples AudioProcessor.db_spectra transforms at once
+MAX_CHUNK_SAMPLES = 2 ** 20
+
+
+COLORS = [
+    (0, 0, 0, 0),
+    (58 / 4, 68 / 4, 65 / 4, 255),
+    (80 / 2, 100 / 2, 153 / 2, 255),
+    (90, 180, 100, 255),
+    (224, 224, 44, 255),
+    (255, 60, 30, 255),
+    (255, 255, 255, 255)
+ ]
+
+
 class SpectrogramImage(object):
-    def __init__(self, image_size, fft_size):
+    def __init__(self, image_size, fft_size, palette=None):
         self.image_width, self.image_height = image_size
         self.fft_size = fft_size
 
-        colors = [
-            (0, 0, 0, 0),
-            (58 / 4, 68 / 4, 65 / 4, 255),
-            (80 / 2, 100 / 2, 153 / 2, 255),
-            (90, 180, 100, 255),
-            (224, 224, 44, 255),
-            (255, 60, 30, 255),
-            (255, 255, 255, 255)
-         ]
-
-        self.palette = interpolate_colors(colors)
+        self.palette = palette or interpolate_colors(COLORS)
 
         # Generate lookup table for y-coordinate from fft-bin
         self.y_to_bin = []
@@ -75,28 +81,37 @@ class SpectrogramImage(object):
 
                 self.y_to_bin.append((int(fft_bin), alpha * 255))
 
-        # this is a bit strange, but using image.load()[x,y] = ... is
-        # a lot slower than using image.putadata and then rotating the image
-        # so we store all the pixels in an array and then create the image when saving
-        self.pixels = []
+        # numpy lookups for draw_spectra: the bins, their weights and
+        # the palette as RGBA, clamped like Image.putdata does
+        self.bins = numpy.array([index for index, alpha in self.y_to_bin],
+                                dtype=numpy.intp)
+        self.alphas = numpy.array([alpha for index, alpha in self.y_to_bin])
+        self.lut = numpy.array(
+                [color + (255,) for color in self.palette]).clip(
+                0, 255).astype(numpy.uint8)
+
+        # One row of pixels per x-coordinate, rotated when saving.
+        # Where the FFT is too small to fill up the image, it stays black.
+        self.pixels = numpy.empty(
+                (self.image_width, self.image_height, 4),
+                dtype=numpy.uint8)
+        self.pixels[:] = self.lut[0]
 
     def draw_spectrum(self, x, spectrum):
-        # for all frequencies, draw the pixels
-        for index, alpha in self.y_to_bin:
-            self.pixels.append(
-                    self.palette[int((255.0 - alpha) * spectrum[index]
-                        + alpha * spectrum[index + 1])])
-
-        # if the FFT is too small to fill up the image, fill with black to the top
-        for y in range(len(self.y_to_bin), self.image_height):
-            self.pixels.append(self.palette[0])
+        self.draw_spectra(x, spectrum[numpy.newaxis])
+
+    def draw_spectra(self, x, spectra):
+        """
+        Draw the columns x, x + 1, ... from a 2-D array of db spectra,
+        one spectrum per row
+        """
+        values = ((255.0 - self.alphas) * spectra[:, self.bins]
+                  + self.alphas * spectra[:, self.bins + 1])
+        self.pixels[x:x + len(spectra), :len(self.bins)] = \
+            self.lut[values.astype(numpy.intp)]
 
     def save(self, filename, quality=90):
-        self.image = Image.new(
-                'RGBA',
-                (self.image_height, self.image_width))
-
-        self.image.putdata(self.pixels)
+        self.image = Image.fromarray(self.pixels, 'RGBA')
         self.image.transpose(Image.ROTATE_90).save(
                 filename,
                 quality=quality)
@@ -168,7 +183,7 @@ class AudioProcessor(object):
 
         if resize_if_less and (add_to_start > 0 or add_to_end > 0):
             if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=1)
+                samples = numpy.concatenate((numpy.zeros(add_to_start), samples))
 
             if add_to_end > 0:
                 samples = numpy.resize(samples, size)
@@ -196,7 +211,7 @@ class AudioProcessor(object):
         if energy > 1e-60:
             # calculate the spectral centroid
 
-            if self.spectrum_range == None:
+            if self.spectrum_range is None:
                 self.spectrum_range = numpy.arange(length)
 
             spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.audio_file.samplerate * 0.5
@@ -206,6 +221,69 @@ class AudioProcessor(object):
 
         return (spectral_centroid, db_spectrum)
 
+    def db_spectra(self, seek_points, spec_range=110.0, max_samples=None):
+        """
+        Calculate the db spectra of the fft_size samples around each of
+        the (ascending) seek_points, like spectral_centroid does.
+
+        Yields (index of the first seek point, 2-D array of spectra)
+        pairs, for batches of at most max_samples (MAX_CHUNK_SAMPLES by
+        default) samples that go through a single FFT.
+        """
+        if max_samples is None:
+            max_samples = MAX_CHUNK_SAMPLES
+
+        batch_size = max(1, max_samples / self.fft_size)
+
+        for first in range(0, len(seek_points), batch_size):
+            samples = self._read_windows(
+                seek_points[first:first + batch_size] - self.fft_size / 2)
+            samples *= self.window
+
+            spectra = self.scale * numpy.abs(numpy.fft.rfft(samples))
+
+            yield first, ((20 * (numpy.log10(spectra + 1e-60))).clip(
+                -spec_range, 0.0) + spec_range) / spec_range
+
+    def _read_windows(self, starts):
+        """ read fft_size samples at each of starts, one window per row """
+        span = starts[-1] - starts[0] + self.fft_size
+
+        if span > 2 * len(starts) * self.fft_size:
+            # Far apart, reading everything in between would be a waste
+            return numpy.vstack([self._read_chunk(start, self.fft_size)
+                                 for start in starts])
+
+        # Read once and take the windows from a view of all of them
+        chunk = self._read_chunk(starts[0], span)
+        windows = as_strided(
+            chunk,
+            shape=(span - self.fft_size + 1, self.fft_size),
+            strides=(chunk.strides[0], chunk.strides[0]))
+        return windows[starts - starts[0]]
+
+    def _read_chunk(self, start, size):
+        """ like read(start, size, True), but not confined to the file """
+        chunk = numpy.zeros(size)
+
+        begin = max(start, 0)
+        end = min(start + size, self.audio_file.nframes)
+        if end > begin:
+            self.audio_file.seek(begin)
+            try:
+                samples = self.audio_file.read_frames(end - begin)
+            except RuntimeError:
+                # this can happen for wave files with broken headers...
+                return chunk
+
+            # convert to mono by selecting left channel only
+            if self.audio_file.channels > 1:
+                samples = samples[:,0]
+
+            chunk[begin - start:end - start] = samples
+
+        return chunk
+
 
     def peaks(self, start_seek, end_seek):
         """ read all samples between start_seek and end_seek, then find the minimum and maximum peak
@@ -255,28 +333,27 @@ class AudioProcessor(object):
 
 
 def create_spectrogram_image(source_filename, output_filename,
-        image_size, fft_size, progress_callback=None):
+        image_size, fft_size, progress_callback=None,
+        window_function=numpy.hamming, palette=None, quality=90):
 
-    processor = AudioProcessor(source_filename, fft_size, numpy.hamming)
+    processor = AudioProcessor(source_filename, fft_size, window_function)
     samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
 
-    spectrogram = SpectrogramImage(image_size, fft_size)
+    spectrogram = SpectrogramImage(image_size, fft_size, palette)
 
-    for x in range(image_size[0]):
-        if progress_callback and x % (image_size[0] / 10) == 0:
-            progress_callback((x * 100) / image_size[0])
-
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
+    seek_points = (numpy.arange(image_size[0]) * samples_per_pixel).astype(
+        numpy.intp)
 
-        (spectral_centroid, db_spectrum) = processor.spectral_centroid(seek_point)
+    for x, db_spectra in processor.db_spectra(seek_points):
+        if progress_callback:
+            progress_callback((x * 100) / image_size[0])
 
-        spectrogram.draw_spectrum(x, db_spectrum)
+        spectrogram.draw_spectra(x, db_spectra)
 
     if progress_callback:
         progress_callback(100)
 
-    spectrogram.save(output_filename)
+    spectrogram.save(output_filename, quality=quality)
 
 
 def interpolate_colors(colors, flat=False, num_colors=256):
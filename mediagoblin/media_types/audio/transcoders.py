@@ -21,7 +21,7 @@ except ImportError:
     import Image
 
 from mediagoblin.processing import BadMediaFail
-from mediagoblin.media_types.audio import audioprocessing
+from mediagoblin.media_types.audio import audioprocessing, spectrogram
 
 
 _log = logging.getLogger(__name__)
@@ -73,30 +73,15 @@ class AudioThumbnailer(object):
         fft_size = kw.get('fft_size', 2048)
         callback = kw.get('progress_callback')
 
-        processor = audioprocessing.AudioProcessor(
+        spectrogram.create_spectrogram_image(
             src,
+            dst,
+            (width, height),
             fft_size,
-            numpy.hanning)
-
-        samples_per_pixel = processor.audio_file.nframes / float(width)
-
-        spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
-
-        for x in range(width):
-            if callback and x % (width / 10) == 0:
-                callback((x * 100) / width)
-
-            seek_point = int(x * samples_per_pixel)
-
-            (spectral_centroid, db_spectrum) = processor.spectral_centroid(
-                seek_point)
-
-            spectrogram.draw_spectrum(x, db_spectrum)
-
-        if callback:
-            callback(100)
-
-        spectrogram.save(dst)
+            callback,
+            numpy.hanning,
+            audioprocessing.interpolate_colors(spectrogram.COLORS),
+            quality=80)
 
     def thumbnail_spectrogram(self, src, dst, thumb_size):
         '''
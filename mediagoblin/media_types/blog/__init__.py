@@ -20,6 +20,7 @@ _log = logging.getLogger(__name__)
 
 from mediagoblin.media_types import MediaManagerBase
 from mediagoblin.media_types.blog.models import Blog, BlogPostData
+from mediagoblin.media_types.blog.lib import recount_blog_posts
 
 from mediagoblin.tools import pluginapi
 
@@ -89,6 +90,7 @@ hooks = {
     'setup': setup_plugin,
     'get_media_type_and_manager': get_media_type_and_manager,
     ('media_manager', MEDIA_TYPE): lambda: BlogPostMediaManager,
+    'recount': recount_blog_posts,
 }
 
 
@@ -13,8 +13,12 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import func, select
+
 from mediagoblin.db.base import Session
 
+
 def check_blog_slug_used(author_id, slug, ignore_b_id=None):
     from mediagoblin.media_types.blog.models import Blog
     query = Blog.query.filter_by(author=author_id, slug=slug)
@@ -40,7 +44,7 @@ def get_all_blogposts_of_blog(request, blog, state=None):
 
     # next line is just providing shortcuts
     MediaEntry, BlogPostData = request.db.MediaEntry, request.db.BlogPostData
-    blog_posts = Session.query(MediaEntry).join(BlogPostData)\
+    blog_posts = MediaEntry.eager_query().join(BlogPostData)\
 	.filter(BlogPostData.blog == blog.id)
     if state is not None:
  	blog_posts = blog_posts.filter(MediaEntry.state==state)
@@ -48,3 +52,15 @@ def get_all_blogposts_of_blog(request, blog, state=None):
     return blog_posts
 
 
+
+
+def recount_blog_posts(commit=True):
+    """Recompute the number of posts of all blogs"""
+    from mediagoblin.media_types.blog.models import Blog, BlogPostData
+    blogs = Blog.__table__
+    posts = BlogPostData.__table__
+    Session.execute(blogs.update().values(
+        post_count=select([func.count(posts.c.media_entry)]).where(
+            posts.c.blog == blogs.c.id).as_scalar()))
+    if commit:
+        Session.commit()
@@ -0,0 +1,39 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from sqlalchemy import MetaData, Column, Integer, func, select
+
+from mediagoblin.db.migration_tools import RegisterMigration, inspect_table
+
+MIGRATIONS = {}
+
+
+@RegisterMigration(1, MIGRATIONS)
+def add_blog_post_count(db):
+    """Add post_count to Blog and count the current posts"""
+    metadata = MetaData(bind=db.bind)
+    blog_table = inspect_table(metadata, "mediatype__blogs")
+    post_table = inspect_table(metadata, "blogpost__mediadata")
+
+    col = Column('post_count', Integer, default=0)
+    col.create(blog_table)
+
+    db.execute(blog_table.update().values(
+        post_count=select([func.count(post_table.c.media_entry)]).where(
+            post_table.c.blog == blog_table.c.id).as_scalar()))
+
+    db.commit()
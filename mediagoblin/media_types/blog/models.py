@@ -17,7 +17,7 @@
 import datetime
 
 from mediagoblin.db.base import Base
-from mediagoblin.db.models import Collection, User, MediaEntry
+from mediagoblin.db.models import Collection, User, MediaEntry, change_count
 from mediagoblin.db.mixin import GenerateSlugMixin
 
 from mediagoblin.media_types.blog.lib import check_blog_slug_used
@@ -25,7 +25,7 @@ from mediagoblin.media_types.blog.lib import check_blog_slug_used
 from mediagoblin.tools.text import cleaned_markdown_conversion
 
 from sqlalchemy import (
-    Column, Integer, ForeignKey, Unicode, UnicodeText, DateTime)
+    Column, Integer, ForeignKey, Unicode, UnicodeText, DateTime, event)
 from sqlalchemy.orm import relationship, backref
 
 
@@ -41,6 +41,9 @@ class Blog(Base, BlogMixin):
     author = Column(Integer, ForeignKey(User.id), nullable=False, index=True) #similar to uploader
     created = Column(DateTime, nullable=False, default=datetime.datetime.now, index=True)
     slug = Column(Unicode)
+    # Number of posts, drafts included.  Kept up to date by the
+    # BlogPostData events below.
+    post_count = Column(Integer, default=0)
 
     
 BACKREF_NAME = "blogpost__media_data"
@@ -56,5 +59,16 @@ class BlogPostData(Base):
                         cascade="all, delete-orphan"))
 
 
+
+@event.listens_for(BlogPostData, 'after_insert')
+def _count_blog_post(mapper, connection, post_data):
+    change_count(connection, Blog, 'post_count', post_data.blog, 1)
+
+
+@event.listens_for(BlogPostData, 'before_delete')
+def _uncount_blog_post(mapper, connection, post_data):
+    change_count(connection, Blog, 'post_count', post_data.blog, -1)
+
+
 DATA_MODEL = BlogPostData
 MODELS = [BlogPostData, Blog]
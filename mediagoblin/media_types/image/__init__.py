@@ -18,7 +18,7 @@ import logging
 
 from mediagoblin.media_types import MediaManagerBase
 from mediagoblin.media_types.image.processing import sniff_handler, \
-        ImageProcessingManager
+        sniff_magic, ImageProcessingManager
 
 
 _log = logging.getLogger(__name__)
@@ -67,6 +67,7 @@ def get_media_type_and_manager(ext):
 hooks = {
     'get_media_type_and_manager': get_media_type_and_manager,
     'sniff_handler': sniff_handler,
+    'sniff_magic': sniff_magic,
     ('media_manager', MEDIA_TYPE): lambda: ImageMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: ImageProcessingManager,
 }
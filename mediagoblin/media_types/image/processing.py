@@ -21,8 +21,12 @@ except ImportError:
 import os
 import logging
 import argparse
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types import matches_magic
 from mediagoblin.processing import (
     BadMediaFail, FilenameBuilder,
     MediaProcessor, ProcessingManager,
@@ -43,6 +47,62 @@ PIL_FILTERS = {
 MEDIA_TYPE = 'mediagoblin.media_types.image'
 
 
+def get_resize_filter(filter):
+    """
+    Look up the PIL filter for the config/command line name ``filter``
+    """
+    try:
+        return PIL_FILTERS[filter.upper()]
+    except KeyError:
+        raise Exception('Filter "{0}" not found, choose one of {1}'.format(
+            unicode(filter),
+            u', '.join(PIL_FILTERS.keys())))
+
+
+def fit_size(size, new_size):
+    """
+    Return the size an image of ``size`` gets when thumbnailed into the
+    ``new_size`` box, keeping its aspect ratio (like Image.thumbnail).
+    """
+    x, y = size
+    if x > new_size[0]:
+        y = int(max(y * new_size[0] / x, 1))
+        x = int(new_size[0])
+    if y > new_size[1]:
+        x = int(max(x * new_size[1] / y, 1))
+        y = int(new_size[1])
+    return x, y
+
+
+def draft_size(size, new_size, swaps_axes=False):
+    """
+    The smallest size to decode an image of ``size`` at, so that it
+    can still be thumbnailed into the ``new_size`` box.  If it's going
+    to be rotated by 90 or 270 degrees (``swaps_axes``), that has to
+    hold for the rotated image too.
+    """
+    x, y = fit_size(size, new_size)
+    if swaps_axes:
+        rotated_y, rotated_x = fit_size((size[1], size[0]), new_size)
+        x, y = max(x, rotated_x), max(y, rotated_y)
+    return x, y
+
+
+def save_resized(entry, resized, keyname, target_name, workdir, quality,
+                 format=None):
+    """
+    Save an already resized image to the workdir and store it publicly
+
+    ``format`` is the PIL format to save in; if it is not given PIL
+    guesses it from the extension of ``target_name``.
+    """
+    # Copy the new file to the conversion subdir, then remotely.
+    tmp_resized_filename = os.path.join(workdir, target_name)
+    with file(tmp_resized_filename, 'w') as resized_file:
+        resized.save(resized_file, format=format, quality=quality)
+    store_public(entry, keyname, tmp_resized_filename, target_name)
+
+
 def resize_image(entry, resized, keyname, target_name, new_size,
                  exif_tags, workdir, quality, filter):
     """
@@ -59,22 +119,125 @@ def resize_image(entry, resized, keyname, target_name, new_size,
     quality -- level of compression used when resizing images
     filter -- One of BICUBIC, BILINEAR, NEAREST, ANTIALIAS
     """
+    format = resized.format
     resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
-
-    try:
-        resize_filter = PIL_FILTERS[filter.upper()]
-    except KeyError:
-        raise Exception('Filter "{0}" not found, choose one of {1}'.format(
-            unicode(filter),
-            u', '.join(PIL_FILTERS.keys())))
+    resize_filter = get_resize_filter(filter)
 
     resized.thumbnail(new_size, resize_filter)
 
-    # Copy the new file to the conversion subdir, then remotely.
-    tmp_resized_filename = os.path.join(workdir, target_name)
-    with file(tmp_resized_filename, 'w') as resized_file:
-        resized.save(resized_file, quality=quality)
-    store_public(entry, keyname, tmp_resized_filename, target_name)
+    save_resized(entry, resized, keyname, target_name, workdir, quality,
+                 format)
+
+
+class ResizePipeline(object):
+    """
+    Create several resized versions of one image from a single decode.
+
+    Add every wanted derivative with add(), then call run().  The
+    original is opened once; JPEGs are decoded in draft mode so libjpeg
+    already scales them down to what the largest derivative needs.  The
+    orientation is fixed once, and each derivative is resized from the
+    next larger one (the thumbnail from the medium) instead of from the
+    full original.  Only after everything is resized are the files
+    written out and stored.
+
+    After run(), ``timings`` maps each stage name to the seconds spent
+    in it.
+    """
+    def __init__(self, orig_file, exif_tags, quality, filter):
+        self.orig_file = orig_file
+        self.exif_tags = exif_tags
+        self.quality = quality
+        self.resize_filter = get_resize_filter(filter)
+        self.derivatives = []
+        self.timings = OrderedDict()
+
+    def add(self, keyname, target_name, new_size, force=False):
+        """
+        Request a derivative stored under ``keyname``.
+
+        Unless ``force`` is set, the derivative is only created if the
+        original is bigger than ``new_size`` or needs rotation.
+        """
+        self.derivatives.append(
+            (unicode(keyname), target_name, tuple(new_size), force))
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0) + \
+                time.time() - start
+
+    def run(self, entry, workdir):
+        with self._timed('open'):
+            try:
+                im = Image.open(self.orig_file)
+            except IOError:
+                raise BadMediaFail()
+
+        needs_rotation = exif_image_needs_rotation(self.exif_tags)
+        # See exif_fix_image_orientation
+        swaps_axes = needs_rotation and \
+            self.exif_tags['Image Orientation'].values[0] in (6, 8)
+        wanted = [
+            (keyname, target_name, new_size)
+            for keyname, target_name, new_size, force in self.derivatives
+            if force
+            or im.size[0] > new_size[0]
+            or im.size[1] > new_size[1]
+            or needs_rotation]
+        if not wanted:
+            return
+
+        # Largest first, so that every derivative can be made from the
+        # previous one.
+        wanted.sort(key=lambda d: d[2], reverse=True)
+
+        format = im.format
+        with self._timed('decode'):
+            if format == 'JPEG':
+                im.draft(None, draft_size(im.size, (
+                    max(d[2][0] for d in wanted),
+                    max(d[2][1] for d in wanted)), swaps_axes))
+            try:
+                im.load()
+            except IOError:
+                raise BadMediaFail()
+            im = exif_fix_image_orientation(im, self.exif_tags)
+
+        resized_images = []
+        source, source_size = im, None
+        for keyname, target_name, new_size in wanted:
+            with self._timed('resize:' + keyname):
+                if source_size is None or source_size[0] < new_size[0] \
+                        or source_size[1] < new_size[1]:
+                    source = im
+                resized = source.copy()
+                resized.thumbnail(new_size, self.resize_filter)
+            resized_images.append((keyname, target_name, resized))
+            source, source_size = resized, new_size
+
+        for keyname, target_name, resized in resized_images:
+            with self._timed('store:' + keyname):
+                save_resized(entry, resized, keyname, target_name,
+                             workdir, self.quality, format)
+
+        _log.debug('Resized {0} in {1}'.format(
+            ', '.join(d[0] for d in wanted),
+            ', '.join('{0}: {1:.3f}s'.format(stage, seconds)
+                      for stage, seconds in self.timings.items())))
+
+
+def get_default_size(keyname):
+    """
+    Get the configured (max_width, max_height) for ``keyname``
+    """
+    max_width = mgg.global_config['media:' + keyname]['max_width']
+    max_height = mgg.global_config['media:' + keyname]['max_height']
+    return (max_width, max_height)
 
 
 def resize_tool(entry,
@@ -82,31 +245,43 @@ def resize_tool(entry,
                 conversions_subdir, exif_tags, quality, filter, new_size=None):
     # Use the default size if new_size was not given
     if not new_size:
-        max_width = mgg.global_config['media:' + keyname]['max_width']
-        max_height = mgg.global_config['media:' + keyname]['max_height']
-        new_size = (max_width, max_height)
+        new_size = get_default_size(keyname)
 
     # If the size of the original file exceeds the specified size for the desized
     # file, a target_name file is created and later associated with the media
     # entry.
     # Also created if the file needs rotation, or if forced.
-    try:
-        im = Image.open(orig_file)
-    except IOError:
-        raise BadMediaFail()
-    if force \
-        or im.size[0] > new_size[0]\
-        or im.size[1] > new_size[1]\
-        or exif_image_needs_rotation(exif_tags):
-        resize_image(
-            entry, im, unicode(keyname), target_name,
-            tuple(new_size),
-            exif_tags, conversions_subdir,
-            quality, filter)
+    pipeline = ResizePipeline(orig_file, exif_tags, quality, filter)
+    pipeline.add(keyname, target_name, new_size, force)
+    pipeline.run(entry, conversions_subdir)
 
 
 SUPPORTED_FILETYPES = ['png', 'gif', 'jpg', 'jpeg', 'tiff']
 
+MAGIC_SIGNATURES = [
+    (0, '\xff\xd8\xff'),  # jpeg
+    (0, '\x89PNG\r\n\x1a\n'),
+    (0, 'GIF87a'),
+    (0, 'GIF89a'),
+    (0, 'II*\x00'),  # tiff, little endian
+    (0, 'MM\x00*'),  # tiff, big endian
+    ]
+
+# Extensions for files that were only recognized by their magic bytes
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'TIFF': '.tiff',
+    }
+
+
+def sniff_magic(header, **kw):
+    if matches_magic(header, MAGIC_SIGNATURES):
+        return MEDIA_TYPE
+
+    return None
+
 
 def sniff_handler(media_file, **kw):
     _log.info('Sniffing {0}'.format(MEDIA_TYPE))
@@ -151,32 +326,64 @@ class CommonImageProcessor(MediaProcessor):
         self.process_filename = get_process_filename(
             self.entry, self.workbench, self.acceptable_files)
         self.name_builder = FilenameBuilder(self.process_filename)
+        if self.name_builder.ext[1:] not in SUPPORTED_FILETYPES:
+            # Sniffed by magic; name the stored files after the real format
+            try:
+                format = Image.open(self.process_filename).format
+            except IOError:
+                format = None
+            self.name_builder.ext = FORMAT_EXTENSIONS.get(
+                format, self.name_builder.ext)
 
         # Exif extraction
         self.exif_tags = extract_exif(self.process_filename)
 
-    def generate_medium_if_applicable(self, size=None, quality=None,
-                                      filter=None):
+        # Seconds spent per resize stage, filled by _run_pipeline
+        self.timings = OrderedDict()
+
+    def _resize_pipeline(self, quality=None, filter=None):
         if not quality:
             quality = self.image_config['quality']
         if not filter:
             filter = self.image_config['resize_filter']
 
-        resize_tool(self.entry, False, 'medium', self.process_filename,
-                    self.name_builder.fill('{basename}.medium{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+        return ResizePipeline(self.process_filename, self.exif_tags,
+                              quality, filter)
+
+    def _add_medium(self, pipeline, size=None):
+        pipeline.add('medium',
+                     self.name_builder.fill('{basename}.medium{ext}'),
+                     size or get_default_size('medium'))
+
+    def _add_thumb(self, pipeline, size=None):
+        pipeline.add('thumb',
+                     self.name_builder.fill('{basename}.thumbnail{ext}'),
+                     size or get_default_size('thumb'), force=True)
+
+    def _run_pipeline(self, pipeline):
+        pipeline.run(self.entry, self.conversions_subdir)
+        self.timings.update(pipeline.timings)
+
+    def generate_medium_if_applicable(self, size=None, quality=None,
+                                      filter=None):
+        pipeline = self._resize_pipeline(quality, filter)
+        self._add_medium(pipeline, size)
+        self._run_pipeline(pipeline)
 
     def generate_thumb(self, size=None, quality=None, filter=None):
-        if not quality:
-            quality = self.image_config['quality']
-        if not filter:
-            filter = self.image_config['resize_filter']
+        pipeline = self._resize_pipeline(quality, filter)
+        self._add_thumb(pipeline, size)
+        self._run_pipeline(pipeline)
 
-        resize_tool(self.entry, True, 'thumb', self.process_filename,
-                    self.name_builder.fill('{basename}.thumbnail{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+    def generate_medium_and_thumb(self, size=None, thumb_size=None,
+                                  quality=None, filter=None):
+        """
+        Generate medium (if applicable) and thumb from one decode
+        """
+        pipeline = self._resize_pipeline(quality, filter)
+        self._add_medium(pipeline, size)
+        self._add_thumb(pipeline, thumb_size)
+        self._run_pipeline(pipeline)
 
     def copy_original(self):
         copy_original(
@@ -256,9 +463,8 @@ class InitialProcessor(CommonImageProcessor):
 
     def process(self, size=None, thumb_size=None, quality=None, filter=None):
         self.common_setup()
-        self.generate_medium_if_applicable(size=size, filter=filter,
-                                           quality=quality)
-        self.generate_thumb(size=thumb_size, filter=filter, quality=quality)
+        self.generate_medium_and_thumb(size=size, thumb_size=thumb_size,
+                                       filter=filter, quality=quality)
         self.copy_original()
         self.extract_metadata()
         self.delete_queue_file()
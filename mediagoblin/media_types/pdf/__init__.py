@@ -16,7 +16,7 @@
 
 from mediagoblin.media_types import MediaManagerBase
 from mediagoblin.media_types.pdf.processing import PdfProcessingManager, \
-    sniff_handler
+    sniff_handler, sniff_magic
 
 
 ACCEPTED_EXTENSIONS = ['pdf']
@@ -37,6 +37,7 @@ def get_media_type_and_manager(ext):
 hooks = {
     'get_media_type_and_manager': get_media_type_and_manager,
     'sniff_handler': sniff_handler,
+    'sniff_magic': sniff_magic,
     ('media_manager', MEDIA_TYPE): lambda: PDFMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: PdfProcessingManager,
 }
@@ -20,6 +20,7 @@ import dateutil.parser
 from subprocess import PIPE, Popen
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types import matches_magic
 from mediagoblin.processing import (
     FilenameBuilder, BadMediaFail,
     MediaProcessor, ProcessingManager,
@@ -181,6 +182,12 @@ def sniff_handler(media_file, **kw):
 
     return None
 
+def sniff_magic(header, **kw):
+    if matches_magic(header, [(0, '%PDF-')]) and check_prerequisites():
+        return MEDIA_TYPE
+
+    return None
+
 def create_pdf_thumb(original, thumb_filename, width, height):
     # Note: pdftocairo adds '.png', remove it
     thumb_filename = thumb_filename[:-4]
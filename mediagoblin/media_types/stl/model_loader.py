@@ -15,8 +15,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import array
 import struct
 
+import numpy
+
+
+# One triangle of a binary stl file
+STL_TRIANGLE = numpy.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attributes', '<u2')])
+
 
 class ThreeDeeParseError(Exception):
     pass
@@ -30,10 +40,7 @@ class ThreeDee():
     """
 
     def __init__(self, fileob):
-        self.verts = []
-        self.average = [0, 0, 0]
-        self.min = [None, None, None]
-        self.max = [None, None, None]
+        self.verts = numpy.empty((0, 3))
         self.width = 0  # x axis
         self.depth = 0  # y axis
         self.height = 0 # z axis
@@ -42,21 +49,11 @@ class ThreeDee():
         if not len(self.verts):
             raise ThreeDeeParseError("Empty model.")
 
-        for vector in self.verts:
-            for i in range(3):
-                num = vector[i]
-                self.average[i] += num
-                if not self.min[i]:
-                    self.min[i] = num
-                    self.max[i] = num
-                else:
-                    if self.min[i] > num:
-                        self.min[i] = num
-                    if self.max[i] < num:
-                        self.max[i] = num
-
-        for i in range(3):
-            self.average[i]/=len(self.verts)
+        # reduce over all but the last (x, y, z) axis
+        axes = tuple(range(self.verts.ndim - 1))
+        self.average = self.verts.mean(axes, dtype=numpy.float64).tolist()
+        self.min = self.verts.min(axes).tolist()
+        self.max = self.verts.max(axes).tolist()
 
         self.width = abs(self.min[0] - self.max[0])
         self.depth = abs(self.min[1] - self.max[1])
@@ -64,7 +61,10 @@ class ThreeDee():
 
 
     def load(self, fileob):
-        """Override this method in your subclass."""
+        """
+        Override this method in your subclass, setting self.verts to
+        an array of vertices, with x, y and z along the last axis.
+        """
         pass
 
 
@@ -74,31 +74,59 @@ class ObjModel(ThreeDee):
     reference: http://en.wikipedia.org/wiki/Wavefront_.obj_file
     """
 
-    def __vector(self, line, expected=3):
-        nums = map(float, line.strip().split(" ")[1:])
-        return tuple(nums[:expected])
-    
+    # "vertex" is for ascii stl files, see auto_detect
+    VERTEX_KEYWORDS = ("v", "vertex")
+
     def load(self, fileob):
+        coordinates = array.array("d")
         for line in fileob:
-            line = line.strip()
-            if line[0] == "v":
-                self.verts.append(self.__vector(line))
-            
+            fields = line.split()
+            if fields and fields[0] in self.VERTEX_KEYWORDS:
+                if len(fields) < 4:
+                    raise ThreeDeeParseError("Vertex without 3 coordinates.")
+                coordinates.extend(
+                    (float(fields[1]), float(fields[2]), float(fields[3])))
+
+        if coordinates:
+            self.verts = numpy.frombuffer(
+                coordinates, numpy.float64).reshape(-1, 3)
+
 
 class BinaryStlModel(ThreeDee):
     """
-    Parser for ascii-encoded stl files.  File format reference:
+    Parser for binary stl files.  File format reference:
     http://en.wikipedia.org/wiki/STL_%28file_format%29#Binary_STL
     """
 
     def load(self, fileob):
         fileob.seek(80) # skip the header
-        count = struct.unpack("<I", fileob.read(4))[0]
-        for i in range(count):
-            fileob.read(12) # skip the normal vector
-            for v in range(3):
-                self.verts.append(struct.unpack("<3f", fileob.read(12)))
-            fileob.read(2) # skip the attribute bytes
+        count = fileob.read(4)
+        if len(count) < 4:
+            raise ThreeDeeParseError("Truncated stl file.")
+
+        count = struct.unpack("<I", count)[0]
+        if not count:
+            return
+
+        fileob.seek(0, 2)
+        if fileob.tell() < 84 + count * STL_TRIANGLE.itemsize:
+            raise ThreeDeeParseError("Truncated stl file.")
+
+        try:
+            fileob.fileno()
+        except (AttributeError, IOError):
+            # not a real file, read it
+            fileob.seek(84)
+            triangles = numpy.frombuffer(
+                fileob.read(count * STL_TRIANGLE.itemsize),
+                STL_TRIANGLE, count)
+        else:
+            # leave it to the page cache instead of reading it all
+            triangles = numpy.memmap(
+                fileob, STL_TRIANGLE, 'r', offset=84, shape=(count,))
+
+        # count x 3 vertices x 3 coordinates
+        self.verts = triangles['vertices']
 
 
 def auto_detect(fileob, hint):
@@ -16,7 +16,7 @@
 
 from mediagoblin.media_types import MediaManagerBase
 from mediagoblin.media_types.video.processing import VideoProcessingManager, \
-    sniff_handler
+    sniff_handler, sniff_magic
 
 
 MEDIA_TYPE = 'mediagoblin.media_types.video'
@@ -41,6 +41,7 @@ def get_media_type_and_manager(ext):
 hooks = {
     'get_media_type_and_manager': get_media_type_and_manager,
     'sniff_handler': sniff_handler,
+    'sniff_magic': sniff_magic,
     ('media_manager', MEDIA_TYPE): lambda: VideoMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: VideoProcessingManager,
 }
@@ -20,6 +20,7 @@ import logging
 import datetime
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types import matches_magic
 from mediagoblin.processing import (
     FilenameBuilder, BaseProcessingFail,
     ProgressCallback, MediaProcessor,
@@ -36,6 +37,27 @@ _log.setLevel(logging.DEBUG)
 
 MEDIA_TYPE = 'mediagoblin.media_types.video'
 
+MAGIC_SIGNATURES = [
+    (0, '\x1a\x45\xdf\xa3'),  # matroska and webm
+    (8, 'AVI '),
+    ]
+
+# mp4 brands of audio only files, those go to the audio type
+AUDIO_MP4_BRANDS = ['M4A ', 'M4B ']
+
+
+def sniff_magic(header, **kw):
+    if header.startswith('OggS'):
+        if '\x80theora' in header:
+            return MEDIA_TYPE
+    elif header[4:8] == 'ftyp':
+        if header[8:12] not in AUDIO_MP4_BRANDS:
+            return MEDIA_TYPE
+    elif matches_magic(header, MAGIC_SIGNATURES):
+        return MEDIA_TYPE
+
+    return None
+
 
 class VideoTranscodingFail(BaseProcessingFail):
     '''
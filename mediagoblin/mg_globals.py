@@ -36,6 +36,9 @@ queue_store = None
 # A WorkBenchManager
 workbench_manager = None
 
+# The page and fragment cache, None if disabled
+cache = None
+
 # A thread-local scope
 thread_scope = threading.local()
 
@@ -24,10 +24,9 @@ from werkzeug.wrappers import Response
 from mediagoblin.tools.response import json_response
 from mediagoblin.decorators import require_active_login
 from mediagoblin.meddleware.csrf import csrf_exempt
-from mediagoblin.media_types import sniff_media
 from mediagoblin.plugins.api.tools import api_auth, get_entry_serializable
-from mediagoblin.submit.lib import check_file_field, prepare_queue_task, \
-    run_process_media, new_upload_entry
+from mediagoblin.submit.lib import check_file_field, queue_upload, \
+    run_process_media, new_upload_entry, delete_queued_upload
 
 _log = logging.getLogger(__name__)
 
@@ -51,26 +50,26 @@ def post_entry(request):
 
     media_file = request.files['file']
 
-    media_type, media_manager = sniff_media(media_file)
-
     entry = new_upload_entry(request.user)
-    entry.media_type = unicode(media_type)
-    entry.title = unicode(request.form.get('title')
-            or splitext(media_file.filename)[0])
-
-    entry.description = unicode(request.form.get('description'))
-    entry.license = unicode(request.form.get('license', ''))
-
-    entry.generate_slug()
 
     # queue appropriately
-    queue_file = prepare_queue_task(request.app, entry, media_file.filename)
-
-    with queue_file:
-        queue_file.write(request.files['file'].stream.read())
-
-    # Save now so we have this data before kicking off processing
-    entry.save()
+    media_type, media_manager = queue_upload(
+        request.app, entry, media_file, media_file.filename)
+    try:
+        entry.media_type = unicode(media_type)
+        entry.title = unicode(request.form.get('title')
+                or splitext(media_file.filename)[0])
+
+        entry.description = unicode(request.form.get('description'))
+        entry.license = unicode(request.form.get('license', ''))
+
+        entry.generate_slug()
+
+        # Save now so we have this data before kicking off processing
+        entry.save()
+    except BaseException:
+        delete_queued_upload(request.app, entry)
+        raise
 
     if request.form.get('callback_url'):
         metadata = request.db.ProcessingMetaData()
@@ -14,12 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import hmac
 import logging
+import os
 
 from werkzeug.exceptions import Unauthorized
 
+from mediagoblin import auth
 from mediagoblin.auth.tools import check_login_simple
 from mediagoblin.plugins.api.tools import Auth
+from mediagoblin.tools import pluginapi
+from mediagoblin.tools.cache import MemoryBackend
 
 _log = logging.getLogger(__name__)
 
@@ -27,8 +33,61 @@ _log = logging.getLogger(__name__)
 def setup_http_api_auth():
     _log.info('Setting up HTTP API Auth...')
 
+    config = pluginapi.get_config('mediagoblin.plugins.httpapiauth')
+    timeout = config.get('credential_cache_timeout', 300)
+    if timeout > 0:
+        http_auth.credentials = CredentialCache(
+            timeout, config.get('credential_cache_size', 1000))
+    else:
+        http_auth.credentials = None
+
+
+class CredentialCache(object):
+    """
+    Remembers user names and passwords that were checked successfully,
+    so they don't need to be hashed again for a while.
+
+    Only a HMAC of the user, the password and the user's password hash
+    is kept, keyed with a secret of this process.  A new password means
+    a new password hash, so changing the password invalidates what was
+    remembered about the old one.
+    """
+    def __init__(self, timeout=300, max_entries=1000):
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)
+        self._verified = MemoryBackend(max_entries)
+
+    def _key(self, user, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        message = '\0'.join([
+            str(user.id), user.pw_hash.encode('utf-8'), password])
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def check_login(self, username, password):
+        """Like check_login_simple, but hashing the password only once"""
+        user = auth.get_user(username=username)
+        if user is not None and user.pw_hash:
+            if self._verified.get(self._key(user, password)):
+                self.hits += 1
+                return user
+
+        self.misses += 1
+        user = check_login_simple(username, password)
+        if user is not None:
+            self._verified.set(self._key(user, password), True, self.timeout)
+        return user
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
 
 class HTTPAuth(Auth):
+    # Set up by setup_http_api_auth
+    credentials = None
+
     def trigger(self, request):
         if request.authorization:
             return True
@@ -40,8 +99,12 @@ class HTTPAuth(Auth):
         if not request.authorization:
             return False
 
-        user = check_login_simple(unicode(request.authorization['username']),
-                                  request.authorization['password'])
+        username = unicode(request.authorization['username'])
+        password = request.authorization['password']
+        if self.credentials is not None:
+            user = self.credentials.check_login(username, password)
+        else:
+            user = check_login_simple(username, password)
 
         if user:
             request.user = user
@@ -52,7 +115,8 @@ class HTTPAuth(Auth):
         return False
 
 
+http_auth = HTTPAuth()
 
 hooks = {
     'setup': setup_http_api_auth,
-    'auth': HTTPAuth()}
+    'auth': http_auth}
@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
 import os
 import uuid
 
@@ -30,6 +31,9 @@ PLUGIN_DIR = os.path.dirname(__file__)
 def setup_plugin():
     config = pluginapi.get_config('mediagoblin.plugins.openid')
 
+    # Register the store cleanup task with celery
+    from mediagoblin.plugins.openid import task
+
     routes = [
         ('mediagoblin.plugins.openid.register',
          '/auth/openid/register/',
@@ -112,8 +116,20 @@ def add_to_form_context(context):
 def Auth():
     return True
 
+def add_celery_settings(celery_settings):
+    """Have celery beat clean up the OpenID store now and then"""
+    config = pluginapi.get_config('mediagoblin.plugins.openid')
+
+    celery_settings.setdefault('CELERYBEAT_SCHEDULE', {})[
+        'openid-store-cleanup'] = {
+            'task': 'mediagoblin.plugins.openid.task.CleanupStoreTask',
+            'schedule': datetime.timedelta(
+                seconds=config.get('cleanup_interval', 3600))}
+
+
 hooks = {
     'setup': setup_plugin,
+    'celery_settings': add_celery_settings,
     'authentication': Auth,
     'auth_extra_validation': extra_validation,
     'auth_create_user': create_user,
@@ -0,0 +1,45 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import MetaData, Column, Integer, Index
+
+from mediagoblin.db.migration_tools import RegisterMigration, inspect_table
+
+MIGRATIONS = {}
+
+
+@RegisterMigration(1, MIGRATIONS)
+def add_expiry_indexes(db):
+    """
+    Add Association.expires and index it and Nonce.timestamp, so expired
+    rows can be deleted without going through the whole tables
+    """
+    metadata = MetaData(bind=db.bind)
+    association_table = inspect_table(metadata, "openid__association")
+    nonce_table = inspect_table(metadata, "openid__nonce")
+
+    col = Column('expires', Integer)
+    col.create(association_table)
+
+    db.execute(association_table.update().values(
+        expires=association_table.c.issued + association_table.c.lifetime))
+
+    Index('ix_openid__association_expires',
+          association_table.c.expires).create(db.bind)
+    Index('ix_openid__nonce_timestamp',
+          nonce_table.c.timestamp).create(db.bind)
+
+    db.commit()
@@ -13,7 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from sqlalchemy import Column, Integer, Unicode, ForeignKey
+from sqlalchemy import Column, Integer, Unicode, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 
 from mediagoblin.db.models import User
@@ -40,6 +40,11 @@ class Nonce(Base):
     timestamp = Column(Integer, primary_key=True)
     salt = Column(Unicode, primary_key=True)
 
+    # For deleting the expired nonces, see cleanupNonces
+    __table_args__ = (
+        Index('ix_openid__nonce_timestamp', 'timestamp'),
+        {})
+
     def __unicode__(self):
         return u'Nonce: %r, %r' % (self.server_url, self.salt)
 
@@ -52,6 +57,8 @@ class Association(Base):
     secret = Column(Unicode)
     issued = Column(Integer)
     lifetime = Column(Integer)
+    # issued + lifetime, kept in its own column so it can be indexed
+    expires = Column(Integer, index=True)
     assoc_type = Column(Unicode)
 
     def __unicode__(self):
@@ -20,13 +20,30 @@ from openid.association import Association as OIDAssociation
 from openid.store.interface import OpenIDStore
 from openid.store import nonce
 
+from mediagoblin.db.base import Session
 from mediagoblin.plugins.openid.models import Association, Nonce
+from mediagoblin.tools import pluginapi
+from mediagoblin.tools.cache import MemoryBackend
+
+
+# (server_url, handle or None) -> OIDAssociation, shared by all stores
+# of this process
+_association_cache = MemoryBackend(max_entries=1000)
+
+
+def _association_cache_timeout():
+    config = pluginapi.get_config('mediagoblin.plugins.openid')
+    return config.get('association_cache_timeout', 300)
 
 
 class SQLAlchemyOpenIDStore(OpenIDStore):
     def __init__(self):
         self.max_nonce_age = 6 * 60 * 60
 
+    def _forget_association(self, server_url, handle):
+        _association_cache.delete((server_url, handle))
+        _association_cache.delete((server_url, None))
+
     def storeAssociation(self, server_url, association):
         assoc = Association.query.filter_by(
             server_url=server_url, handle=association.handle
@@ -42,48 +59,45 @@ class SQLAlchemyOpenIDStore(OpenIDStore):
         assoc.secret = unicode(base64.encodestring(association.secret))
         assoc.issued = association.issued
         assoc.lifetime = association.lifetime
+        assoc.expires = association.issued + association.lifetime
         assoc.assoc_type = association.assoc_type
         assoc.save()
 
+        self._forget_association(server_url, association.handle)
+
     def getAssociation(self, server_url, handle=None):
-        assocs = []
+        key = (server_url, handle)
+        association = _association_cache.get(key)
+        if association is not None and association.getExpiresIn() > 0:
+            return association
+
+        # The newest association that has not expired yet; expired ones
+        # are left to cleanupAssociations
+        assocs = Association.query.filter(
+            Association.server_url == server_url,
+            Association.expires > int(time.time()))
         if handle is not None:
-            assocs = Association.query.filter_by(
-                server_url=server_url, handle=handle
-            )
-        else:
-            assocs = Association.query.filter_by(
-                server_url=server_url
-            )
+            assocs = assocs.filter(Association.handle == handle)
+        assoc = assocs.order_by(Association.issued.desc()).first()
 
-        if assocs.count() == 0:
+        if assoc is None:
             return None
-        else:
-            associations = []
-            for assoc in assocs:
-                association = OIDAssociation(
-                    assoc.handle, base64.decodestring(assoc.secret),
-                    assoc.issued, assoc.lifetime, assoc.assoc_type
-                )
-                if association.getExpiresIn() == 0:
-                    assoc.delete()
-                else:
-                    associations.append((association.issued, association))
-
-            if not associations:
-                return None
-            associations.sort()
-            return associations[-1][1]
+
+        association = OIDAssociation(
+            assoc.handle, base64.decodestring(assoc.secret),
+            assoc.issued, assoc.lifetime, assoc.assoc_type
+        )
+        _association_cache.set(key, association, min(
+            association.getExpiresIn(), _association_cache_timeout()))
+        return association
 
     def removeAssociation(self, server_url, handle):
-        assocs = Association.query.filter_by(
+        self._forget_association(server_url, handle)
+        count = Association.query.filter_by(
             server_url=server_url, handle=handle
-        ).first()
-
-        assoc_exists = True if assocs else False
-        for assoc in assocs:
-            assoc.delete()
-        return assoc_exists
+        ).delete(synchronize_session=False)
+        Session.commit()
+        return count > 0
 
     def useNonce(self, server_url, timestamp, salt):
         if abs(timestamp - time.time()) > nonce.SKEW:
@@ -108,20 +122,15 @@ class SQLAlchemyOpenIDStore(OpenIDStore):
     def cleanupNonces(self, _now=None):
         if _now is None:
             _now = int(time.time())
-        expired = Nonce.query.filter(
+        count = Nonce.query.filter(
             Nonce.timestamp < (_now - nonce.SKEW)
-        )
-        count = expired.count()
-        for each in expired:
-            each.delete()
+        ).delete(synchronize_session=False)
+        Session.commit()
         return count
 
     def cleanupAssociations(self):
-        now = int(time.time())
-        assoc = Association.query.all()
-        count = 0
-        for each in assoc:
-            if (each.lifetime + each.issued) <= now:
-                each.delete()
-                count = count + 1
+        count = Association.query.filter(
+            Association.expires <= int(time.time())
+        ).delete(synchronize_session=False)
+        Session.commit()
         return count
@@ -0,0 +1,48 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+
+from celery import registry
+from celery.task import Task
+
+
+_log = logging.getLogger(__name__)
+
+
+class CleanupStoreTask(Task):
+    '''
+    Delete the expired nonces and associations of the OpenID store.
+
+    Run periodically by celery beat, see add_celery_settings.
+    '''
+    def run(self):
+        from mediagoblin.plugins.openid.store import SQLAlchemyOpenIDStore
+
+        store = SQLAlchemyOpenIDStore()
+        start = time.time()
+        nonces = store.cleanupNonces()
+        associations = store.cleanupAssociations()
+        seconds = time.time() - start
+
+        _log.info('Deleted {0} expired nonces and {1} expired associations '
+                  'in {2:.3f}s'.format(nonces, associations, seconds))
+        return {'nonces': nonces,
+                'associations': associations,
+                'seconds': seconds}
+
+cleanup_store_task = registry.tasks[CleanupStoreTask.name]
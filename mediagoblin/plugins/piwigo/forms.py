@@ -40,5 +40,6 @@ class AddForm(wtforms.Form):
          _md5_validator])
     file_sum = wtforms.TextField(None, [_md5_validator])
     name = wtforms.TextField()
+    comment = wtforms.TextField()
     date_creation = wtforms.TextField()
     categories = wtforms.TextField()
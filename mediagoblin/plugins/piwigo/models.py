@@ -0,0 +1,74 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from sqlalchemy import Column, Integer, Unicode, DateTime, ForeignKey, \
+    UniqueConstraint
+from sqlalchemy.orm import relationship, backref
+
+from mediagoblin.db.models import User
+from mediagoblin.db.base import Base
+
+
+class PwgChunkedUpload(Base):
+    """
+    An upload sent in chunks with pwg.images.addChunk
+
+    The chunks are kept in the queue store until pwg.images.add puts
+    them together, see chunk_path.
+    """
+    __tablename__ = "piwigo__chunked_uploads"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey(User.id), nullable=False)
+    # md5 hexdigest of the whole file, as the client announced it
+    original_sum = Column(Unicode, nullable=False)
+    # One more than the highest position seen
+    chunks = Column(Integer, nullable=False, default=0)
+    updated = Column(DateTime, nullable=False, default=datetime.datetime.now,
+                     index=True)
+
+    user = relationship(User, backref=backref('piwigo_chunked_uploads',
+                                              cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'original_sum'),
+        {})
+
+    def chunk_path(self, position):
+        return ['piwigo_chunks', unicode(self.user_id), self.original_sum,
+                u'%d' % position]
+
+    def delete_chunks(self, queue_store, commit=True):
+        """Delete the chunks from queue_store, and this upload"""
+        path = self.chunk_path(0)
+        for position in range(self.chunks):
+            path = self.chunk_path(position)
+            if queue_store.file_exists(path):
+                queue_store.delete_file(path)
+        # Fails, harmlessly, for directories still used by other uploads
+        for depth in (3, 2, 1):
+            queue_store.delete_dir(path[:depth])
+        self.delete(commit=commit)
+
+    def __unicode__(self):
+        return u'PwgChunkedUpload: %r, %r' % (self.user_id, self.original_sum)
+
+
+MODELS = [
+    PwgChunkedUpload
+]
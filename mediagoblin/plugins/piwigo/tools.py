@@ -15,14 +15,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+import datetime
+import hashlib
 import logging
 
 import six
 import lxml.etree as ET
 from werkzeug.exceptions import MethodNotAllowed, BadRequest
 
+from mediagoblin.db.base import Session
 from mediagoblin.tools.request import setup_user_in_request
 from mediagoblin.tools.response import Response
+from .models import PwgChunkedUpload
 
 
 _log = logging.getLogger(__name__)
@@ -163,3 +167,81 @@ class PWGSession(object):
         assert self.in_pwg_session
         self.session_manager.save_session_to_cookie(self.request.session,
             self.request, response)
+
+
+class ChunkReader(object):
+    """
+    Read the chunks of a PwgChunkedUpload from the queue store as one
+    file, without putting them together anywhere first.
+
+    The md5 of the data is computed on the way, the first time it is read.
+    Only seeking back to the start is supported.
+    """
+    def __init__(self, queue_store, upload):
+        self.queue_store = queue_store
+        self.paths = [upload.chunk_path(position)
+                      for position in range(upload.chunks)]
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+        self._file = None
+        self.seek(0)
+
+    def seek(self, offset, whence=0):
+        if (offset, whence) != (0, 0):
+            raise IOError('Can only seek to the start of the chunks')
+        self.close()
+        self._index = 0
+        self._position = 0
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self._file is None:
+                if self._index >= len(self.paths):
+                    break
+                self._file = self.queue_store.get_file(
+                    self.paths[self._index], 'rb')
+            chunk = self._file.read(size)
+            if not chunk:
+                self.close()
+                self._index += 1
+                continue
+            self._hash(chunk)
+            self._position += len(chunk)
+            data.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(data)
+
+    def _hash(self, chunk):
+        end = self._position + len(chunk)
+        if self._position <= self._hashed < end:
+            self._md5.update(chunk[self._hashed - self._position:])
+            self._hashed = end
+
+    def hexdigest(self):
+        """The md5 of everything read so far"""
+        return self._md5.hexdigest()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def delete_stale_uploads(queue_store, max_age):
+    """
+    Delete the chunked uploads nothing was added to for max_age seconds
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+    stale = PwgChunkedUpload.query.filter(
+        PwgChunkedUpload.updated < cutoff).all()
+    for upload in stale:
+        _log.info("Deleting stale chunked upload %r", upload.original_sum)
+        upload.delete_chunks(queue_store, commit=False)
+    if stale:
+        Session.commit()
+    return len(stale)
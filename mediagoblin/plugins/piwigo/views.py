@@ -14,25 +14,31 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import binascii
+import datetime
+import imghdr
 import logging
 import re
 from os.path import splitext
-import shutil
 
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 from werkzeug.exceptions import MethodNotAllowed, BadRequest, NotImplemented
 from werkzeug.wrappers import BaseResponse
 
 from mediagoblin.meddleware.csrf import csrf_exempt
 from mediagoblin.auth.tools import check_login_simple
-from mediagoblin.media_types import sniff_media
-from mediagoblin.submit.lib import check_file_field, prepare_queue_task, \
-    run_process_media, new_upload_entry
+from mediagoblin.media_types import FileTypeNotSupported
+from mediagoblin.submit.lib import check_file_field, queue_upload, \
+    run_process_media, new_upload_entry, delete_queued_upload
+from mediagoblin.tools import pluginapi
 
 from mediagoblin.user_pages.lib import add_media_to_collection
 from mediagoblin.db.models import Collection
 
+from .models import PwgChunkedUpload
 from .tools import CmdTable, response_xml, check_form, \
-    PWGSession, PwgNamedArray, PwgError
+    PWGSession, PwgNamedArray, PwgError, ChunkReader, delete_stale_uploads
 from .forms import AddSimpleForm, AddForm
 
 
@@ -128,13 +134,13 @@ def pwg_images_addSimple(request):
 
     filename = request.files['image'].filename
 
-    # Sniff the submitted media to determine which
-    # media plugin should handle processing
-    media_type, media_manager = sniff_media(
-        request.files['image'])
-
     # create entry and save in database
     entry = new_upload_entry(request.user)
+
+    # Stream the submitted media to the queue and sniff it
+    # to determine which media plugin should handle processing
+    media_type, media_manager = queue_upload(
+        request.app, entry, request.files['image'], filename)
     entry.media_type = unicode(media_type)
     entry.title = (
         unicode(form.name.data)
@@ -148,18 +154,23 @@ def pwg_images_addSimple(request):
         form.tags.data)
     '''
 
-    # Generate a slug from the title
-    entry.generate_slug()
+    return finish_upload(request, entry, [form.category.data])
 
-    queue_file = prepare_queue_task(request.app, entry, filename)
 
-    with queue_file:
-        shutil.copyfileobj(request.files['image'].stream,
-                           queue_file,
-                           length=4 * 1048576)
+def finish_upload(request, entry, collection_ids):
+    """
+    Save the queued entry, kick off its processing and add it to those
+    of the collections that belong to the user
+    """
+    try:
+        # Generate a slug from the title
+        entry.generate_slug()
 
-    # Save now so we have this data before kicking off processing
-    entry.save()
+        # Save now so we have this data before kicking off processing
+        entry.save()
+    except BaseException:
+        delete_queued_upload(request.app, entry)
+        raise
 
     # Pass off to processing
     #
@@ -170,8 +181,9 @@ def pwg_images_addSimple(request):
         qualified=True, user=request.user.username)
     run_process_media(entry, feed_url)
 
-    collection_id = form.category.data
-    if collection_id > 0:
+    for collection_id in collection_ids:
+        if not collection_id > 0:
+            continue
         collection = Collection.query.get(collection_id)
         if collection is not None and collection.creator == request.user.id:
             add_media_to_collection(collection, entry, "")
@@ -194,15 +206,29 @@ def fetch_md5(request, parm_name, optional_parm=False):
     return val
 
 
+def get_upload_max_age():
+    config = pluginapi.get_config('mediagoblin.plugins.piwigo')
+    return config.get('chunked_upload_max_age', 86400)
+
+
 @CmdTable("pwg.images.addChunk", True)
 def pwg_images_addChunk(request):
-    o_sum = fetch_md5(request, 'original_sum')
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    o_sum = unicode(fetch_md5(request, 'original_sum').lower())
     typ = request.form.get('type')
     pos = request.form.get('position')
     data = request.form.get('data')
 
     # Validate params:
-    pos = int(pos)
+    try:
+        pos = int(pos)
+        data = binascii.a2b_base64(data)
+    except (TypeError, ValueError, binascii.Error):
+        raise BadRequest("Bad position or data")
+    if pos < 0:
+        raise BadRequest("Bad position")
     if not typ in ("file", "thumb"):
         _log.error("type %r not allowed for now", typ)
         return False
@@ -213,6 +239,23 @@ def pwg_images_addChunk(request):
         _log.info("addChunk: Ignoring thumb, because we create our own")
         return True
 
+    upload = PwgChunkedUpload.query.filter_by(
+        user_id=request.user.id, original_sum=o_sum).first()
+    if upload is None:
+        # A good time to forget about uploads that were never finished
+        delete_stale_uploads(request.app.queue_store, get_upload_max_age())
+        upload = PwgChunkedUpload(user_id=request.user.id,
+                                  original_sum=o_sum)
+
+    # Chunks may come in any order, and again when an upload is resumed
+    with request.app.queue_store.get_file(
+            upload.chunk_path(pos), 'wb') as chunk_file:
+        chunk_file.write(data)
+
+    upload.chunks = max(upload.chunks or 0, pos + 1)
+    upload.updated = datetime.datetime.now()
+    upload.save()
+
     return True
 
 
@@ -222,7 +265,61 @@ def pwg_images_add(request):
     form = AddForm(request.form)
     check_form(form)
 
-    return {'image_id': 123456, 'url': ''}
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    o_sum = unicode(form.original_sum.data.lower())
+    upload = PwgChunkedUpload.query.filter_by(
+        user_id=request.user.id, original_sum=o_sum).first()
+    if upload is None:
+        return PwgError(404, 'No chunks uploaded for this file')
+
+    queue_store = request.app.queue_store
+    for position in range(upload.chunks):
+        if not queue_store.file_exists(upload.chunk_path(position)):
+            return PwgError(500, 'Chunk %d is missing' % position)
+
+    # The chunks are streamed to the queue file directly, and hashed on
+    # the way.  Piwigo sends no file name, so the extension comes from
+    # the image header.
+    title = unicode(form.name.data or u'')
+    chunks = ChunkReader(queue_store, upload)
+    kind = imghdr.what(None, chunks.read(32))
+    chunks.seek(0)
+    filename = (secure_filename(title) or o_sum) + (
+        '.' + kind if kind else '')
+    entry = new_upload_entry(request.user)
+    try:
+        media_type, media_manager = queue_upload(
+            request.app, entry, FileStorage(chunks, filename), filename)
+    except FileTypeNotSupported:
+        upload.delete_chunks(queue_store)
+        return PwgError(500, 'File type not supported')
+    finally:
+        chunks.close()
+
+    if chunks.hexdigest() != o_sum:
+        _log.error("add: md5 of the chunks of %r is %r",
+                   o_sum, chunks.hexdigest())
+        delete_queued_upload(request.app, entry)
+        upload.delete_chunks(queue_store)
+        return PwgError(500, 'md5 checksum mismatch')
+
+    upload.delete_chunks(queue_store)
+
+    entry.media_type = unicode(media_type)
+    entry.title = title or unicode(splitext(filename)[0])
+    entry.description = unicode(form.comment.data or u'')
+
+    collection_ids = []
+    for category in (form.categories.data or '').split(';'):
+        # Categories may come with a rank, "id,rank"
+        try:
+            collection_ids.append(int(category.split(',')[0]))
+        except ValueError:
+            pass
+
+    return finish_upload(request, entry, collection_ids)
 
 
 @csrf_exempt
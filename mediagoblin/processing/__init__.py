@@ -17,24 +17,103 @@
 from collections import OrderedDict
 import logging
 import os
+import time
 
 from mediagoblin import mg_globals as mgg
-from mediagoblin.db.util import atomic_update
+from mediagoblin.db.util import atomic_update, recount_user_media, \
+    recount_tag_media
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.tools.common import import_component
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
 _log = logging.getLogger(__name__)
 
 
+class DatabaseProgressSink(object):
+    """Keep the progress of processing in MediaEntry.transcoding_progress"""
+    def set(self, entry_id, progress):
+        # Only update this one column, not everything changed on the entry
+        atomic_update(MediaEntry, {'id': entry_id},
+                      {'transcoding_progress': progress})
+
+    def get(self, entry_ids):
+        if not entry_ids:
+            return {}
+        return dict(MediaEntry.query.filter(
+            MediaEntry.id.in_(entry_ids)).with_entities(
+            MediaEntry.id, MediaEntry.transcoding_progress))
+
+
+class CacheProgressSink(object):
+    """
+    Keep the progress of processing in the cache, see the [cache]
+    section.  Use a backend shared by all processes, so the web
+    processes see the progress reported by the celery workers.
+    """
+    timeout = 24 * 60 * 60
+
+    def _key(self, entry_id):
+        return mgg.cache.make_stable_key('processing_progress', entry_id)
+
+    def set(self, entry_id, progress):
+        mgg.cache.set(self._key(entry_id), progress, self.timeout)
+
+    def get(self, entry_ids):
+        return dict((entry_id, mgg.cache.get(self._key(entry_id)))
+                    for entry_id in entry_ids)
+
+
+PROGRESS_SINKS = {
+    'database': DatabaseProgressSink,
+    'cache': CacheProgressSink}
+
+
+def get_progress_sink():
+    """
+    Return the progress sink chosen by progress_sink in [processing]:
+    one of PROGRESS_SINKS, or the import path of a class like them.
+    """
+    name = mgg.global_config['processing']['progress_sink']
+    if name == 'cache' and mgg.cache is None:
+        _log.warn('Caching is disabled, keeping progress in the database')
+        name = 'database'
+    if name in PROGRESS_SINKS:
+        return PROGRESS_SINKS[name]()
+    return import_component(name)()
+
+
 class ProgressCallback(object):
-    def __init__(self, entry):
-        self.entry = entry
+    """
+    Report the progress of processing entry to the progress sink.
+
+    Transcoders call this many times per second, so progress is only
+    passed on once it changed by a whole percent, and at most every
+    progress_interval seconds (except for reaching 100%).
+    """
+    def __init__(self, entry, sink=None, interval=None):
+        self.entry_id = entry.id
+        self.sink = sink or get_progress_sink()
+        if interval is None:
+            interval = mgg.global_config['processing']['progress_interval']
+        self.interval = interval
+        self.reported = None
+        self.reported_at = None
 
     def __call__(self, progress):
-        if progress:
-            self.entry.transcoding_progress = progress
-            self.entry.save()
+        if not progress:
+            return
+        progress = int(progress)
+        if progress == self.reported:
+            return
+        now = time.time()
+        if progress < 100 and self.reported_at is not None \
+                and now - self.reported_at < self.interval:
+            return
+
+        self.sink.set(self.entry_id, progress)
+        self.reported = progress
+        self.reported_at = now
 
 
 def create_pub_filepath(entry, filename):
@@ -161,15 +240,7 @@ class MediaProcessor(object):
     #####################
 
     def delete_queue_file(self):
-        # Remove queued media file from storage and database.
-        # queued_filepath is in the task_id directory which should
-        # be removed too, but fail if the directory is not empty to be on
-        # the super-safe side.
-        queued_filepath = self.entry.queued_media_file
-        if queued_filepath:
-            mgg.queue_store.delete_file(queued_filepath)      # rm file
-            mgg.queue_store.delete_dir(queued_filepath[:-1])  # rm dir
-            self.entry.queued_media_file = []
+        delete_queue_file(self.entry)
 
 
 class ProcessingKeyError(Exception): pass
@@ -237,8 +308,6 @@ class ProcessingManager(object):
         try:
             processor = self.processors[key]
         except KeyError:
-            import pdb
-            pdb.set_trace()
             raise ProcessorDoesNotExist(
                 "'%s' processor does not exist for this media type" % key)
 
@@ -291,6 +360,26 @@ def get_entry_and_processing_manager(media_id):
     return entry, manager
 
 
+def get_processing_queue(media_type, action):
+    """
+    Return the celery queue to run the processor action of media_type
+    in, as configured in the [[queues]] of the [processing] section.
+    """
+    config = mgg.global_config['processing']
+    queues = config['queues']
+    return queues.get(u'{0}:{1}'.format(media_type, action)) \
+        or queues.get(media_type) \
+        or config['default_queue']
+
+
+def get_processing_priority(action):
+    """Return the celery priority of running the processor action"""
+    config = mgg.global_config['processing']
+    if action == 'initial':
+        return config['initial_priority']
+    return config['reprocess_priority']
+
+
 def mark_entry_failed(entry_id, exc):
     """
     Mark a media entry as having failed in its conversion.
@@ -326,6 +415,12 @@ def mark_entry_failed(entry_id, exc):
              u'fail_error': None,
              u'fail_metadata': {}})
 
+    # atomic_update goes around the events counting media per state
+    uploader = mgg.database.MediaEntry.query.with_entities(
+        mgg.database.MediaEntry.uploader).filter_by(id=entry_id).scalar()
+    recount_user_media([uploader], commit=False)
+    recount_tag_media([entry_id])
+
 
 def get_process_filename(entry, workbench, acceptable_files):
     """
@@ -387,6 +482,54 @@ def copy_original(entry, orig_filename, target_name, keyname=u"original"):
     store_public(entry, keyname, orig_filename, target_name)
 
 
+def delete_queue_file(entry):
+    # Remove queued media file from storage and database.
+    # queued_filepath is in the task_id directory which should
+    # be removed too, but fail if the directory is not empty to be on
+    # the super-safe side.
+    queued_filepath = entry.queued_media_file
+    if queued_filepath:
+        mgg.queue_store.delete_file(queued_filepath)      # rm file
+        mgg.queue_store.delete_dir(queued_filepath[:-1])  # rm dir
+        entry.queued_media_file = []
+
+
+def find_duplicate_entry(entry):
+    """
+    Find a processed entry of the same type with the same upload as entry
+    """
+    if not entry.upload_hash:
+        return None
+
+    return MediaEntry.query.filter(
+        (MediaEntry.upload_hash == entry.upload_hash)
+        & (MediaEntry.media_type == entry.media_type)
+        & (MediaEntry.state == u'processed')
+        & (MediaEntry.id != entry.id)).first()
+
+
+def clone_processed_entry(entry, original):
+    """
+    Give entry the processing results of original instead of processing it
+
+    The public files are copied, which in a content addressed public
+    store only adds references to the existing blobs.
+    """
+    for keyname, filepath in original.media_files.items():
+        target_filepath = create_pub_filepath(entry, filepath[-1])
+        mgg.public_store.copy_file(filepath, target_filepath)
+        entry.media_files[keyname] = target_filepath
+
+    media_data = original.media_data
+    if media_data is not None:
+        entry.media_data_init(**dict(
+            (column.name, getattr(media_data, column.name))
+            for column in media_data.__table__.columns
+            if column.name != 'media_entry'))
+
+    delete_queue_file(entry)
+
+
 class BaseProcessingFail(Exception):
     """
     Base exception that all other processing failure messages should
@@ -22,7 +22,8 @@ import celery
 from celery.registry import tasks
 
 from mediagoblin import mg_globals as mgg
-from . import mark_entry_failed, BaseProcessingFail
+from . import mark_entry_failed, BaseProcessingFail, \
+    find_duplicate_entry, clone_processed_entry
 from mediagoblin.tools.processing import json_processing_callback
 from mediagoblin.processing import get_entry_and_processing_manager
 
@@ -84,28 +85,18 @@ class ProcessMedia(celery.Task):
 
         # Try to process, and handle expected errors.
         try:
-            processor_class = manager.get_processor(reprocess_action, entry)
-
-            with processor_class(manager, entry) as processor:
-                # Initial state change has to be here because
-                # the entry.state gets recorded on processor_class init
-                entry.state = u'processing'
-                entry.save()
-
-                _log.debug('Processing {0}'.format(entry))
-
-                try:
-                    processor.process(**reprocess_info)
-                except Exception as exc:
-                    if processor.entry_orig_state == 'processed':
-                        _log.error(
-                            'Entry {0} failed to process due to the following'
-                            ' error: {1}'.format(entry.id, exc))
-                        _log.info(
-                            'Setting entry.state back to "processed"')
-                        pass
-                    else:
-                        raise
+            duplicate = None
+            if reprocess_action == 'initial' \
+                    and getattr(mgg.public_store, 'content_addressed', False):
+                duplicate = find_duplicate_entry(entry)
+
+            if duplicate is not None:
+                _log.debug('{0} is a duplicate of {1}, reusing its files'
+                           .format(entry, duplicate))
+                clone_processed_entry(entry, duplicate)
+            else:
+                self.run_processor(
+                    manager, entry, reprocess_action, reprocess_info)
 
             # We set the state to processed and save the entry here so there's
             # no need to save at the end of the processing stage, probably ;)
@@ -141,6 +132,30 @@ class ProcessMedia(celery.Task):
             json_processing_callback(entry)
             raise
 
+    def run_processor(self, manager, entry, reprocess_action, reprocess_info):
+        processor_class = manager.get_processor(reprocess_action, entry)
+
+        with processor_class(manager, entry) as processor:
+            # Initial state change has to be here because
+            # the entry.state gets recorded on processor_class init
+            entry.state = u'processing'
+            entry.save()
+
+            _log.debug('Processing {0}'.format(entry))
+
+            try:
+                processor.process(**reprocess_info)
+            except Exception as exc:
+                if processor.entry_orig_state == 'processed':
+                    _log.error(
+                        'Entry {0} failed to process due to the following'
+                        ' error: {1}'.format(entry.id, exc))
+                    _log.info(
+                        'Setting entry.state back to "processed"')
+                    pass
+                else:
+                    raise
+
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """
         If the processing failed we should mark that in the database.
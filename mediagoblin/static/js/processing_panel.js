@@ -0,0 +1,37 @@
+/**
+ * GNU MediaGoblin -- federated, autonomous media hosting
+ * Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+// Keep the progress column of the processing panel up to date
+$(document).ready(function(){
+  var table = $('table.media_panel.processing');
+  if (!table.length) {
+    return;
+  }
+
+  function updateProgress(){
+    $.getJSON(table.data('progress-url'), function(progress){
+      table.find('td.processing_progress').each(function(){
+        var percent = progress[$(this).data('media-id')];
+        if (percent) {
+          $(this).text(percent + '%');
+        }
+      });
+    });
+  }
+  setInterval(updateProgress, 10000);
+});
@@ -191,6 +191,18 @@ class StorageInterface(object):
                 # Copy to storage system in 4M chunks
                 shutil.copyfileobj(source_file, dest_file, length=4*1048576)
 
+    def copy_file(self, filepath, dest_filepath):
+        """
+        Copy the file at filepath to dest_filepath in this storage system.
+
+        Storage systems that can copy (or share) files without reading
+        them through override this method.
+        """
+        with self.get_file(filepath, 'rb') as source_file:
+            with self.get_file(dest_filepath, 'wb') as dest_file:
+                # Copy within the storage system in 4M chunks
+                shutil.copyfileobj(source_file, dest_file, length=4*1048576)
+
 
 ###########
 # Utilities
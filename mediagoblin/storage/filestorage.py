@@ -19,9 +19,26 @@ from mediagoblin.storage import (
     clean_listy_filepath,
     NoWebServing)
 
+import errno
+import hashlib
 import os
 import shutil
 import urlparse
+import uuid
+
+
+def _file_sha1(filename):
+    """
+    Return the sha1 hexdigest of the file at filename
+    """
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as hashed_file:
+        while True:
+            chunk = hashed_file.read(4 * 1048576)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
 
 class BasicFileStorage(StorageInterface):
@@ -31,15 +48,24 @@ class BasicFileStorage(StorageInterface):
 
     local_storage = True
 
-    def __init__(self, base_dir, base_url=None, **kwargs):
+    # Directory (below base_dir) holding the content addressed blobs
+    BLOB_DIR = '_blobs'
+
+    def __init__(self, base_dir, base_url=None, content_addressed=False,
+                 **kwargs):
         """
         Keyword arguments:
         - base_dir: Base directory things will be served out of.  MUST
           be an absolute path.
         - base_url: URL files will be served from
+        - content_addressed: Store the contents of files copied into
+          this storage only once, as blobs named after their sha1.
+          The filepaths are hard links to those blobs, so the link
+          count of a blob is its reference count.
         """
         self.base_dir = base_dir
         self.base_url = base_url
+        self.content_addressed = content_addressed
 
     def _resolve_filepath(self, filepath):
         """
@@ -51,6 +77,36 @@ class BasicFileStorage(StorageInterface):
     def file_exists(self, filepath):
         return os.path.exists(self._resolve_filepath(filepath))
 
+    def _blob_path(self, digest):
+        return os.path.join(self.base_dir, self.BLOB_DIR, digest[:2], digest)
+
+    def _store_blob(self, filename):
+        """
+        Make sure a blob with the contents of filename exists, return its path
+        """
+        blob_path = self._blob_path(_file_sha1(filename))
+        if not os.path.exists(blob_path):
+            directory = os.path.dirname(blob_path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            # Copy under a temporary name first, so a blob is never
+            # seen half written
+            tmp_path = '%s.%s.tmp' % (blob_path, uuid.uuid4())
+            shutil.copy(filename, tmp_path)
+            os.rename(tmp_path, blob_path)
+        return blob_path
+
+    def _unshare(self, filepath):
+        """
+        Give filepath its own copy of the contents if it shares a blob
+        """
+        local_path = self._resolve_filepath(filepath)
+        if os.path.exists(local_path) and os.stat(local_path).st_nlink > 1:
+            tmp_path = '%s.%s.tmp' % (local_path, uuid.uuid4())
+            shutil.copy(local_path, tmp_path)
+            self.delete_file(filepath)
+            os.rename(tmp_path, local_path)
+
     def get_file(self, filepath, mode='r'):
         # Make directories if necessary
         if len(filepath) > 1:
@@ -58,15 +114,34 @@ class BasicFileStorage(StorageInterface):
             if not os.path.exists(directory):
                 os.makedirs(directory)
 
+        writing = mode.startswith(('w', 'a')) or '+' in mode
+        if self.content_addressed and writing and self.file_exists(filepath):
+            # Never write through to a blob other filepaths share
+            if mode.startswith('w'):
+                self.delete_file(filepath)
+            else:
+                self._unshare(filepath)
+
         # Grab and return the file in the mode specified
         return open(self._resolve_filepath(filepath), mode)
 
     def delete_file(self, filepath):
         """Delete file at filepath
 
+        In content addressed mode the blob is deleted together with
+        the last filepath referencing it.
+
         Raises OSError in case filepath is a directory."""
         #TODO: log error
-        os.remove(self._resolve_filepath(filepath))
+        local_path = self._resolve_filepath(filepath)
+        if self.content_addressed and os.stat(local_path).st_nlink == 2:
+            blob_path = self._blob_path(_file_sha1(local_path))
+            if os.path.exists(blob_path) \
+                    and os.path.samefile(blob_path, local_path):
+                os.remove(local_path)
+                os.remove(blob_path)
+                return
+        os.remove(local_path)
 
     def delete_dir(self, dirpath, recursive=False):
         """returns True on succes, False on failure"""
@@ -109,5 +184,38 @@ class BasicFileStorage(StorageInterface):
             directory = self._resolve_filepath(filepath[:-1])
             if not os.path.exists(directory):
                 os.makedirs(directory)
-        # This uses chunked copying of 16kb buffers (Py2.7):
-        shutil.copy(filename, self.get_local_path(filepath))
+
+        if not self.content_addressed:
+            # This uses chunked copying of 16kb buffers (Py2.7):
+            shutil.copy(filename, self.get_local_path(filepath))
+            return
+
+        if self.file_exists(filepath):
+            self.delete_file(filepath)
+        try:
+            os.link(self._store_blob(filename), self.get_local_path(filepath))
+        except OSError as e:
+            # The blob's last other reference was deleted in between
+            if e.errno != errno.ENOENT:
+                raise
+            os.link(self._store_blob(filename), self.get_local_path(filepath))
+
+    def copy_file(self, filepath, dest_filepath):
+        """
+        Copy a file to another filepath in this storage.
+
+        In content addressed mode this only adds a reference to the blob.
+        """
+        if len(dest_filepath) > 1:
+            directory = self._resolve_filepath(dest_filepath[:-1])
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        if self.file_exists(dest_filepath):
+            self.delete_file(dest_filepath)
+
+        source = self._resolve_filepath(filepath)
+        if self.content_addressed and os.stat(source).st_nlink > 1:
+            os.link(source, self._resolve_filepath(dest_filepath))
+        else:
+            self.copy_local_to_storage(source, dest_filepath)
@@ -14,18 +14,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import logging
 import uuid
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.processing import mark_entry_failed
+from mediagoblin.media_types import sniff_media, FileTypeNotSupported
+from mediagoblin.processing import mark_entry_failed, get_processing_queue, \
+    get_processing_priority
 from mediagoblin.processing.task import ProcessMedia
 
 
 _log = logging.getLogger(__name__)
 
+# Uploads are copied to the queue store in chunks of this size
+UPLOAD_CHUNK_SIZE = 4 * 1048576
+
 
 def check_file_field(request, field_name):
     """Check if a file field meets minimal criteria"""
@@ -76,6 +82,59 @@ def prepare_queue_task(app, entry, filename):
     return queue_file
 
 
+def store_upload(stream, queue_file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Copy an upload stream to the queue file chunk by chunk
+
+    Never holds more than chunk_size bytes of the upload in memory.
+    Returns the sha1 hexdigest of the data, computed on the way.
+    """
+    file_hash = hashlib.sha1()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        file_hash.update(chunk)
+        queue_file.write(chunk)
+
+    return file_hash.hexdigest()
+
+
+def queue_upload(app, entry, media, filename):
+    """
+    Stream an uploaded file to the queue store and sniff its media type
+
+    The sniffers are pointed at the queued file if the queue store is
+    local, so the upload is not copied a second time.  If no media type
+    accepts the file, it is removed from the queue again and
+    FileTypeNotSupported is raised.  Callers that fail before saving the
+    entry have to remove it with delete_queued_upload() themselves.
+
+    Returns a tuple of `(media_type, media_manager)`.
+    """
+    queue_file = prepare_queue_task(app, entry, filename)
+
+    with queue_file:
+        entry.upload_hash = unicode(store_upload(media.stream, queue_file))
+
+    local_path = None
+    if app.queue_store.local_storage:
+        local_path = app.queue_store.get_local_path(entry.queued_media_file)
+
+    try:
+        return sniff_media(media, local_path)
+    except FileTypeNotSupported:
+        delete_queued_upload(app, entry)
+        raise
+
+
+def delete_queued_upload(app, entry):
+    """Remove the queued upload of an entry from the queue store again"""
+    app.queue_store.delete_file(entry.queued_media_file)
+    app.queue_store.delete_dir(entry.queued_media_file[:-1])
+    entry.queued_media_file = []
+
+
 def run_process_media(entry, feed_url=None,
                       reprocess_action="initial", reprocess_info=None):
     """Process the media asynchronously
@@ -91,7 +150,9 @@ def run_process_media(entry, feed_url=None,
     try:
         ProcessMedia().apply_async(
             [entry.id, feed_url, reprocess_action, reprocess_info], {},
-            task_id=entry.queued_task_id)
+            task_id=entry.queued_task_id,
+            queue=get_processing_queue(entry.media_type, reprocess_action),
+            priority=get_processing_priority(reprocess_action))
     except BaseException as exc:
         # The purpose of this section is because when running in "lazy"
         # or always-eager-with-exceptions-propagated celery mode that
@@ -30,10 +30,9 @@ from mediagoblin.tools.response import render_to_response, redirect
 from mediagoblin.decorators import require_active_login
 from mediagoblin.submit import forms as submit_forms
 from mediagoblin.messages import add_message, SUCCESS
-from mediagoblin.media_types import sniff_media, \
-    InvalidFileType, FileTypeNotSupported
-from mediagoblin.submit.lib import check_file_field, prepare_queue_task, \
-    run_process_media, new_upload_entry
+from mediagoblin.media_types import InvalidFileType, FileTypeNotSupported
+from mediagoblin.submit.lib import check_file_field, queue_upload, \
+    run_process_media, new_upload_entry, delete_queued_upload
 
 from mediagoblin.notifications import add_comment_subscription
 
@@ -58,36 +57,40 @@ def submit_start(request):
                 if not all(ord(c) < 128 for c in filename):
                     filename = unicode(uuid.uuid4()) + splitext(filename)[-1]
 
-                # Sniff the submitted media to determine which
-                # media plugin should handle processing
-                media_type, media_manager = sniff_media(
-                    request.files['file'])
-
                 # create entry and save in database
                 entry = new_upload_entry(request.user)
-                entry.media_type = unicode(media_type)
-                entry.title = (
-                    unicode(submit_form.title.data)
-                    or unicode(splitext(request.files['file'].filename)[0]))
-
-                entry.description = unicode(submit_form.description.data)
-
-                entry.license = unicode(submit_form.license.data) or None
-
-                # Process the user's folksonomy "tags"
-                entry.tags = convert_to_tag_list_of_dicts(
-                    submit_form.tags.data)
 
-                # Generate a slug from the title
-                entry.generate_slug()
-
-                queue_file = prepare_queue_task(request.app, entry, filename)
-
-                with queue_file:
-                    queue_file.write(request.files['file'].stream.read())
-
-                # Save now so we have this data before kicking off processing
-                entry.save()
+                # Stream the submitted media to the queue and sniff it
+                # to determine which media plugin should handle processing
+                media_type, media_manager = queue_upload(
+                    request.app, entry, request.files['file'], filename)
+                try:
+                    entry.media_type = unicode(media_type)
+                    entry.title = (
+                        unicode(submit_form.title.data)
+                        or unicode(splitext(
+                            request.files['file'].filename)[0]))
+
+                    entry.description = unicode(
+                        submit_form.description.data)
+
+                    entry.license = unicode(submit_form.license.data) or None
+
+                    # Process the user's folksonomy "tags"
+                    entry.tags = convert_to_tag_list_of_dicts(
+                        submit_form.tags.data)
+
+                    # Generate a slug from the title
+                    entry.generate_slug()
+
+                    # Save now so we have this data before kicking off
+                    # processing
+                    entry.save()
+                except BaseException:
+                    # Without a saved entry nothing would ever process
+                    # or remove the queued file
+                    delete_queued_upload(request.app, entry)
+                    raise
 
                 # Pass off to async processing
                 #
@@ -17,7 +17,9 @@
 
 import logging
 import base64
+import os
 
+import mock
 import pytest
 
 from mediagoblin import mg_globals
@@ -79,6 +81,26 @@ class TestAPI(object):
         assert response.body == \
                 '{"username": "joapi", "email": "joapi@example.com"}'
 
+    def test_http_auth_credential_cache(self, test_app):
+        from mediagoblin.plugins.httpapiauth import http_auth
+        credentials = http_auth.credentials
+        hits, misses = credentials.hits, credentials.misses
+
+        for i in range(3):
+            test_app.get('/api/test', headers=self.http_auth_headers())
+        assert credentials.misses == misses + 1
+        assert credentials.hits == hits + 2
+
+        # A new password invalidates the remembered one
+        old_headers = self.http_auth_headers()
+        self.user_password = u'n3w_p4ssw0rd'
+        self.user = fixture_add_user(u'joapi', self.user_password)
+        test_app.get('/api/test', headers=old_headers, status=401)
+        test_app.get('/api/test', headers=self.http_auth_headers())
+        test_app.get('/api/test', headers=self.http_auth_headers())
+        assert credentials.misses == misses + 3
+        assert credentials.hits == hits + 3
+
     def test_2_test_submission(self, test_app):
         self.login(test_app)
 
@@ -90,3 +112,19 @@ class TestAPI(object):
         assert response.status_int == 200
 
         assert self.db.MediaEntry.query.filter_by(title=u'Great JPG!').first()
+
+    def test_failed_submission_removes_queued_file(self, test_app):
+        queue_dir = mg_globals.app.queue_store.base_dir
+
+        def queued_files():
+            return sum(len(files) for _, _, files in os.walk(queue_dir))
+
+        before = queued_files()
+        with mock.patch('mediagoblin.db.models.MediaEntry.generate_slug',
+                        side_effect=ValueError('Broken slug')):
+            with pytest.raises(ValueError):
+                self.do_post({'title': 'Doomed'}, test_app,
+                             **self.upload_data(GOOD_JPG))
+        assert queued_files() == before
+        assert not self.db.MediaEntry.query.filter_by(
+            title=u'Doomed').count()
@@ -0,0 +1,110 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2013 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+import pytest
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+try:
+    from mediagoblin.media_types.audio import spectrogram
+except Exception:
+    # The audio media type needs gstreamer
+    spectrogram = None
+
+
+class ArrayAudioFile(object):
+    """Mimics audiolab.Sndfile, reading from an array"""
+    def __init__(self, samples):
+        self.samples = samples
+        self.nframes = len(samples)
+        self.channels = 1 if samples.ndim == 1 else samples.shape[1]
+        self.samplerate = 44100
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def read_frames(self, frames):
+        samples = self.samples[self.position:self.position + frames]
+        self.position += frames
+        return samples.copy()
+
+    def close(self):
+        pass
+
+
+class FakeAudiolab(object):
+    def __init__(self, samples):
+        self.samples = samples
+
+    def Sndfile(self, filename, mode):
+        return ArrayAudioFile(self.samples)
+
+
+def column_by_column(source, output, image_size, fft_size):
+    """How the spectrogram used to be drawn, one pixel at a time"""
+    processor = spectrogram.AudioProcessor(source, fft_size, numpy.hamming)
+    image = spectrogram.SpectrogramImage(image_size, fft_size)
+    samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
+
+    pixels = []
+    for x in range(image_size[0]):
+        centroid, spectrum = processor.spectral_centroid(
+            int(x * samples_per_pixel))
+        for index, alpha in image.y_to_bin:
+            pixels.append(image.palette[int(
+                (255.0 - alpha) * spectrum[index]
+                + alpha * spectrum[index + 1])])
+        for y in range(len(image.y_to_bin), image_size[1]):
+            pixels.append(image.palette[0])
+
+    result = Image.new('RGBA', (image_size[1], image_size[0]))
+    result.putdata(pixels)
+    result.transpose(Image.ROTATE_90).save(output)
+
+
+@pytest.mark.skipif("spectrogram is None")
+@pytest.mark.parametrize(('frames', 'channels', 'max_samples'), [
+    (44100, 1, 2 ** 20),
+    (44100, 2, 2 ** 13),  # several chunks
+    (300, 1, 2 ** 20),  # shorter than one FFT
+    ])
+def test_spectrogram_matches_column_by_column(monkeypatch, tmpdir,
+                                              frames, channels, max_samples):
+    random = numpy.random.RandomState(42)
+    samples = random.uniform(-1, 1, (frames, channels)).squeeze()
+    # some structure, not just noise
+    samples[:frames / 2] = (samples[:frames / 2].T
+                            * numpy.sin(numpy.arange(frames / 2) / 7.0)).T
+    monkeypatch.setattr(spectrogram, 'audiolab', FakeAudiolab(samples),
+                        raising=False)
+    monkeypatch.setattr(spectrogram, 'MAX_CHUNK_SAMPLES', max_samples)
+
+    expected = str(tmpdir.join('expected.png'))
+    column_by_column('audio.wav', expected, (160, 48), 512)
+
+    result = str(tmpdir.join('result.png'))
+    progress = []
+    spectrogram.create_spectrogram_image(
+        'audio.wav', result, (160, 48), 512, progress.append)
+
+    assert list(Image.open(result).getdata()) == \
+        list(Image.open(expected).getdata())
+    assert progress[-1] == 100
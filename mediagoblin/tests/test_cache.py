@@ -0,0 +1,172 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import jinja2
+import mock
+import pytest
+import pkg_resources
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry, MediaComment
+from mediagoblin.tools import template
+from mediagoblin.tools.cache import Cache, MemoryBackend, \
+    FragmentCacheExtension
+from mediagoblin.tests.tools import get_app, fixture_add_user, \
+    fixture_media_entry
+
+
+USER_TEMPLATE = 'mediagoblin/user_pages/user.html'
+
+
+@pytest.fixture()
+def cache_app(request):
+    return get_app(
+        request,
+        mgoblin_config=pkg_resources.resource_filename(
+            'mediagoblin.tests', 'appconfig_cache.ini'))
+
+
+def _rendered(app, url):
+    """Fetch url, return whether the page had to be rendered"""
+    template.clear_test_template_context()
+    response = app.get(url)
+    assert response.status_int == 200
+    return USER_TEMPLATE in template.TEMPLATE_TEST_CONTEXT
+
+
+def test_anonymous_page_cache(cache_app):
+    user = fixture_add_user(u'cachy')
+    fixture_media_entry(uploader=user.id, state=u'processed')
+
+    # Served from the cache the second time around
+    assert _rendered(cache_app, '/u/cachy/')
+    assert not _rendered(cache_app, '/u/cachy/')
+    # ... but only for the very same url
+    assert _rendered(cache_app, '/u/cachy/?page=1')
+
+    # Changing a media entry invalidates the cache
+    entry = MediaEntry.query.filter_by(uploader=user.id).first()
+    entry.title = u'Caf\xe9 \u2014 a new title'
+    entry.save()
+    assert _rendered(cache_app, '/u/cachy/')
+    assert u'Caf\xe9' in cache_app.get('/u/cachy/').body.decode('utf-8')
+    assert not _rendered(cache_app, '/u/cachy/')
+
+
+def test_feed_cache(cache_app):
+    user = fixture_add_user(u'feedy')
+    fixture_media_entry(title=u'First', uploader=user.id,
+                        state=u'processed')
+
+    with mock.patch('mediagoblin.db.mixin.cleaned_markdown_conversion',
+                    return_value=u'<p>Rendered</p>') as render:
+        response = cache_app.get('/u/feedy/atom/')
+        assert 'First' in response.body
+        assert render.call_count == 1
+
+        # New media starts a new feed, but the description of the
+        # first entry is still known
+        fixture_media_entry(title=u'Second', uploader=user.id,
+                            state=u'processed')
+        response = cache_app.get('/u/feedy/atom/')
+        assert 'First' in response.body and 'Second' in response.body
+        assert render.call_count == 2
+
+        # Media still being processed is no news
+        fixture_media_entry(title=u'Third', uploader=user.id)
+        assert cache_app.get('/u/feedy/atom/').body == response.body
+        assert render.call_count == 2
+
+
+def test_no_validators_without_cache(test_app):
+    # Only the cache generation notices edits to the media in a gallery
+    user = fixture_add_user(u'uncached')
+    fixture_media_entry(uploader=user.id, state=u'processed')
+    assert not test_app.get('/u/uncached/gallery/').etag
+    assert not test_app.get('/u/uncached/atom/').etag
+
+
+def test_conditional_get(cache_app):
+    user = fixture_add_user(u'poller')
+    media = fixture_media_entry(uploader=user.id, state=u'processed',
+                                expunge=False)
+    media_id, media_url = media.id, '/u/poller/m/%s/' % media.slug
+    user_id = user.id
+    urls = ['/u/poller/atom/', '/u/poller/gallery/', media_url]
+
+    etags = {}
+    for url in urls:
+        response = cache_app.get(url)
+        assert response.etag
+        # Nothing keeps track of when media was edited
+        assert not response.last_modified
+        etags[url] = response.etag
+
+        response = cache_app.get(url, headers={
+            'If-None-Match': '"%s"' % response.etag})
+        assert response.status_int == 304
+
+    def check_changed(urls):
+        for url in urls:
+            response = cache_app.get(url, headers={
+                'If-None-Match': '"%s"' % etags[url]})
+            assert response.status_int == 200
+            assert response.etag != etags[url]
+            etags[url] = response.etag
+
+    # A new comment changes the media page
+    comment = MediaComment()
+    comment.media_entry = media_id
+    comment.author = user_id
+    comment.content = u'Fresh comment'
+    comment.save()
+    check_changed([media_url])
+
+    # An edit changes all of them
+    media = MediaEntry.query.get(media_id)
+    media.title = u'Renamed'
+    media.save()
+    check_changed(urls)
+
+    # A new entry changes the feed, the gallery and the links to the
+    # neighbours of the media
+    fixture_media_entry(uploader=user_id, state=u'processed')
+    check_changed(urls)
+
+
+def test_fragment_cache():
+    env = jinja2.Environment(extensions=[FragmentCacheExtension])
+    tmpl = env.from_string(
+        u'{% cache "frag", key %}{{ calls.append(1) or calls|length }}'
+        u'{% endcache %}')
+
+    orig_cache = mg_globals.cache
+    try:
+        mg_globals.cache = None
+        calls = []
+        assert tmpl.render(key=1, calls=calls) == u'1'
+        assert tmpl.render(key=1, calls=calls) == u'2'
+
+        mg_globals.cache = Cache(MemoryBackend())
+        calls = []
+        assert tmpl.render(key=1, calls=calls) == u'1'
+        assert tmpl.render(key=1, calls=calls) == u'1'
+        assert tmpl.render(key=2, calls=calls) == u'2'
+
+        mg_globals.cache.invalidate()
+        assert tmpl.render(key=1, calls=calls) == u'3'
+    finally:
+        mg_globals.cache = orig_cache
@@ -14,9 +14,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mediagoblin.db.base import Session
-from mediagoblin.db.models import User, MediaEntry, MediaComment
-from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from cStringIO import StringIO
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from mediagoblin.db.base import Base, Session
+from mediagoblin.db.open import QueryCounter
+from mediagoblin.db.models import User, MediaEntry, MediaComment, Collection
+from mediagoblin.db.util import recount_user_media, recount_collection_items
+from mediagoblin.gmg_commands.import_export import (
+    ArchiveError, export_archive, import_archive)
+from mediagoblin.storage.filestorage import BasicFileStorage
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_collection
+from mediagoblin.tools.request import RequestLookups
+from mediagoblin.user_pages.lib import add_media_to_collection
 
 
 def test_404_for_non_existent(test_app):
@@ -91,3 +104,164 @@ def test_media_deletes_broken_attachment(test_app):
 
     MediaEntry.query.get(media.id).delete()
     User.query.get(user_a.id).delete()
+
+
+def _add_tagged_entries(user, count):
+    for i in range(count):
+        entry = fixture_media_entry(title=u'entry %d' % i,
+                                    uploader=user.id, state=u'processed',
+                                    save=False, expunge=False)
+        entry.tags.append({'name': u'Shared', 'slug': u'shared'})
+        entry.tags.append({'name': u'Own %d' % i, 'slug': u'own-%d' % i})
+        entry.save()
+    Session.remove()
+
+
+def _count_queries(test_app, url):
+    statements = []
+    counting = [True]
+
+    def count(conn, cursor, statement, *args):
+        if counting[0]:
+            statements.append(statement)
+
+    # SQLAlchemy 0.8 can't remove listeners, so switch this one off instead
+    event.listen(Session.get_bind(), 'before_cursor_execute', count)
+    try:
+        test_app.get(url)
+    finally:
+        counting[0] = False
+    return len(statements)
+
+
+def test_listing_query_count(test_app):
+    """The number of queries per listing page must not grow with its size"""
+    user = fixture_add_user(u'lister')
+    urls = ['/', '/u/lister/', '/u/lister/gallery/', '/tag/shared/',
+            '/atom/', '/u/lister/atom/', '/tag/shared/atom/']
+
+    _add_tagged_entries(user, 2)
+    few = [_count_queries(test_app, url) for url in urls]
+
+    _add_tagged_entries(user, 10)
+    many = [_count_queries(test_app, url) for url in urls]
+
+    assert few == many
+    assert max(many) <= 10
+
+
+def test_request_lookups(test_app):
+    user_id = fixture_add_user(u'looked_up').id
+    Session.remove()
+
+    counter = QueryCounter(Session.get_bind())
+    counter.reset()
+    lookups = RequestLookups()
+    user = lookups.user(user_id)
+    assert counter.count == 1
+    assert lookups.user_by_username(u'looked_up') is user
+    assert lookups.user(user_id) is user
+    assert counter.count == 1
+
+    # Misses are not remembered
+    assert lookups.user_by_username(u'not_there') is None
+    assert lookups.user_by_username(u'not_there') is None
+    assert counter.count == 3
+
+    # A media page looks the user up once, for the decorator, the view
+    # and the templates
+    slug = fixture_media_entry(uploader=user_id, state=u'processed').slug
+    Session.remove()
+    statements = []
+    counting = [True]
+
+    def collect(conn, cursor, statement, *args):
+        if counting[0]:
+            statements.append(statement)
+
+    event.listen(Session.get_bind(), 'before_cursor_execute', collect)
+    try:
+        test_app.get('/u/looked_up/m/%s/' % slug)
+    finally:
+        counting[0] = False
+    assert len([s for s in statements
+                if 'FROM core__users \nWHERE' in s]) == 1
+
+
+def test_counters(test_app):
+    user = fixture_add_user(u'counted')
+    collection = fixture_add_collection(user=user)
+    for state in (u'processed', u'processed', u'processing', u'failed'):
+        fixture_media_entry(uploader=user.id, state=state)
+
+    def counts():
+        user = User.query.filter_by(username=u'counted').one()
+        return (user.processed_media_count, user.processing_media_count,
+                user.failed_media_count,
+                Collection.query.get(collection.id).items)
+
+    assert counts() == (2, 1, 1, 0)
+
+    # The old state of an expired entry still counts
+    entry = MediaEntry.query.filter_by(uploader=user.id,
+                                       state=u'processing').one()
+    Session.expire(entry)
+    entry.state = u'processed'
+    entry.save()
+    add_media_to_collection(Collection.query.get(collection.id), entry)
+    assert counts() == (3, 0, 1, 1)
+
+    MediaEntry.query.get(entry.id).delete()
+    assert counts() == (2, 0, 1, 0)
+
+    User.query.filter_by(username=u'counted').update(
+        {'processed_media_count': 42})
+    Collection.query.filter_by(id=collection.id).update({'items': 42})
+    recount_user_media()
+    recount_collection_items()
+    assert counts() == (2, 0, 1, 0)
+
+
+def test_export_import(test_app, tmpdir):
+    user = fixture_add_user(u'exporter')
+    entry = fixture_media_entry(title=u'Exported', uploader=user.id,
+                                state=u'processed', expunge=False)
+    entry_id, created = entry.id, entry.created
+    public = BasicFileStorage(str(tmpdir.join('public')))
+    for filepath in entry.media_files.values():
+        with public.get_file(filepath, 'wb') as stored_file:
+            stored_file.write('/'.join(filepath))
+    queue = BasicFileStorage(str(tmpdir.join('queue')))
+    Session.remove()
+
+    archive = StringIO()
+    export_archive(Session.get_bind(), {'public': public, 'queue': queue},
+                   archive, jobs=2)
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    stores = {'public': BasicFileStorage(str(tmpdir.join('new_public'))),
+              'queue': BasicFileStorage(str(tmpdir.join('new_queue')))}
+    checkpoint = str(tmpdir.join('checkpoint'))
+    imported, skipped = import_archive(
+        engine, stores, StringIO(archive.getvalue()), jobs=2,
+        checkpoint=checkpoint)
+    assert imported > 3 and skipped == 0
+
+    row = engine.execute(MediaEntry.__table__.select().where(
+        MediaEntry.__table__.c.id == entry_id)).first()
+    assert row.title == u'Exported'
+    assert row.created == created
+    assert engine.execute(User.__table__.count()).scalar() \
+        == User.query.count()
+    with stores['public'].get_file(['g', 'h', 'i.png']) as stored_file:
+        assert stored_file.read() == 'g/h/i.png'
+
+    # Resuming skips everything that's been imported already ...
+    assert import_archive(
+        engine, stores, StringIO(archive.getvalue()),
+        checkpoint=checkpoint) == (0, imported)
+
+    # ... and without a checkpoint, only empty databases are welcome
+    with pytest.raises(ArchiveError):
+        import_archive(engine, stores, StringIO(archive.getvalue()))
@@ -19,8 +19,10 @@
 
 from mediagoblin.db.base import Session
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.util import render_stored_markdown
+from mediagoblin.tools.text import MARKDOWN_RENDERER_VERSION
 
-from mediagoblin.tests.tools import fixture_add_user
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 
 import mock
 
@@ -165,3 +167,62 @@ def test_media_data_init(test_app):
         obj_in_session += 1
         print repr(obj)
     assert obj_in_session == 0
+
+
+def test_media_siblings(test_app):
+    user_id = fixture_add_user(u'sibling').id
+    other_id = fixture_add_user(u'stranger').id
+
+    def add_entry(slug, state=u'processed', uploader=user_id, **kwargs):
+        return fixture_media_entry(slug=slug, state=state, uploader=uploader,
+                                   gen_slug=False, **kwargs).id
+
+    oldest = add_entry(None, fake_upload=False)
+    add_entry(u'failed', state=u'failed')
+    add_entry(u'strangers', uploader=other_id)
+    middle = add_entry(u'middle')
+    newest = add_entry(u'newest')
+
+    def urlgen(endpoint, **kwargs):
+        return u'/u/%(user)s/m/%(media)s/' % kwargs
+
+    media = MediaEntry.query.get(middle)
+    assert [sibling.id for sibling in media.siblings] == [newest, oldest]
+    assert media.url_to_prev(urlgen) == u'/u/sibling/m/newest/'
+    assert media.url_to_next(urlgen) == u'/u/sibling/m/id:%s/' % oldest
+    # The oldest entry has no files at all
+    assert media.thumb_url_of_next() is None
+
+    media = MediaEntry.query.get(newest)
+    assert media.url_to_prev(urlgen) is None
+    assert media.url_to_next(urlgen) == u'/u/sibling/m/middle/'
+    assert media.thumb_url_of_next() == \
+        MediaEntry.query.get(middle).thumb_url
+
+
+def test_rendered_markdown(test_app):
+    user = fixture_add_user(u'markdowner')
+    entry = fixture_media_entry(uploader=user.id, expunge=False)
+    entry.description = u'Some *emphasis*'
+    entry.save()
+    assert entry.rendered_html == u'<p>Some <em>emphasis</em></p>'
+
+    # Reading the html doesn't render again
+    with mock.patch('mediagoblin.db.mixin.cleaned_markdown_conversion') \
+            as render:
+        assert entry.description_html == u'<p>Some <em>emphasis</em></p>'
+        assert not render.called
+
+    # Rows rendered by another version are ignored, until rendered again
+    table = MediaEntry.__table__
+    Session.execute(table.update().values(
+        rendered_html=u'<p>stale</p>', rendered_version=0))
+    Session.commit()
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.description_html == u'<p>Some <em>emphasis</em></p>'
+
+    assert render_stored_markdown() >= 1
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.rendered_html == u'<p>Some <em>emphasis</em></p>'
+    assert entry.rendered_version == MARKDOWN_RENDERER_VERSION
+    assert render_stored_markdown() == 0
@@ -371,3 +371,39 @@ class TestOpenIDPlugin(object):
             assert not new_openid
 
         _test_delete(self, test_user)
+
+
+def test_store_expiry(openid_plugin_app):
+    import time
+    from openid.association import Association as OIDAssociation
+    from openid.store import nonce
+    from mediagoblin.plugins.openid.models import Association, Nonce
+    from mediagoblin.plugins.openid.store import SQLAlchemyOpenIDStore
+    from mediagoblin.plugins.openid.task import CleanupStoreTask
+
+    store = SQLAlchemyOpenIDStore()
+    now = int(time.time())
+    server = u'http://openid.example.org/'
+
+    store.storeAssociation(server, OIDAssociation(
+        u'expired', 'secret', now - 7200, 3600, u'HMAC-SHA1'))
+    store.storeAssociation(server, OIDAssociation(
+        u'old', 'secret', now - 60, 3600, u'HMAC-SHA1'))
+    store.storeAssociation(server, OIDAssociation(
+        u'new', 'secret', now - 30, 3600, u'HMAC-SHA1'))
+
+    assert store.getAssociation(server).handle == u'new'
+    assert store.getAssociation(server, u'old').handle == u'old'
+    assert store.getAssociation(server, u'expired') is None
+
+    assert store.removeAssociation(server, u'new')
+    assert not store.removeAssociation(server, u'new')
+    assert store.getAssociation(server).handle == u'old'
+
+    assert store.useNonce(server, now, u'salt')
+    Nonce(server_url=server, timestamp=now - nonce.SKEW - 10,
+          salt=u'stale').save()
+
+    assert CleanupStoreTask().run()['associations'] == 1
+    assert [a.handle for a in Association.query] == [u'old']
+    assert [n.salt for n in Nonce.query] == [u'salt']
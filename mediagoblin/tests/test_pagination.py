@@ -0,0 +1,96 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+
+
+KEYSET = (MediaEntry.created, MediaEntry.id)
+
+
+def _add_entries(count):
+    user = fixture_add_user(u'pager')
+    created = datetime.datetime(2013, 7, 1, 12, 0, 0, 123456)
+    for i in range(count):
+        entry = fixture_media_entry(title=u'entry %d' % i,
+                                    uploader=user.id, save=False,
+                                    fake_upload=False, expunge=False)
+        # Every other entry shares its timestamp with the previous one
+        entry.created = created + datetime.timedelta(minutes=i // 2)
+        Session.add(entry)
+    Session.commit()
+    return MediaEntry.query.filter_by(uploader=user.id)
+
+
+def test_keyset_pagination(test_app):
+    query = _add_entries(7)
+    expected = [e.id for e in query.order_by(
+        MediaEntry.created.desc(), MediaEntry.id.desc())]
+
+    # Walk forward through all pages using the seek tokens
+    seen, seek, page = [], None, 1
+    while True:
+        pagination = Pagination(page, query, 3, keyset=KEYSET, seek=seek)
+        items = pagination()
+        assert pagination.total_count == 7
+        assert pagination.has_prev == (page > 1)
+        seen.extend(e.id for e in items)
+        if not pagination.has_next:
+            break
+        seek, page = pagination.next_seek, page + 1
+    assert seen == expected
+    assert page == pagination.pages == 3
+
+    # ... and back again
+    pagination = Pagination(2, query, 3, keyset=KEYSET,
+                            seek=pagination.prev_seek)
+    assert [e.id for e in pagination()] == expected[3:6]
+    pagination = Pagination(1, query, 3, keyset=KEYSET,
+                            seek=pagination.prev_seek)
+    assert [e.id for e in pagination()] == expected[:3]
+    assert not pagination.has_prev
+    assert pagination.has_next
+
+    # Broken tokens fall back to the plain page
+    pagination = Pagination(2, query, 3, keyset=KEYSET, seek='garbage')
+    assert [e.id for e in pagination()] == expected[3:6]
+
+    # Tokens end up in the page links, replacing any stale one
+    url = pagination.get_page_url_explicit(
+        '/u/pager/gallery/', {'seek': 'old'}, 3, pagination.next_seek)
+    assert 'seek=old' not in url
+    assert pagination.next_seek in url
+
+
+def test_keyset_jump_to_id(test_app):
+    query = _add_entries(7)
+    expected = [e.id for e in query.order_by(
+        MediaEntry.created.asc(), MediaEntry.id.asc())]
+
+    for position, entry_id in enumerate(expected):
+        pagination = Pagination(1, query, 3, entry_id, keyset=KEYSET,
+                                descending=False)
+        assert pagination.page == 1 + position // 3
+        assert pagination.active_id == entry_id
+        assert entry_id in [e.id for e in pagination()]
+
+    pagination = Pagination(1, query, 3, 424242, keyset=KEYSET)
+    assert pagination.page == 1
+    assert pagination.active_id is None
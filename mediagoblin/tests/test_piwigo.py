@@ -14,8 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import datetime
+import hashlib
+
 import pytest
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.plugins.piwigo.models import PwgChunkedUpload
+from mediagoblin.plugins.piwigo.tools import delete_stale_uploads
 from .tools import fixture_add_user
+from .resources import GOOD_JPG
 
 
 XML_PREFIX = "<?xml version='1.0' encoding='utf-8'?>\n"
@@ -31,9 +41,9 @@ class Test_PWG(object):
         self.username = u"chris"
         self.password = "toast"
 
-    def do_post(self, method, params):
+    def do_post(self, method, params, **kwargs):
         params["method"] = method
-        return self.test_app.post("/api/piwigo/ws.php", params)
+        return self.test_app.post("/api/piwigo/ws.php", params, **kwargs)
 
     def do_get(self, method, params=None):
         if params is None:
@@ -69,3 +79,83 @@ class Test_PWG(object):
         resp = self.do_get("pwg.session.getStatus")
         assert resp.body == XML_PREFIX \
             + '<rsp stat="ok"><username>guest</username></rsp>'
+
+    def add_chunks(self, data, original_sum, chunk_size, positions):
+        for position in positions:
+            chunk = data[position * chunk_size:(position + 1) * chunk_size]
+            resp = self.do_post("pwg.images.addChunk", {
+                "original_sum": original_sum,
+                "type": "file",
+                "position": str(position),
+                "data": base64.b64encode(chunk)})
+            assert resp.body == XML_PREFIX + '<rsp stat="ok">1</rsp>'
+
+    def test_chunked_upload(self):
+        self.do_post("pwg.session.login",
+            {"username": self.username, "password": self.password})
+
+        with open(GOOD_JPG, 'rb') as f:
+            data = f.read()
+        original_sum = hashlib.md5(data).hexdigest()
+        chunk_size = len(data) // 3 + 1
+
+        # Out of order, and one chunk sent again as if resumed
+        self.add_chunks(data, original_sum, chunk_size, [2, 0, 0, 1])
+        upload = PwgChunkedUpload.query.filter_by(
+            original_sum=original_sum).one()
+        assert upload.chunks == 3
+        queue_store = mg_globals.app.queue_store
+        assert queue_store.file_exists(upload.chunk_path(2))
+
+        resp = self.do_post("pwg.images.add", {
+            "original_sum": original_sum,
+            "file_sum": original_sum,
+            "name": u"Chunky"})
+        assert '<image_id>' in resp.body
+
+        entry = MediaEntry.query.filter_by(title=u"Chunky").one()
+        assert entry.media_type == u'mediagoblin.media_types.image'
+        assert entry.state == u'processed'
+        assert entry.media_files['original'][-1].endswith('Chunky.jpeg')
+        assert entry.upload_hash == unicode(hashlib.sha1(data).hexdigest())
+        assert PwgChunkedUpload.query.filter_by(
+            original_sum=original_sum).count() == 0
+        assert not queue_store.file_exists(upload.chunk_path(2))
+
+    def test_chunked_upload_checks_md5(self):
+        self.do_post("pwg.session.login",
+            {"username": self.username, "password": self.password})
+
+        with open(GOOD_JPG, 'rb') as f:
+            data = f.read()
+        wrong_sum = hashlib.md5('not the data').hexdigest()
+        self.add_chunks(data, wrong_sum, len(data), [0])
+
+        resp = self.do_post("pwg.images.add", {
+            "original_sum": wrong_sum,
+            "file_sum": wrong_sum,
+            "name": u"Corrupted"}, status=500)
+        assert 'md5 checksum mismatch' in resp.body
+        assert MediaEntry.query.filter_by(title=u"Corrupted").count() == 0
+        assert PwgChunkedUpload.query.filter_by(
+            original_sum=wrong_sum).count() == 0
+
+    def test_stale_chunked_uploads(self):
+        self.do_post("pwg.session.login",
+            {"username": self.username, "password": self.password})
+
+        original_sum = hashlib.md5('never finished').hexdigest()
+        self.add_chunks('never finished', original_sum, 5, [0, 1])
+
+        queue_store = mg_globals.app.queue_store
+        upload = PwgChunkedUpload.query.filter_by(
+            original_sum=original_sum).one()
+        assert delete_stale_uploads(queue_store, 3600) == 0
+
+        upload.updated = datetime.datetime.now() - datetime.timedelta(
+            hours=2)
+        upload.save()
+        assert delete_stale_uploads(queue_store, 3600) == 1
+        assert not queue_store.file_exists(upload.chunk_path(0))
+        assert PwgChunkedUpload.query.filter_by(
+            original_sum=original_sum).count() == 0
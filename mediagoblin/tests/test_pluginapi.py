@@ -304,6 +304,40 @@ def test_hook_transform():
         "expand_tuple", (-1, 0)) == (-1, 0, 1, 2, 3)
 
 
+@with_cleanup()
+def test_hook_dispatch_table_and_stats():
+    """
+    Test that hooks registered late are picked up and calls are counted
+    """
+    cfg = build_config(CONFIG_ALL_CALLABLES)
+    cfg['mediagoblin']['profile_hooks'] = True
+
+    mg_globals.app_config = cfg['mediagoblin']
+    mg_globals.global_config = cfg
+
+    setup_plugins()
+
+    try:
+        assert pluginapi.hook_transform("late_hook", 1) == 1
+        pluginapi.PluginManager().register_hooks({
+            "late_hook": [lambda x: x + 1, lambda x: x * 3]})
+        assert pluginapi.hook_transform("late_hook", 1) == 6
+
+        assert pluginapi.hook_runall("just_one", []) == ["Called just once"]
+        assert pluginapi.hook_handle(
+            "nothing_handling", default_handler=lambda: 42) == 42
+
+        stats = pluginapi.get_hook_stats()
+        assert stats["late_hook"][0] == 2
+        assert stats["just_one"][0] == 1
+        assert stats["nothing_handling"][0] == 1
+        assert stats["just_one"][1] >= 0
+    finally:
+        pluginapi.profile_hooks(False)
+
+    assert pluginapi.get_hook_stats() is None
+
+
 def test_plugin_config():
     """
     Make sure plugins can set up their own config
@@ -1,6 +1,23 @@
 #!/usr/bin/env python
 
-from mediagoblin import processing
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+import argparse
+
+import mock
+
+from mediagoblin import mg_globals, processing
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.gmg_commands import reprocess
+from mediagoblin.gmg_commands.workers import worker_commands
+from mediagoblin.submit.lib import run_process_media
+from mediagoblin.media_types.image.processing import ResizePipeline, \
+    draft_size
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from .resources import GOOD_JPG
 
 class TestProcessing(object):
     def run_fill(self, input, format, output=None):
@@ -16,3 +33,193 @@ class TestProcessing(object):
     def test_long_filename_fill(self):
         self.run_fill('{0}.png'.format('A' * 300), 'image-{basename}{ext}',
                       'image-{0}.png'.format('A' * 245))
+
+
+def test_resize_pipeline(test_app, tmpdir):
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    pipeline = ResizePipeline(GOOD_JPG, {}, 90, 'ANTIALIAS')
+    pipeline.add('medium', 'good.medium.jpg', (320, 320))
+    pipeline.add('thumb', 'good.thumbnail.jpg', (100, 100), force=True)
+    # Already small enough, so this one is skipped
+    pipeline.add('big', 'good.big.jpg', (1024, 1024))
+    pipeline.run(entry, str(tmpdir))
+
+    assert sorted(entry.media_files.keys()) == ['medium', 'thumb']
+    for keyname, size in [('medium', (320, 214)), ('thumb', (100, 66))]:
+        resized = Image.open(
+            mg_globals.public_store.get_local_path(entry.media_files[keyname]))
+        assert resized.size == size
+
+    assert pipeline.timings.keys() == [
+        'open', 'decode', 'resize:medium', 'resize:thumb',
+        'store:medium', 'store:thumb']
+
+
+def test_draft_size():
+    assert draft_size((4000, 3000), (640, 1000)) == (640, 480)
+    # Rotated, the image is 3000x4000 and fits into the box at 640x853:
+    # the original has to be decoded at 853x640 at least
+    assert draft_size((4000, 3000), (640, 1000), True) == (853, 640)
+    # Square boxes don't care
+    assert draft_size((4000, 3000), (640, 640), True) == (640, 480)
+
+
+def test_clone_duplicate_entry(test_app):
+    user = fixture_add_user()
+    original = fixture_media_entry(title=u'original', uploader=user.id,
+                                   state=u'processed', fake_upload=False,
+                                   expunge=False)
+    original.media_type = u'mediagoblin.media_types.image'
+    original.upload_hash = u'8843d7f92416211de9ebb963ff4ce28125932878'
+    processing.store_public(original, u'original', GOOD_JPG, 'good.jpg')
+    original.save()
+
+    entry = fixture_media_entry(title=u'duplicate', uploader=user.id,
+                                fake_upload=False, expunge=False)
+    entry.media_type = original.media_type
+    entry.upload_hash = original.upload_hash
+    assert processing.find_duplicate_entry(entry) == original
+    assert processing.find_duplicate_entry(original) is None
+
+    processing.clone_processed_entry(entry, original)
+    filepath = entry.media_files[u'original']
+    assert filepath == [u'media_entries', unicode(entry.id), u'good.jpg']
+    assert mg_globals.public_store.file_exists(filepath)
+
+
+def test_processing_queues(test_app):
+    config = mg_globals.global_config['processing']
+    queues = {
+        'mediagoblin.media_types.video': 'video',
+        'mediagoblin.media_types.video:resize': 'video_thumbs'}
+
+    with mock.patch.dict(config['queues'], queues):
+        assert processing.get_processing_queue(
+            'mediagoblin.media_types.video', 'initial') == 'video'
+        assert processing.get_processing_queue(
+            'mediagoblin.media_types.video', 'resize') == 'video_thumbs'
+        assert processing.get_processing_queue(
+            'mediagoblin.media_types.image', 'initial') == 'celery'
+
+        entry = fixture_media_entry(fake_upload=False, expunge=False)
+        entry.media_type = u'mediagoblin.media_types.video'
+        with mock.patch('mediagoblin.submit.lib.ProcessMedia') as task:
+            run_process_media(entry)
+            run_process_media(entry, reprocess_action='resize')
+        calls = task.return_value.apply_async.call_args_list
+        assert [(call[1]['queue'], call[1]['priority']) for call in calls] \
+            == [('video', 9), ('video_thumbs', 0)]
+
+
+def test_worker_commands():
+    config = {'processing': {
+        'default_queue': 'celery',
+        'queues': {'mediagoblin.media_types.image': 'images',
+                   'mediagoblin.media_types.video': 'video'},
+        'worker_concurrency': {'images': 8, 'video': 1}}}
+
+    commands = dict(worker_commands(config))
+    assert sorted(commands) == ['celery', 'images', 'video']
+    assert commands['video'][-2:] == ['--concurrency', '1']
+    assert '--concurrency' not in commands['celery']
+    assert commands['images'][commands['images'].index('--queues') + 1] \
+        == 'images'
+
+    assert [queue for queue, command in worker_commands(config, ['video'])] \
+        == ['video']
+
+    beats = [command for queue, command in worker_commands(config, beat=True)
+             if '--beat' in command]
+    assert len(beats) == 1
+
+
+def _bulk_args(**kwargs):
+    args = dict(jobs=1, chunk_size=2, checkpoint=None, celery=False)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_bulk_process_checkpoint(test_app, tmpdir):
+    user = fixture_add_user(u'bulky')
+    ids = [fixture_media_entry(uploader=user.id).id for i in range(5)]
+    query = MediaEntry.query.filter(MediaEntry.id.in_(ids))
+    failing, not_eligible = ids[1], ids[3]
+    calls = []
+
+    def func(args, media_id):
+        calls.append(media_id)
+        if media_id == failing:
+            raise Exception('Broken')
+        if media_id == not_eligible:
+            return False
+
+    checkpoint = tmpdir.join('checkpoint')
+    with mock.patch.object(reprocess, '_process_chunk',
+                           side_effect=reprocess._process_chunk) as chunks:
+        reprocess.bulk_process(
+            _bulk_args(checkpoint=str(checkpoint)), query, func)
+    assert [len(call[0][0][2]) for call in chunks.call_args_list] \
+        == [2, 2, 1]
+    assert calls == ids
+
+    # Only what was reprocessed is recorded ...
+    assert checkpoint.read().split() == [
+        str(media_id) for media_id in ids
+        if media_id not in (failing, not_eligible)]
+
+    # ... so resuming tries the rest again
+    del calls[:]
+    reprocess.bulk_process(
+        _bulk_args(checkpoint=str(checkpoint)), query, func)
+    assert calls == [failing, not_eligible]
+    assert len(checkpoint.read().split()) == 3
+
+    # Queued media might still fail, it can't be checkpointed
+    del calls[:]
+    reprocess.bulk_process(
+        _bulk_args(checkpoint=str(tmpdir.join('other')), celery=True),
+        query, func)
+    assert calls == []
+
+    # Processors that don't apply report a skip
+    args = argparse.Namespace(reprocess_command='nonexistent',
+                              reprocess_args=[])
+    assert reprocess.run(args, ids[0]) is False
+
+
+class RecordingSink(object):
+    def __init__(self):
+        self.reports = []
+
+    def set(self, entry_id, progress):
+        self.reports.append(progress)
+
+
+def test_progress_callback_throttling():
+    entry = mock.Mock(id=1)
+    sink = RecordingSink()
+    callback = processing.ProgressCallback(entry, sink, interval=5)
+
+    with mock.patch('time.time') as now:
+        for seconds, progress in [(0, 0), (0, 1.2), (1, 1.7), (2, 2.1),
+                                  (6, 2.9), (7, 10), (12, 11), (13, 100)]:
+            now.return_value = seconds
+            callback(progress)
+
+    # No 0, no repeated percent, at most every 5s, but always the 100
+    assert sink.reports == [1, 2, 11, 100]
+
+
+def test_processing_progress(test_app):
+    user = fixture_add_user(u'progressive', u'secret')
+    entry = fixture_media_entry(uploader=user.id, state=u'processing',
+                                fake_upload=False)
+    fixture_media_entry(uploader=user.id, state=u'processed',
+                        fake_upload=False)
+    processing.ProgressCallback(entry)(42.5)
+
+    test_app.post('/auth/login/', {
+        'username': u'progressive',
+        'password': u'secret'})
+    response = test_app.get('/u/progressive/panel/progress/')
+    assert response.json == {str(entry.id): 42}
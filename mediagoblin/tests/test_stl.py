@@ -0,0 +1,86 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2013 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+from StringIO import StringIO
+
+import pytest
+
+from mediagoblin.media_types.stl import model_loader
+
+
+TRIANGLES = [
+    ((0, 0, 1), (0.0, 0.0, 0.0), (2.0, 0.0, 0.0), (0.0, 4.0, 0.0)),
+    ((0, 0, 1), (2.0, 4.0, 0.0), (0.0, 4.0, -6.0), (2.0, 0.0, 0.0))]
+
+
+def binary_stl(triangles):
+    data = 'binary stl'.ljust(80) + struct.pack('<I', len(triangles))
+    for triangle in triangles:
+        data += struct.pack('<12fH', *(sum(triangle, ()) + (0,)))
+    return data
+
+
+def ascii_stl(triangles):
+    lines = ['solid test']
+    for normal, a, b, c in triangles:
+        lines.append('  facet normal %s %s %s' % normal)
+        lines.append('    outer loop')
+        for vertex in a, b, c:
+            lines.append('      vertex %s %s %s' % vertex)
+        lines.append('    endloop')
+        lines.append('  endfacet')
+    lines.append('endsolid test')
+    return '\n'.join(lines) + '\n'
+
+
+def check_extents(model):
+    assert model.min == [0.0, 0.0, -6.0]
+    assert model.max == [2.0, 4.0, 0.0]
+    assert (model.width, model.depth, model.height) == (2.0, 4.0, 6.0)
+    assert model.average == [1.0, 2.0, -1.0]
+
+
+def test_binary_stl(tmpdir):
+    model = model_loader.auto_detect(StringIO(binary_stl(TRIANGLES)), 'stl')
+    assert isinstance(model, model_loader.BinaryStlModel)
+    check_extents(model)
+
+    # Real files are mapped instead of read
+    path = tmpdir.join('model.stl')
+    path.write(binary_stl(TRIANGLES), 'wb')
+    with path.open('rb') as model_file:
+        check_extents(model_loader.auto_detect(model_file, 'stl'))
+
+
+def test_ascii_stl_and_obj():
+    model = model_loader.auto_detect(StringIO(ascii_stl(TRIANGLES)), 'stl')
+    assert isinstance(model, model_loader.ObjModel)
+    check_extents(model)
+
+    obj = '# a comment\n\nv 0 0 0\nv 2 4 0 1.0\nvn 0 0 100\nv  0 4 -6\nf 1 2 3\n'
+    model = model_loader.auto_detect(StringIO(obj), 'obj')
+    assert model.min == [0.0, 0.0, -6.0]
+    assert model.max == [2.0, 4.0, 0.0]
+
+
+def test_broken_models():
+    with pytest.raises(model_loader.ThreeDeeParseError):
+        model_loader.auto_detect(StringIO(binary_stl(TRIANGLES)[:-10]), 'stl')
+
+    with pytest.raises(model_loader.ThreeDeeParseError):
+        model_loader.auto_detect(StringIO('solid empty\nendsolid empty\n'),
+                                 'stl')
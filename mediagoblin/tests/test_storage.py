@@ -86,12 +86,14 @@ def test_storage_system_from_config():
 # Basic file storage tests
 ##########################
 
-def get_tmp_filestorage(mount_url=None, fake_remote=False):
+def get_tmp_filestorage(mount_url=None, fake_remote=False,
+                        content_addressed=False):
     tmpdir = tempfile.mkdtemp(prefix="test_gmg_storage")
     if fake_remote:
         this_storage = FakeRemoteStorage(tmpdir, mount_url)
     else:
-        this_storage = storage.filestorage.BasicFileStorage(tmpdir, mount_url)
+        this_storage = storage.filestorage.BasicFileStorage(
+            tmpdir, mount_url, content_addressed=content_addressed)
     return tmpdir, this_storage
 
 
@@ -319,3 +321,51 @@ def test_basic_storage_copy_local_to_storage():
 def test_general_storage_copy_local_to_storage():
     tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
     _test_copy_local_to_storage_works(tmpdir, this_storage)
+
+
+def test_content_addressed_storage():
+    tmpdir, this_storage = get_tmp_filestorage(content_addressed=True)
+
+    local_filename = tempfile.mktemp()
+    with file(local_filename, 'w') as tmpfile:
+        tmpfile.write('haha')
+
+    first = ['dir1', 'first.txt']
+    second = ['dir2', 'second.txt']
+    this_storage.copy_local_to_storage(local_filename, first)
+    this_storage.copy_local_to_storage(local_filename, second)
+    os.remove(local_filename)
+
+    # Both share one blob
+    blob_dir = os.path.join(tmpdir, this_storage.BLOB_DIR)
+    blob_subdir, = os.listdir(blob_dir)
+    blob, = os.listdir(os.path.join(blob_dir, blob_subdir))
+    blob = os.path.join(blob_dir, blob_subdir, blob)
+    assert os.stat(blob).st_nlink == 3
+    assert os.path.samefile(blob, this_storage.get_local_path(first))
+
+    # copy_file only adds another reference
+    third = ['dir2', 'third.txt']
+    this_storage.copy_file(first, third)
+    assert os.stat(blob).st_nlink == 4
+
+    # Writing to one of them does not touch the others
+    with this_storage.get_file(second, 'w') as our_file:
+        our_file.write('hoho')
+    with this_storage.get_file(first, 'a') as our_file:
+        our_file.write('hihi')
+    assert file(blob).read() == 'haha'
+    assert this_storage.get_file(first).read() == 'hahahihi'
+    assert this_storage.get_file(second).read() == 'hoho'
+    assert os.stat(blob).st_nlink == 2
+
+    # The blob goes away with its last reference
+    this_storage.delete_file(first)
+    this_storage.delete_file(second)
+    assert os.path.exists(blob)
+    this_storage.delete_file(third)
+    assert not os.path.exists(blob)
+
+    os.rmdir(os.path.join(blob_dir, blob_subdir))
+    os.rmdir(blob_dir)
+    cleanup_storage(this_storage, tmpdir, ['dir1'], ['dir2'])
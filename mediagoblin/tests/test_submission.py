@@ -18,17 +18,25 @@ import sys
 reload(sys)
 sys.setdefaultencoding('utf-8')
 
+import hashlib
 import urlparse
 import os
 import pytest
+import mock
+from StringIO import StringIO
 
 from mediagoblin.tests.tools import fixture_add_user
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools import template
 from mediagoblin.media_types.image import ImageMediaManager
+from mediagoblin.submit.lib import store_upload, new_upload_entry, \
+    queue_upload, run_process_media
+from mediagoblin.media_types import sniff_media, FileTypeNotSupported
 from mediagoblin.media_types.pdf.processing import check_prerequisites as pdf_check_prerequisites
 
+from werkzeug.datastructures import FileStorage
+
 from .resources import GOOD_JPG, GOOD_PNG, EVIL_FILE, EVIL_JPG, EVIL_PNG, \
     BIG_BLUE, GOOD_PDF, GPS_JPG
 
@@ -292,3 +300,66 @@ class TestSubmission:
             size = os.stat(filename).st_size
             assert last_size > size
             last_size = size
+
+
+def test_store_upload():
+    with open(GOOD_JPG, 'rb') as upload:
+        data = upload.read()
+        upload.seek(0)
+        queue_file = StringIO()
+        file_hash = store_upload(upload, queue_file, chunk_size=1000)
+
+    assert queue_file.getvalue() == data
+    assert file_hash == hashlib.sha1(data).hexdigest()
+
+
+def test_sniff_media_by_magic(test_app):
+    def upload(path):
+        with open(path, 'rb') as f:
+            return FileStorage(StringIO(f.read()), filename='upload')
+
+    def fail(*args, **kwargs):
+        assert False, 'The upload should not need to be copied'
+
+    image = upload(GOOD_PNG)
+    with mock.patch('tempfile.NamedTemporaryFile', fail):
+        media_type, manager = sniff_media(image)
+    assert media_type == 'mediagoblin.media_types.image'
+    assert manager is ImageMediaManager
+    assert image.stream.tell() == 0
+
+    # The result is remembered for the rest of the request
+    image.stream.close()
+    assert sniff_media(image)[0] == 'mediagoblin.media_types.image'
+
+    if pdf_check_prerequisites():
+        assert sniff_media(upload(GOOD_PDF))[0] == \
+            'mediagoblin.media_types.pdf'
+
+    evil = upload(EVIL_FILE)
+    with pytest.raises(FileTypeNotSupported):
+        sniff_media(evil)
+    with pytest.raises(FileTypeNotSupported):
+        sniff_media(evil)
+
+
+def test_process_upload_sniffed_by_magic(test_app):
+    user = fixture_add_user(u'magicuser')
+    entry = new_upload_entry(user)
+    with open(GOOD_JPG, 'rb') as f:
+        upload = FileStorage(StringIO(f.read()), filename='upload')
+    media_type, manager = queue_upload(
+        mg_globals.app, entry, upload, 'upload')
+    entry.media_type = unicode(media_type)
+    entry.title = u'upload'
+    entry.generate_slug()
+    entry.save()
+    entry_id = entry.id
+    run_process_media(entry)
+
+    entry = MediaEntry.query.get(entry_id)
+    assert entry.state == u'processed'
+    for key, basename in (('original', 'upload.jpg'),
+                          ('medium', 'upload.medium.jpg'),
+                          ('thumb', 'upload.thumbnail.jpg')):
+        assert entry.media_files[key][-1].endswith(basename)
@@ -14,6 +14,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import Tag
+from mediagoblin.processing import mark_entry_failed
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 from mediagoblin.tools import text
 
 def test_list_of_dicts_conversion(test_app):
@@ -37,3 +41,68 @@ def test_list_of_dicts_conversion(test_app):
     assert text.media_tags_as_string([{'name': u'yin', 'slug': u'yin'},
                                       {'name': u'yang', 'slug': u'yang'}]) == \
                                       u'yin, yang'
+
+
+def test_tag_counts_and_orphans(test_app):
+    user = fixture_add_user(u'tagger')
+
+    first = fixture_media_entry(uploader=user.id, state=u'processed',
+                                save=False, expunge=False)
+    # "Yin!" has the same slug as "yin"
+    first.tags = text.convert_to_tag_list_of_dicts(u'yin, yang, Yin!')
+    first.save()
+    second = fixture_media_entry(uploader=user.id, state=u'processed',
+                                 save=False, expunge=False)
+    second.tags = text.convert_to_tag_list_of_dicts(u'yang, zen')
+    second.save()
+
+    assert [tag['name'] for tag in first.tags] == [u'yin', u'yang']
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'yin': 1, u'yang': 2, u'zen': 1}
+    assert [tag.slug for tag in Tag.popular(2)] == [u'yang', u'yin']
+
+    # Unchanged tags keep their row, only the name is updated
+    yang_id = first.tags_helper[1].id
+    first.tags = text.convert_to_tag_list_of_dicts(u'Yang, om')
+    first.save()
+    assert first.tags_helper[0].id == yang_id
+    assert [tag['name'] for tag in first.tags] == [u'Yang', u'om']
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'yin': 0, u'yang': 2, u'zen': 1, u'om': 1}
+
+    # Deleting media cleans up all unused tags
+    second.delete()
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'yang': 1, u'om': 1}
+
+    response = test_app.get('/')
+    assert 'Popular tags' in response.body
+    assert '/tag/om/' in response.body
+
+
+def test_tag_counts_only_processed_media(test_app):
+    user = fixture_add_user(u'tagger')
+
+    # Tags are attached when submitting, before processing
+    entry = fixture_media_entry(uploader=user.id, state=u'processing',
+                                save=False, expunge=False)
+    entry.tags = text.convert_to_tag_list_of_dicts(u'pending')
+    entry.save()
+    failed = fixture_media_entry(uploader=user.id, state=u'failed',
+                                 save=False, expunge=False)
+    failed.tags = text.convert_to_tag_list_of_dicts(u'pending, broken')
+    failed.save()
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'pending': 0, u'broken': 0}
+    assert list(Tag.popular()) == []
+
+    entry.state = u'processed'
+    entry.save()
+    entry_id = entry.id
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'pending': 1, u'broken': 0}
+
+    # Failing goes around the orm
+    mark_entry_failed(entry_id, Exception())
+    assert dict(Session.query(Tag.slug, Tag.media_count)) == {
+        u'pending': 0, u'broken': 0}
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import email
+import threading
 
 from mediagoblin.tools import common, url, translate, mail, text, testing
 
@@ -143,3 +144,34 @@ def test_html_cleaner():
         '<p><a href="javascript:nasty_surprise">innocent link!</a></p>')
     assert result == (
         '<p><a href="">innocent link!</a></p>')
+
+
+def test_markdown_conversion_is_isolated():
+    # Reference links don't carry over to the next document
+    text.cleaned_markdown_conversion(u'[a]: http://example.org/')
+    assert text.cleaned_markdown_conversion(u'see [this][a]') == \
+        u'<p>see [this][a]</p>'
+
+    # Every thread has a converter of its own
+    sources = [u'*%d* [x][%d]\n\n[%d]: http://example.org/%d' % (i, i, i, i)
+               for i in range(20)]
+    expected = [text.cleaned_markdown_conversion(source)
+                for source in sources]
+    results = {}
+    instances = []
+
+    def convert(thread_no):
+        instances.append(text.get_markdown_instance())
+        results[thread_no] = [text.cleaned_markdown_conversion(source)
+                              for source in sources * 5]
+
+    threads = [threading.Thread(target=convert, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    for result in results.values():
+        assert result == expected * 5
+    assert len(set(id(instance) for instance in instances)) == 4
@@ -0,0 +1,298 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Caching of rendered pages and template fragments.
+
+All keys live in a "generation": whenever a media entry, comment or
+collection changes, a new generation is started and everything cached
+before is ignored from then on.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+import cPickle as pickle
+from collections import OrderedDict
+
+from jinja2 import nodes, Markup
+from jinja2.ext import Extension
+from sqlalchemy import event
+
+from mediagoblin import mg_globals
+
+_log = logging.getLogger(__name__)
+
+
+GENERATION_KEY = 'mediagoblin:cache:generation'
+
+
+class MemoryBackend(object):
+    """
+    A least recently used cache living in this process.
+
+    Changes made by other processes (like celery workers) only become
+    visible once entries time out; use a shared backend if that matters.
+    """
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires and expires < time.time():
+                return None
+            self._entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value, timeout=0):
+        expires = timeout and time.time() + timeout
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MemcachedBackend(object):
+    """Cache in memcached, shared by all processes"""
+    def __init__(self, servers):
+        import memcache
+        self._client = memcache.Client(servers or ['127.0.0.1:11211'])
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, timeout=0):
+        self._client.set(key, value, time=timeout)
+
+    def clear(self):
+        self._client.flush_all()
+
+
+class RedisBackend(object):
+    """Cache in redis (or anything speaking its protocol)"""
+    def __init__(self, servers):
+        import redis
+        self._client = redis.StrictRedis.from_url(
+            servers[0] if servers else 'redis://localhost:6379/0')
+
+    def get(self, key):
+        value = self._client.get(key)
+        if value is not None:
+            return pickle.loads(value)
+
+    def set(self, key, value, timeout=0):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if timeout:
+            self._client.setex(key, timeout, value)
+        else:
+            self._client.set(key, value)
+
+    def clear(self):
+        self._client.flushdb()
+
+
+BACKENDS = {
+    'memory': lambda config: MemoryBackend(config['max_entries']),
+    'memcached': lambda config: MemcachedBackend(config['servers']),
+    'redis': lambda config: RedisBackend(config['servers'])}
+
+
+class Cache(object):
+    """
+    Generational cache on top of one of the backends.
+    """
+    def __init__(self, backend, timeout=300):
+        self.backend = backend
+        self.timeout = timeout
+
+    @property
+    def generation(self):
+        generation = self.backend.get(GENERATION_KEY)
+        if generation is None:
+            generation = self.invalidate()
+        return generation
+
+    def invalidate(self):
+        """Start a new generation, dropping everything cached so far"""
+        # A random generation (rather than a counter) can't fall back
+        # to an old one if the backend evicts this key
+        generation = uuid.uuid4().hex
+        self.backend.set(GENERATION_KEY, generation)
+        return generation
+
+    def make_key(self, *parts):
+        return self._make_key(self.generation, parts)
+
+    def make_stable_key(self, *parts):
+        """
+        Like make_key, but the key outlives new generations: only use
+        this if parts change whenever the cached value does.
+        """
+        return self._make_key('stable', parts)
+
+    def _make_key(self, prefix, parts):
+        key = u'\x00'.join(unicode(part) for part in parts)
+        return 'mediagoblin:cache:%s:%s' % (
+            prefix, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        self.backend.set(key, value, timeout)
+
+
+def cache_generation():
+    """
+    The current generation of mg_globals.cache, or None if caching is
+    disabled.
+
+    Use it in the validators of pages listing media: no column keeps
+    track of edits to media, but every edit starts a new generation.
+    """
+    if mg_globals.cache is None:
+        return None
+    return mg_globals.cache.generation
+
+
+def cache_from_config(cache_config):
+    """
+    Create the Cache described by the [cache] config section, or
+    return None if caching is disabled.
+    """
+    if not cache_config['enabled']:
+        return None
+
+    cache = Cache(BACKENDS[cache_config['backend']](cache_config),
+                  cache_config['timeout'])
+    _log.info("Caching pages in %s", cache_config['backend'])
+    return cache
+
+
+########################################
+# Invalidate when the relevant rows change
+########################################
+
+def _invalidating_models():
+    from mediagoblin.db.models import (MediaEntry, MediaComment,
+        Collection, CollectionItem, User)
+    return (MediaEntry, MediaComment, Collection, CollectionItem, User)
+
+
+def _note_changes(session, flush_context):
+    models = _invalidating_models()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, models):
+            session._mg_cache_dirty = True
+            return
+
+
+def _invalidate_on_commit(session):
+    if getattr(session, '_mg_cache_dirty', False):
+        session._mg_cache_dirty = False
+        if mg_globals.cache is not None:
+            mg_globals.cache.invalidate()
+
+
+def _forget_changes(session, *args):
+    session._mg_cache_dirty = False
+
+
+_listening = []
+
+
+def listen_for_changes(Session):
+    """
+    Start a new cache generation whenever a transaction changing
+    media, comments, collections or users is committed.
+    """
+    if _listening:
+        return
+    # Changes are only noted in after_flush: by after_commit the
+    # session does not know anymore what was changed.
+    event.listen(Session, 'after_flush', _note_changes)
+    event.listen(Session, 'after_commit', _invalidate_on_commit)
+    event.listen(Session, 'after_rollback', _forget_changes)
+    _listening.append(Session)
+
+
+########################################
+# Template fragments
+########################################
+
+class FragmentCacheExtension(Extension):
+    """
+    Cache the rendered output of part of a template.
+
+    Use:
+      {% cache "media_grid", media_entries|map(attribute='id')|list %}
+        ...
+      {% endcache %}
+
+    All arguments together make up the key; the locale of the
+    environment is added automatically.  Renders the block as usual if
+    caching is disabled.
+    """
+
+    tags = set(["cache"])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache_locale=None)
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [nodes.List(args)]),
+            [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key_parts, caller):
+        cache = mg_globals.cache
+        if cache is None:
+            return caller()
+
+        key = cache.make_key(
+            'fragment', self.environment.fragment_cache_locale, *key_parts)
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = caller()
+            cache.set(key, rendered)
+        return Markup(rendered)
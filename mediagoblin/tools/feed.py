@@ -0,0 +1,156 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The Atom feeds of users, collections, tags and the whole site.
+
+Feeds are cached under their URL and the newest item and number of
+items they list, so a feed is built anew as soon as new media lands in
+it, even if that happened in another process.  The rendered description
+of every item is cached on its own, so that a new item does not mean
+running Markdown over the others again.
+"""
+
+from werkzeug.contrib.atom import AtomFeed
+from werkzeug.wrappers import Response
+
+from mediagoblin import mg_globals
+from mediagoblin.db.util import newest_in_query
+from mediagoblin.tools.response import make_etag, not_modified, \
+    set_validators
+
+
+ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
+
+
+def cached_html(kind, obj_id, updated, source, render):
+    """
+    Return render(), the html rendered from source, caching it under
+    the id and update time of the object it belongs to.
+    """
+    cache = mg_globals.cache
+    if cache is None:
+        return render()
+
+    # The source is part of the key, so edits show up right away
+    key = cache.make_stable_key('feed-item', kind, obj_id, updated, source)
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html)
+    return html
+
+
+def media_entry_item(entry):
+    """Feed item for a MediaEntry: its description, added when created"""
+    return entry, entry.created, cached_html(
+        u'media', entry.id, entry.created, entry.description,
+        lambda: entry.description_html)
+
+
+def collection_item_item(item):
+    """Feed item for a CollectionItem: its note, added when collected"""
+    return item.get_media_entry, item.added, cached_html(
+        u'collection_item', item.id, item.added, item.note,
+        lambda: item.note_html)
+
+
+def atom_links(link):
+    """The alternate link of a feed, plus the configured PuSH hubs"""
+    links = [{
+        'href': link,
+        'rel': 'alternate',
+        'type': 'text/html'}]
+
+    for push_url in mg_globals.app_config["push_urls"]:
+        links.append({
+            'rel': 'hub',
+            'href': push_url})
+    return links
+
+
+def build_atom_feed(request, title, feed_id, link, items):
+    """
+    Return an AtomFeed of items, (media entry, updated, html content)
+    tuples.  The uploaders of the entries should be loaded already.
+    """
+    feed = AtomFeed(
+        title,
+        feed_url=request.url,
+        id=feed_id,
+        links=atom_links(link))
+
+    for entry, updated, content in items:
+        url = entry.url_for_self(request.urlgen, qualified=True)
+        username = entry.get_uploader.username
+        feed.add(entry.title,
+            content,
+            id=url,
+            content_type='html',
+            author={
+                'name': username,
+                'uri': request.urlgen(
+                    'mediagoblin.user_pages.user_home',
+                    qualified=True, user=username)},
+            updated=updated,
+            links=[{
+                'href': url,
+                'rel': 'alternate',
+                'type': 'text/html'}])
+
+    return feed
+
+
+def atom_feed_response(request, query, keyset, make_item, title, feed_id,
+                       link, etag_parts=(),
+                       limit=ATOM_DEFAULT_NR_OF_UPDATED_ITEMS):
+    """
+    Respond with the Atom feed of the newest rows of query.
+
+    query should load the media entries and their uploaders eagerly
+    (see MediaEntry.eager_query).  keyset is its (created, id) columns,
+    newest first; make_item turns a row into a feed item, see
+    media_entry_item.  If caching is enabled, answers conditional
+    requests with 304.
+    """
+    created_col, id_col = keyset
+    cache = mg_globals.cache
+    etag = key = xml = None
+    if cache is not None:
+        # No Last-Modified: only the cache generation notices edits to
+        # the media in the feed
+        _, newest_id, count = newest_in_query(query, created_col, id_col)
+        etag = make_etag('atom', cache.generation,
+                         *(tuple(etag_parts) + (newest_id, count)))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        key = cache.make_key('feed', request.url, etag)
+        xml = cache.get(key)
+
+    if xml is None:
+        rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit)
+        xml = build_atom_feed(
+            request, title, feed_id, link,
+            (make_item(row) for row in rows)).to_string()
+        if cache is not None:
+            cache.set(key, xml)
+
+    response = Response(xml, mimetype='application/atom+xml')
+    if etag:
+        set_validators(response, etag)
+    return response
@@ -16,12 +16,68 @@
 
 import urllib
 import copy
+import time
+import json
+import base64
+import datetime
 from math import ceil, floor
 from itertools import izip, count
 
+from sqlalchemy import and_, or_, desc, DateTime
+
 
 PAGINATION_DEFAULT_PER_PAGE = 30
 
+# Totals at or above COUNT_CACHE_THRESHOLD rows are remembered for
+# COUNT_CACHE_TTL seconds; smaller ones are cheap enough to count exactly.
+COUNT_CACHE_THRESHOLD = 1000
+COUNT_CACHE_TTL = 300
+COUNT_CACHE_SIZE = 1024
+
+SEEK_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_count_cache = {}
+
+
+def cached_count(query):
+    """
+    Return the number of rows in query, reusing a recent result for
+    large tables.
+
+    The figure can lag behind by up to COUNT_CACHE_TTL seconds, which is
+    fine for drawing page links.
+    """
+    query = query.order_by(None).enable_eagerloads(False)
+    statement = query.statement.compile()
+    key = (id(query.session.get_bind()), unicode(statement),
+           repr(sorted(statement.params.items())))
+
+    now = time.time()
+    cached = _count_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    total = query.count()
+    if total >= COUNT_CACHE_THRESHOLD:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            _count_cache.clear()
+        _count_cache[key] = (total, now + COUNT_CACHE_TTL)
+    return total
+
+
+class SeekPage(list):
+    """
+    The objects of a keyset paginated page.
+
+    Behaves like the query it replaces in templates: it offers count()
+    and, like a query, is true even when empty.
+    """
+    def count(self):
+        return len(self)
+
+    def __nonzero__(self):
+        return True
+
 
 class Pagination(object):
     """
@@ -29,10 +85,16 @@ class Pagination(object):
 
     Initialization through __init__(self, cursor, page=1, per_page=2),
     get actual data slice through __call__().
+
+    Passing keyset=(Model.created, Model.id) switches to keyset (seek)
+    pagination: pages are reached through the opaque next_seek/prev_seek
+    tokens instead of an OFFSET, so deep pages cost the same as the
+    first one.
     """
 
     def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
-                 jump_to_id=False):
+                 jump_to_id=False, keyset=None, seek=None, descending=True,
+                 total_count=None):
         """
         Initializes Pagination
 
@@ -42,14 +104,31 @@ class Pagination(object):
          - cursor: db cursor
          - jump_to_id: object id, sets the page to the page containing the
            object with id == jump_to_id.
+         - keyset: (sort column, unique id column) to paginate on; the
+           cursor will be ordered by these columns.
+         - seek: a next_seek/prev_seek token from a previous page
+         - descending: sort order of the keyset columns
+         - total_count: number of objects in the cursor, if it is known
+           already, to save counting them
         """
         self.page = page
         self.per_page = per_page
         self.cursor = cursor
-        self.total_count = self.cursor.count()
+        self.keyset = keyset
+        self.descending = descending
         self.active_id = None
+        self._total_count = total_count
+        self._seek = None
+        self._items = None
+        self._has_prev = self._has_next = None
 
-        if jump_to_id:
+        if keyset:
+            self.cursor = self._ordered(cursor)
+            if jump_to_id:
+                self._jump_keyset(jump_to_id)
+            elif seek:
+                self._seek = self._decode_seek(seek)
+        elif jump_to_id:
             cursor = copy.copy(self.cursor)
 
             for (doc, increment) in izip(cursor, count(0)):
@@ -63,24 +142,143 @@ class Pagination(object):
         """
         Returns slice of objects for the requested page
         """
+        if self.keyset:
+            return self._fetch()
+
         # TODO, return None for out of index so templates can
         # distinguish between empty galleries and out-of-bound pages???
         return self.cursor.slice(
             (self.page - 1) * self.per_page,
             self.page * self.per_page)
 
+    @property
+    def total_count(self):
+        if self._total_count is None:
+            self._total_count = cached_count(self.cursor)
+        return self._total_count
+
     @property
     def pages(self):
         return int(ceil(self.total_count / float(self.per_page)))
 
     @property
     def has_prev(self):
+        if self.keyset:
+            self._fetch()
+            return self._has_prev
         return self.page > 1
 
     @property
     def has_next(self):
+        if self.keyset:
+            self._fetch()
+            return self._has_next
         return self.page < self.pages
 
+    @property
+    def prev_seek(self):
+        """Token for the page before this one, None if not keyset paginated"""
+        if self.keyset and self._fetch():
+            return self._encode_seek('<', self._items[0])
+
+    @property
+    def next_seek(self):
+        """Token for the page after this one, None if not keyset paginated"""
+        if self.keyset and self._fetch():
+            return self._encode_seek('>', self._items[-1])
+
+    def _ordered(self, query, reverse=False):
+        if self.descending != reverse:
+            order = [desc(col) for col in self.keyset]
+        else:
+            order = list(self.keyset)
+        return query.order_by(None).order_by(*order)
+
+    def _seek_filter(self, values, forward=True):
+        """
+        Filter for the rows that sort after (forward) or before values
+        """
+        (major, minor), (major_value, minor_value) = self.keyset, values
+        if forward == self.descending:
+            return or_(major < major_value,
+                       and_(major == major_value, minor < minor_value))
+        return or_(major > major_value,
+                   and_(major == major_value, minor > minor_value))
+
+    def _jump_keyset(self, jump_to_id):
+        values = self.cursor.filter(self.keyset[1] == jump_to_id).\
+            enable_eagerloads(False).with_entities(*self.keyset).first()
+        if values is None:
+            return
+
+        preceding = self.cursor.filter(
+            self._seek_filter(values, forward=False)).order_by(None).\
+            enable_eagerloads(False).count()
+        self.page = 1 + preceding // self.per_page
+        self.active_id = jump_to_id
+
+    def _fetch(self):
+        if self._items is not None:
+            return self._items
+
+        if self._seek is None:
+            offset = (self.page - 1) * self.per_page
+            items = self.cursor.slice(
+                offset, offset + self.per_page + 1).all()
+            self._has_prev = self.page > 1
+            self._has_next = len(items) > self.per_page
+            items = items[:self.per_page]
+        else:
+            direction, values = self._seek
+            forward = direction == '>'
+            items = self._ordered(self.cursor, reverse=not forward).filter(
+                self._seek_filter(values, forward)).\
+                limit(self.per_page + 1).all()
+            more = len(items) > self.per_page
+            items = items[:self.per_page]
+            if forward:
+                self._has_prev, self._has_next = True, more
+            else:
+                items.reverse()
+                self._has_prev, self._has_next = more, True
+                if not more:
+                    self.page = 1
+
+        self._items = SeekPage(items)
+        return self._items
+
+    def _encode_seek(self, direction, obj):
+        values = [direction]
+        for col in self.keyset:
+            value = getattr(obj, col.key)
+            if isinstance(value, datetime.datetime):
+                value = value.strftime(SEEK_DATETIME_FORMAT)
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+    def _decode_seek(self, seek):
+        """
+        Turn a seek token back into (direction, key values), or None if
+        it has been tampered with.
+        """
+        try:
+            seek = str(seek)
+            values = json.loads(
+                base64.urlsafe_b64decode(seek + '=' * (-len(seek) % 4)))
+            direction, values = values[0], values[1:]
+            if direction not in ('<', '>') or \
+                    len(values) != len(self.keyset):
+                return None
+            for i, col in enumerate(self.keyset):
+                if isinstance(col.property.columns[0].type, DateTime):
+                    values[i] = datetime.datetime.strptime(
+                        values[i], SEEK_DATETIME_FORMAT)
+                elif not isinstance(values[i], (int, long)):
+                    return None
+        except (TypeError, ValueError, UnicodeError, IndexError):
+            return None
+        return direction, values
+
     def iter_pages(self, left_edge=2, left_current=2,
                    right_current=5, right_edge=2):
         last = 0
@@ -94,20 +292,25 @@ class Pagination(object):
                 yield num
                 last = num
 
-    def get_page_url_explicit(self, base_url, get_params, page_no):
+    def get_page_url_explicit(self, base_url, get_params, page_no, seek=None):
         """
         Get a page url by adding a page= parameter to the base url
+
+        A seek token (see next_seek/prev_seek) is added as seek= if given.
         """
         new_get_params = dict(get_params) or {}
         new_get_params['page'] = page_no
+        new_get_params.pop('seek', None)
+        if seek:
+            new_get_params['seek'] = seek
         return "%s?%s" % (
             base_url, urllib.urlencode(new_get_params))
 
-    def get_page_url(self, request, page_no):
+    def get_page_url(self, request, page_no, seek=None):
         """
         Get a new page url based of the request, and the new page number.
 
         This is a nice wrapper around get_page_url_explicit()
         """
         return self.get_page_url_explicit(
-            request.full_path, request.GET, page_no)
+            request.full_path, request.GET, page_no, seek)
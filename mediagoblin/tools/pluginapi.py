@@ -54,9 +54,13 @@ Lifecycle
 2. After all plugin modules are imported, the ``setup`` hook is called
    allowing plugins to do any set up they need to do.
 
+3. The registered hooks are compiled into the table that ``hook_handle``,
+   ``hook_runall`` and ``hook_transform`` dispatch from.
+
 """
 
 import logging
+import time
 
 from functools import wraps
 
@@ -66,6 +70,13 @@ from mediagoblin import mg_globals
 _log = logging.getLogger(__name__)
 
 
+# hook name -> tuple of callables, see PluginManager.compile_hooks
+_hook_table = None
+
+# hook name -> [calls, seconds], while hook profiling is on
+_hook_stats = None
+
+
 class PluginManager(object):
     """Manager for plugin things
 
@@ -97,6 +108,7 @@ class PluginManager(object):
         del self.routes[:]
         self.hooks.clear()
         self.template_paths.clear()
+        self.compile_hooks(reset=True)
 
     def __init__(self):
         self.__dict__ = self.__state
@@ -115,6 +127,27 @@ class PluginManager(object):
                 # list of callables.
                 self.hooks.setdefault(hook, []).append(callables)
 
+        # Compiled again on the next call of a hook
+        self.compile_hooks(reset=True)
+
+    def compile_hooks(self, reset=False):
+        """
+        Freeze the registered hooks into the table the hook_* functions
+        dispatch from, so they don't have to look them up on every call.
+
+        With reset, only throw the table away; it is compiled again when
+        a hook is called next.
+        """
+        global _hook_table
+        if reset:
+            _hook_table = None
+        else:
+            _hook_table = dict(
+                (hook, tuple(callables))
+                for hook, callables in self.hooks.items()
+                if callables)
+        return _hook_table
+
     def get_hook_callables(self, hook_name):
         return self.hooks.get(hook_name, [])
 
@@ -279,6 +312,40 @@ def get_hook_templates(hook_name):
 #############################
 
 
+def _get_callables(hook_name):
+    table = _hook_table
+    if table is None:
+        table = PluginManager().compile_hooks()
+    return table.get(hook_name, ())
+
+
+def profile_hooks(enable=True):
+    """
+    Start (or stop) counting the calls of every hook and the time spent
+    in them.  Starting again resets the counts.  See get_hook_stats.
+    """
+    global _hook_stats
+    _hook_stats = {} if enable else None
+
+
+def get_hook_stats():
+    """
+    Return a dict of hook name -> (calls, seconds spent) since
+    profile_hooks was called, or None if hook profiling is off.
+    """
+    if _hook_stats is None:
+        return None
+    return dict((hook, tuple(stats)) for hook, stats in _hook_stats.items())
+
+
+def _record_call(hook_name, start):
+    stats = _hook_stats.get(hook_name)
+    if stats is None:
+        stats = _hook_stats[hook_name] = [0, 0.0]
+    stats[0] += 1
+    stats[1] += time.time() - start
+
+
 def hook_handle(hook_name, *args, **kwargs):
     """
     Run through hooks attempting to find one that handle this hook.
@@ -300,7 +367,16 @@ def hook_handle(hook_name, *args, **kwargs):
     """
     default_handler = kwargs.pop('default_handler', None)
 
-    callables = PluginManager().get_hook_callables(hook_name)
+    callables = _get_callables(hook_name)
+
+    if _hook_stats is None:
+        if not callables:
+            # Nobody implements this hook
+            if default_handler is None:
+                return None
+            return default_handler(*args, **kwargs)
+    else:
+        start = time.time()
 
     result = None
 
@@ -313,6 +389,9 @@ def hook_handle(hook_name, *args, **kwargs):
     if result is None and default_handler is not None:
         result = default_handler(*args, **kwargs)
 
+    if _hook_stats is not None:
+        _record_call(hook_name, start)
+
     return result
 
 
@@ -332,7 +411,13 @@ def hook_runall(hook_name, *args, **kwargs):
      - You need to *do* something, and actually multiple plugins need
        to do it separately
     """
-    callables = PluginManager().get_hook_callables(hook_name)
+    callables = _get_callables(hook_name)
+
+    if _hook_stats is None:
+        if not callables:
+            return []
+    else:
+        start = time.time()
 
     results = []
 
@@ -342,6 +427,9 @@ def hook_runall(hook_name, *args, **kwargs):
         if result is not None:
             results.append(result)
 
+    if _hook_stats is not None:
+        _record_call(hook_name, start)
+
     return results
 
 
@@ -357,11 +445,20 @@ def hook_transform(hook_name, arg):
      - You have an object, say a form, but you want plugins to each be
        able to modify it.
     """
-    result = arg
+    callables = _get_callables(hook_name)
 
-    callables = PluginManager().get_hook_callables(hook_name)
+    if _hook_stats is None:
+        if not callables:
+            return arg
+    else:
+        start = time.time()
+
+    result = arg
 
     for callable in callables:
         result = callable(result)
 
+    if _hook_stats is not None:
+        _record_call(hook_name, start)
+
     return result
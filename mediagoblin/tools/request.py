@@ -26,16 +26,57 @@ form_encoded = "application/x-www-form-urlencoded"
 json_encoded = "application/json"
 
 
+class RequestLookups(object):
+    """
+    The users looked up while handling one request, available as
+    request.lookups, so setup_user_in_request, the decorators and the
+    views taking a user from the url don't query the same user again.
+
+    (The sql session already knows the objects it loaded by their id,
+    so eg. media.get_uploader doesn't query users loaded before; this
+    adds looking up users by their username.)
+    """
+    def __init__(self):
+        self._users_by_id = {}
+        self._users_by_username = {}
+
+    def add_user(self, user):
+        self._users_by_id[user.id] = user
+        self._users_by_username[user.username] = user
+        return user
+
+    def user(self, user_id):
+        """The User with user_id, or None"""
+        user = self._users_by_id.get(user_id)
+        if user is None:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.add_user(user)
+        return user
+
+    def user_by_username(self, username):
+        """The User called username, or None"""
+        user = self._users_by_username.get(username)
+        if user is None:
+            user = User.query.filter_by(username=username).first()
+            if user is not None:
+                self.add_user(user)
+        return user
+
+
 def setup_user_in_request(request):
     """
     Examine a request and tack on a request.user parameter if that's
     appropriate.
     """
+    if getattr(request, 'lookups', None) is None:
+        request.lookups = RequestLookups()
+
     if 'user_id' not in request.session:
         request.user = None
         return
 
-    request.user = User.query.get(request.session['user_id'])
+    request.user = request.lookups.user(request.session['user_id'])
 
     if not request.user:
         # Something's wrong... this user doesn't exist?  Invalidate
@@ -15,8 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import hashlib
 
 import werkzeug.utils
+from werkzeug.http import is_resource_modified, quote_etag, http_date
 from werkzeug.wrappers import Response as wz_Response
 from mediagoblin.tools.template import render_template
 from mediagoblin.tools.translate import (lazy_pass_to_ugettext as _,
@@ -91,6 +93,37 @@ def render_http_exception(request, exc, description):
                         status=exc.code)
 
 
+def make_etag(*parts):
+    """Build an ETag out of everything a page depends on"""
+    return hashlib.sha1(
+        u'\x00'.join(unicode(part) for part in parts).encode('utf-8')
+        ).hexdigest()
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Return a 304 response if the client's copy of the page is still
+    current according to the validators, None otherwise.
+
+    Call this before doing the expensive work for a page, and pass the
+    same validators to set_validators() on the response.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=last_modified):
+        return None
+    return set_validators(wz_Response(status=304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    """Attach the ETag and Last-Modified headers to response"""
+    response.headers['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
 def redirect(request, *args, **kwargs):
     """Redirects to an URL, using urlgen params or location string
 
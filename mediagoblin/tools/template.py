@@ -29,6 +29,7 @@ from mediagoblin.tools import common
 from mediagoblin.tools.translate import set_thread_locale
 from mediagoblin.tools.pluginapi import get_hook_templates, hook_transform
 from mediagoblin.tools.timesince import timesince
+from mediagoblin.tools.cache import FragmentCacheExtension
 from mediagoblin.meddleware.csrf import render_csrf_form_token
 
 
@@ -62,7 +63,8 @@ def get_jinja_env(template_loader, locale):
         undefined=jinja2.StrictUndefined,
         extensions=[
             'jinja2.ext.i18n', 'jinja2.ext.autoescape',
-            TemplateHookExtension] + local_exts)
+            TemplateHookExtension, FragmentCacheExtension] + local_exts)
+    template_env.fragment_cache_locale = locale
 
     template_env.install_gettext_callables(
         mg_globals.thread_scope.translations.ugettext,
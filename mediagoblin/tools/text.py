@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+
 import wtforms
 import markdown
 from lxml.html.clean import Cleaner
@@ -67,10 +69,12 @@ def convert_to_tag_list_of_dicts(tag_string):
         stripped_tag_string = u' '.join(tag_string.strip().split())
 
         # Split the tag string into a list of tags
+        seen = set()
         for tag in stripped_tag_string.split(','):
             tag = tag.strip()
             # Ignore empty or duplicate tags
-            if tag and tag not in [t['name'] for t in taglist]:
+            if tag and tag not in seen:
+                seen.add(tag)
                 taglist.append({'name': tag,
                                 'slug': url.slugify(tag)})
     return taglist
@@ -107,9 +111,30 @@ def tag_length_validator(form, field):
                                     ', '.join(too_long_tags)))
 
 
-# Don't use the safe mode, because lxml.html.clean is better and we are using
-# it anyway
-UNSAFE_MARKDOWN_INSTANCE = markdown.Markdown()
+_markdown = threading.local()
+
+
+def get_markdown_instance():
+    """
+    Return this thread's Markdown converter, ready for a new document.
+
+    Converters are not thread-safe and remember things like reference
+    links between documents, so every thread gets one of its own and it
+    is reset before each use.
+    """
+    instance = getattr(_markdown, 'instance', None)
+    if instance is None:
+        # Don't use the safe mode, because lxml.html.clean is better
+        # and we are using it anyway
+        instance = _markdown.instance = markdown.Markdown()
+    return instance.reset()
+
+# The html of descriptions, comments etc. is stored along with their
+# markdown.  Increase this whenever the output of
+# cleaned_markdown_conversion changes (a new markdown extension, other
+# HTML_CLEANER settings, ...): stored html of older versions is ignored
+# until "gmg rendermarkdown" has rebuilt it.
+MARKDOWN_RENDERER_VERSION = 2
 
 
 def cleaned_markdown_conversion(text):
@@ -121,4 +146,4 @@ def cleaned_markdown_conversion(text):
     if not text:
         return u''
 
-    return clean_html(UNSAFE_MARKDOWN_INSTANCE.convert(text))
+    return clean_html(get_markdown_instance().convert(text))
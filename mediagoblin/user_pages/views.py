@@ -20,23 +20,29 @@ import json
 
 from mediagoblin import messages, mg_globals
 from mediagoblin.db.models import (MediaEntry, MediaTag, Collection,
-                                   CollectionItem, User)
+                                   CollectionItem, MediaComment)
+from mediagoblin.db.util import newest_in_query
+from mediagoblin.processing import get_progress_sink
 from mediagoblin.tools.response import render_to_response, render_404, \
-    redirect, redirect_obj
+    redirect, redirect_obj, make_etag, not_modified, set_validators, \
+    json_response
 from mediagoblin.tools.text import cleaned_markdown_conversion
 from mediagoblin.tools.translate import pass_to_ugettext as _
 from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.feed import atom_feed_response, media_entry_item, \
+    collection_item_item
 from mediagoblin.user_pages import forms as user_forms
 from mediagoblin.user_pages.lib import add_media_to_collection
 from mediagoblin.notifications import trigger_notification, \
     add_comment_subscription, mark_comment_notification_seen
+from mediagoblin.meddleware.cache import cache_anonymous
+from mediagoblin.tools.cache import cache_generation
 from mediagoblin.decorators import (uses_pagination, get_user_media_entry,
     get_media_entry_by_id,
     require_active_login, user_may_delete_media, user_may_alter_collection,
     get_user_collection, get_user_collection_item, active_user_from_url)
 
-from werkzeug.contrib.atom import AtomFeed
-from werkzeug.exceptions import MethodNotAllowed
+from werkzeug.exceptions import MethodNotAllowed, Forbidden
 from werkzeug.wrappers import Response
 
 
@@ -44,13 +50,14 @@ _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 
+@cache_anonymous
 @uses_pagination
 def user_home(request, page):
     """'Homepage' of a User()"""
     # TODO: decide if we only want homepages for active users, we can
     # then use the @get_active_user decorator and also simplify the
     # template html.
-    user = User.query.filter_by(username=request.matchdict['user']).first()
+    user = request.lookups.user_by_username(request.matchdict['user'])
     if not user:
         return render_404(request)
     elif user.status != u'active':
@@ -59,11 +66,14 @@ def user_home(request, page):
             'mediagoblin/user_pages/user.html',
             {'user': user})
 
-    cursor = MediaEntry.query.\
+    cursor = MediaEntry.eager_query().\
         filter_by(uploader = user.id,
                   state = u'processed').order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    pagination = Pagination(page, cursor,
+                            keyset=(MediaEntry.created, MediaEntry.id),
+                            seek=request.GET.get('seek'),
+                            total_count=user.processed_media_count)
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -83,12 +93,13 @@ def user_home(request, page):
          'pagination': pagination})
 
 
+@cache_anonymous
 @active_user_from_url
 @uses_pagination
 def user_gallery(request, page, url_user=None):
     """'Gallery' of a User()"""
     tag = request.matchdict.get('tag', None)
-    cursor = MediaEntry.query.filter_by(
+    cursor = MediaEntry.eager_query().filter_by(
         uploader=url_user.id,
         state=u'processed').order_by(MediaEntry.created.desc())
 
@@ -98,8 +109,27 @@ def user_gallery(request, page, url_user=None):
             MediaEntry.tags_helper.any(
                 MediaTag.slug == request.matchdict['tag']))
 
-    # Paginate gallery
-    pagination = Pagination(page, cursor)
+    # Pages for logged in users show more than the gallery itself.  No
+    # Last-Modified, and no validators at all without the cache
+    # generation: nothing else notices edits to the listed media.
+    etag = None
+    generation = cache_generation()
+    if generation is not None and request.user is None \
+            and not request.session:
+        _, newest_id, count = newest_in_query(
+            cursor, MediaEntry.created, MediaEntry.id)
+        etag = make_etag('gallery', generation, newest_id, count,
+                         request.locale)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+    # Paginate gallery; only the untagged one is counted ahead of time
+    pagination = Pagination(
+        page, cursor,
+        keyset=(MediaEntry.created, MediaEntry.id),
+        seek=request.GET.get('seek'),
+        total_count=None if tag else url_user.processed_media_count)
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -107,17 +137,21 @@ def user_gallery(request, page, url_user=None):
     if media_entries == None:
         return render_404(request)
 
-    return render_to_response(
+    response = render_to_response(
         request,
         'mediagoblin/user_pages/gallery.html',
         {'user': url_user, 'tag': tag,
          'media_entries': media_entries,
          'pagination': pagination})
+    if etag:
+        set_validators(response, etag)
+    return response
 
 
 MEDIA_COMMENTS_PER_PAGE = 50
 
 
+@cache_anonymous
 @get_user_media_entry
 @uses_pagination
 def media_home(request, media, page, **kwargs):
@@ -125,20 +159,35 @@ def media_home(request, media, page, **kwargs):
     'Homepage' of a MediaEntry()
     """
     comment_id = request.matchdict.get('comment', None)
-    if comment_id:
-        if request.user:
-            mark_comment_notification_seen(comment_id, request.user)
-
-        pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE,
-            comment_id)
-    else:
-        pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE)
+    if comment_id and request.user:
+        mark_comment_notification_seen(comment_id, request.user)
+
+    # Pages for logged in users show more than the media itself.  No
+    # Last-Modified: no column keeps track of edits to the media.
+    etag = None
+    if request.user is None and not request.session:
+        newest_comment, newest_comment_id, comment_count = newest_in_query(
+            media.all_comments, MediaComment.created, MediaComment.id)
+        # The links to (and thumbnail of) the neighbours
+        siblings = [sibling and (sibling.id, sibling.slug, sibling.file_path)
+                    for sibling in media.siblings]
+        etag = make_etag(
+            'media', media.id, media.title, media.description,
+            media.license, media.collected, sorted(media.media_files.items()),
+            [tag['slug'] for tag in media.tags], siblings,
+            newest_comment_id, comment_count, request.locale)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+    ascending = mg_globals.app_config['comments_ascending']
+    pagination = Pagination(
+        page, media.get_comments(ascending),
+        MEDIA_COMMENTS_PER_PAGE,
+        comment_id,
+        keyset=(MediaComment.created, MediaComment.id),
+        seek=request.GET.get('seek'),
+        descending=not ascending)
 
     comments = pagination()
 
@@ -146,7 +195,7 @@ def media_home(request, media, page, **kwargs):
 
     media_template_name = media.media_manager.display_template
 
-    return render_to_response(
+    response = render_to_response(
         request,
         media_template_name,
         {'media': media,
@@ -154,6 +203,9 @@ def media_home(request, media, page, **kwargs):
          'pagination': pagination,
          'comment_form': comment_form,
          'app_config': mg_globals.app_config})
+    if etag:
+        set_validators(response, etag)
+    return response
 
 
 @get_media_entry_by_id
@@ -346,6 +398,7 @@ def media_confirm_delete(request):
          'form': form})
 
 
+@cache_anonymous
 @active_user_from_url
 @uses_pagination
 def user_collection(request, page, url_user=None):
@@ -357,9 +410,12 @@ def user_collection(request, page, url_user=None):
     if not collection:
         return render_404(request)
 
-    cursor = collection.get_collection_items()
+    cursor = CollectionItem.eager_query(collection.get_collection_items())
 
-    pagination = Pagination(page, cursor)
+    pagination = Pagination(page, cursor,
+                            keyset=(CollectionItem.added, CollectionItem.id),
+                            seek=request.GET.get('seek'),
+                            total_count=collection.items)
     collection_items = pagination()
 
     # if no data is available, return NotFound
@@ -406,8 +462,6 @@ def collection_item_confirm_remove(request, collection_item):
             entry.save()
 
             collection_item.delete()
-            collection.items = collection.items - 1
-            collection.save()
 
             messages.add_message(
                 request, messages.SUCCESS, _('You deleted the item from the collection.'))
@@ -480,80 +534,42 @@ def collection_confirm_delete(request, collection):
          'form': form})
 
 
-ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
-
-
+@cache_anonymous
 def atom_feed(request):
     """
     generates the atom feed with the newest images
     """
-    user = User.query.filter_by(
-        username = request.matchdict['user'],
-        status = u'active').first()
-    if not user:
+    user = request.lookups.user_by_username(request.matchdict['user'])
+    if not user or user.status != u'active':
         return render_404(request)
 
-    cursor = MediaEntry.query.filter_by(
+    cursor = MediaEntry.eager_query().filter_by(
         uploader = user.id,
-        state = u'processed').\
-        order_by(MediaEntry.created.desc()).\
-        limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+        state = u'processed')
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
     """
-    atomlinks = [{
-           'href': request.urlgen(
-               'mediagoblin.user_pages.user_home',
-               qualified=True, user=request.matchdict['user']),
-           'rel': 'alternate',
-           'type': 'text/html'
-           }]
-
-    if mg_globals.app_config["push_urls"]:
-        for push_url in mg_globals.app_config["push_urls"]:
-            atomlinks.append({
-                'rel': 'hub',
-                'href': push_url})
-
-    feed = AtomFeed(
-               "MediaGoblin: Feed for user '%s'" % request.matchdict['user'],
-               feed_url=request.url,
-               id='tag:{host},{year}:gallery.user-{user}'.format(
-                   host=request.host,
-                   year=datetime.datetime.today().strftime('%Y'),
-                   user=request.matchdict['user']),
-               links=atomlinks)
-
-    for entry in cursor:
-        feed.add(entry.get('title'),
-            entry.description_html,
-            id=entry.url_for_self(request.urlgen, qualified=True),
-            content_type='html',
-            author={
-                'name': entry.get_uploader.username,
-                'uri': request.urlgen(
-                    'mediagoblin.user_pages.user_home',
-                    qualified=True, user=entry.get_uploader.username)},
-            updated=entry.get('created'),
-            links=[{
-                'href': entry.url_for_self(
-                    request.urlgen,
-                    qualified=True),
-                'rel': 'alternate',
-                'type': 'text/html'}])
-
-    return feed.get_response()
-
-
+    return atom_feed_response(
+        request, cursor, (MediaEntry.created, MediaEntry.id),
+        media_entry_item,
+        "MediaGoblin: Feed for user '%s'" % request.matchdict['user'],
+        feed_id='tag:{host},{year}:gallery.user-{user}'.format(
+            host=request.host,
+            year=datetime.datetime.today().strftime('%Y'),
+            user=request.matchdict['user']),
+        link=request.urlgen(
+            'mediagoblin.user_pages.user_home',
+            qualified=True, user=request.matchdict['user']))
+
+
+@cache_anonymous
 def collection_atom_feed(request):
     """
     generates the atom feed with the newest images from a collection
     """
-    user = User.query.filter_by(
-        username = request.matchdict['user'],
-        status = u'active').first()
-    if not user:
+    user = request.lookups.user_by_username(request.matchdict['user'])
+    if not user or user.status != u'active':
         return render_404(request)
 
     collection = Collection.query.filter_by(
@@ -562,58 +578,38 @@ def collection_atom_feed(request):
     if not collection:
         return render_404(request)
 
-    cursor = CollectionItem.query.filter_by(
-                 collection=collection.id) \
-                 .order_by(CollectionItem.added.desc()) \
-                 .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = CollectionItem.eager_query().filter_by(
+                 collection=collection.id)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
     """
-    atomlinks = [{
-           'href': collection.url_for_self(request.urlgen, qualified=True),
-           'rel': 'alternate',
-           'type': 'text/html'
-           }]
-
-    if mg_globals.app_config["push_urls"]:
-        for push_url in mg_globals.app_config["push_urls"]:
-            atomlinks.append({
-                'rel': 'hub',
-                'href': push_url})
-
-    feed = AtomFeed(
-                "MediaGoblin: Feed for %s's collection %s" %
-                (request.matchdict['user'], collection.title),
-                feed_url=request.url,
-                id=u'tag:{host},{year}:gnu-mediagoblin.{user}.collection.{slug}'\
-                    .format(
-                    host=request.host,
-                    year=collection.created.strftime('%Y'),
-                    user=request.matchdict['user'],
-                    slug=collection.slug),
-                links=atomlinks)
-
-    for item in cursor:
-        entry = item.get_media_entry
-        feed.add(entry.get('title'),
-            item.note_html,
-            id=entry.url_for_self(request.urlgen, qualified=True),
-            content_type='html',
-            author={
-                'name': entry.get_uploader.username,
-                'uri': request.urlgen(
-                    'mediagoblin.user_pages.user_home',
-                    qualified=True, user=entry.get_uploader.username)},
-            updated=item.get('added'),
-            links=[{
-                'href': entry.url_for_self(
-                    request.urlgen,
-                    qualified=True),
-                'rel': 'alternate',
-                'type': 'text/html'}])
-
-    return feed.get_response()
+    return atom_feed_response(
+        request, cursor, (CollectionItem.added, CollectionItem.id),
+        collection_item_item,
+        "MediaGoblin: Feed for %s's collection %s" %
+        (request.matchdict['user'], collection.title),
+        feed_id=u'tag:{host},{year}:gnu-mediagoblin.{user}.collection.{slug}'\
+            .format(
+            host=request.host,
+            year=collection.created.strftime('%Y'),
+            user=request.matchdict['user'],
+            slug=collection.slug),
+        link=collection.url_for_self(request.urlgen, qualified=True),
+        etag_parts=(collection.title,))
+
+
+def _panel_user(request):
+    """
+    The user whose processing panel is requested, or None if the
+    current user may not see it.
+    """
+    user = request.lookups.user_by_username(request.matchdict['user'])
+    # Only admins and this user herself should be able to see the panel.
+    if user is None or not (user.id == request.user.id
+                            or request.user.is_admin):
+        return None
+    return user
 
 
 @require_active_login
@@ -622,22 +618,18 @@ def processing_panel(request):
     Show to the user what media is still in conversion/processing...
     and what failed, and why!
     """
-    user = User.query.filter_by(username=request.matchdict['user']).first()
-    # TODO: XXX: Should this be a decorator?
-    #
-    # Make sure we have permission to access this user's panel.  Only
-    # admins and this user herself should be able to do so.
-    if not (user.id == request.user.id or request.user.is_admin):
+    user = _panel_user(request)
+    if user is None:
         # No?  Simply redirect to this user's homepage.
         return redirect(
             request, 'mediagoblin.user_pages.user_home',
-            user=user.username)
+            user=request.matchdict['user'])
 
     # Get media entries which are in-processing
     processing_entries = MediaEntry.query.\
         filter_by(uploader = user.id,
                   state = u'processing').\
-        order_by(MediaEntry.created.desc())
+        order_by(MediaEntry.created.desc()).all()
 
     # Get media entries which have failed to process
     failed_entries = MediaEntry.query.\
@@ -657,5 +649,23 @@ def processing_panel(request):
         'mediagoblin/user_pages/processing_panel.html',
         {'user': user,
          'processing_entries': processing_entries,
+         'progress': get_progress_sink().get(
+             [entry.id for entry in processing_entries]),
          'failed_entries': failed_entries,
          'processed_entries': processed_entries})
+
+
+@require_active_login
+def processing_progress(request):
+    """
+    The progress of the media of a user that is being processed, as
+    JSON: {"<media id>": <percent or null>, ...}
+    """
+    user = _panel_user(request)
+    if user is None:
+        raise Forbidden()
+
+    entry_ids = [entry_id for (entry_id,) in MediaEntry.query.filter_by(
+        uploader=user.id, state=u'processing').with_entities(MediaEntry.id)]
+    return json_response(get_progress_sink().get(entry_ids),
+                         _disable_cors=True)
@@ -15,25 +15,30 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from mediagoblin import mg_globals
-from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.models import MediaEntry, Tag
 from mediagoblin.tools.pagination import Pagination
 from mediagoblin.tools.response import render_to_response
 from mediagoblin.decorators import uses_pagination
+from mediagoblin.meddleware.cache import cache_anonymous
 
 
 
+@cache_anonymous
 @uses_pagination
 def root_view(request, page):
-    cursor = MediaEntry.query.filter_by(state=u'processed').\
+    cursor = MediaEntry.eager_query().filter_by(state=u'processed').\
         order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    pagination = Pagination(page, cursor,
+                            keyset=(MediaEntry.created, MediaEntry.id),
+                            seek=request.GET.get('seek'))
     media_entries = pagination()
     return render_to_response(
         request, 'mediagoblin/root.html',
         {'media_entries': media_entries,
          'allow_registration': mg_globals.app_config["allow_registration"],
-         'pagination': pagination})
+         'pagination': pagination,
+         'popular_tags': Tag.popular()})
 
 
 def simple_template_render(request):